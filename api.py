@@ -0,0 +1,130 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+from datetime import date
+
+from flask import Blueprint, Response, current_app, request, stream_with_context
+
+from cache import conditional
+from models import Venue, Artist, Show
+from queries import (
+  stream_venue_areas, venue_detail, stream_artists, artist_detail,
+  search_with_upcoming_counts, show_listing_query, show_tile,
+  venues_stamp, venue_stamp, artists_stamp, artist_search_stamp, artist_stamp, shows_stamp
+)
+
+#----------------------------------------------------------------------------#
+# JSON API, version 1.
+#----------------------------------------------------------------------------#
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+def json_default(value):
+  if isinstance(value, date):
+    return value.isoformat()
+  raise TypeError('{!r} is not JSON serializable'.format(value))
+
+def to_json(data):
+  return json.dumps(data, default=json_default, separators=(',', ':'))
+
+def json_response(data):
+  # small payloads are built in memory; ETags come from the page stamps
+  return Response(to_json(data), mimetype='application/json')
+
+def batches(items, separator):
+  # one chunk per API_STREAM_BATCH_SIZE items rather than one tiny write
+  # per item
+  batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+  batch = []
+  for item in items:
+    batch.append(to_json(item))
+    if len(batch) == batch_size:
+      yield separator.join(batch)
+      batch = []
+  if batch:
+    yield separator.join(batch)
+
+def stream_json(name, items):
+  # {"<name>": [...items]}, written out as the items come in
+  def generate():
+    yield '{{"{}":['.format(name)
+    first = True
+    for chunk in batches(items, ','):
+      yield chunk if first else ',' + chunk
+      first = False
+    yield ']}'
+
+  return Response(stream_with_context(generate()), mimetype='application/json')
+
+def wants_ndjson():
+  if request.args.get('format') == 'ndjson':
+    return True
+  return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+#  Venues
+#  ----------------------------------------------------------------
+
+@api.route('/venues')
+@conditional(venues_stamp)
+def venues():
+  # read from a server-side cursor and streamed, like /shows
+  return stream_json('areas', stream_venue_areas())
+
+@api.route('/venues/search')
+@conditional(venues_stamp)
+def search_venues():
+  return json_response(search_with_upcoming_counts(Venue, Show.venue_id, request.args.get('search_term', '')))
+
+@api.route('/venues/<int:venue_id>')
+@conditional(venue_stamp)
+def show_venue(venue_id):
+  return json_response(venue_detail(venue_id))
+
+#  Artists
+#  ----------------------------------------------------------------
+
+@api.route('/artists')
+@conditional(artists_stamp)
+def artists():
+  return stream_json('artists', stream_artists())
+
+@api.route('/artists/search')
+@conditional(artist_search_stamp)
+def search_artists():
+  return json_response(search_with_upcoming_counts(Artist, Show.artist_id, request.args.get('search_term', '')))
+
+@api.route('/artists/<int:artist_id>')
+@conditional(artist_stamp)
+def show_artist(artist_id):
+  return json_response(artist_detail(artist_id))
+
+#  Shows
+#  ----------------------------------------------------------------
+
+def feed_stamp():
+  # JSON and NDJSON are two representations of the same URL
+  return shows_stamp() + (wants_ndjson(),)
+
+@api.route('/shows')
+@conditional(feed_stamp)
+def shows():
+  # every show, streamed from a server-side cursor so memory stays flat
+  # however many shows there are. JSON by default, NDJSON on request.
+  ndjson = wants_ndjson()
+  rows = show_listing_query()\
+    .order_by(Show.start_time, Show.id)\
+    .yield_per(current_app.config['API_STREAM_BATCH_SIZE'])
+  tiles = (show_tile(row) for row in rows)
+
+  def generate_ndjson():
+    for chunk in batches(tiles, '\n'):
+      yield chunk + '\n'
+
+  if ndjson:
+    response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+  else:
+    response = stream_json('shows', tiles)
+  response.vary.add('Accept')
+  return response
@@ -2,32 +2,95 @@
 # Imports
 #----------------------------------------------------------------------------#
 
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 import dateutil.parser
 import babel
-from flask import render_template, request, flash, redirect, url_for, abort
-from sqlalchemy import func
+import babel.dates
+from flask import render_template, request, flash, redirect, url_for, abort, jsonify, Response, stream_with_context
+import os
 import sys
+import json
 import logging
-from logging import Formatter, FileHandler
+from logging import Formatter, FileHandler, StreamHandler
+from flask.logging import default_handler
 from flask_wtf import Form
 from forms import *
 from models import *
+from cache import conditional
+from db_pool import pool_metrics
+from queries import *
+from api import api
+import bulk_import
+import export
+import counters
+import synthetic
+from autocomplete import autocomplete, autocomplete_index
+from writes import write, WriteError, Invalid
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+@lru_cache(maxsize=32)
+def datetime_formatter(pattern, locale):
+  # parsing the pattern and the locale is most of babel's per-call cost,
+  # so do it once per pattern/locale pair
+  pattern = babel.dates.parse_pattern(pattern)
+  locale = babel.Locale.parse(locale)
+  return lambda date: pattern.apply(date, locale)
+
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+  if not isinstance(value, datetime):
+    value = dateutil.parser.parse(value)
+  if value.tzinfo is None:
+    value = value.replace(tzinfo=timezone.utc)
+  return datetime_formatter(DATETIME_FORMATS.get(format, format), 'en')(value)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Streamed pages.
+#----------------------------------------------------------------------------#
+
+# rendered pieces sent together, so the page does not go out a few bytes
+# per write
+STREAM_BUFFER_SIZE = 100
+
+def stream_page(template_name, **context):
+  # like render_template, but the page is sent while it renders, so long
+  # listings are never held in memory in full. The context iterables are
+  # read lazily by the template, inside the request context.
+  app.update_template_context(context)
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  stream.enable_buffering(STREAM_BUFFER_SIZE)
+  return Response(stream_with_context(stream), mimetype='text/html')
+
+#----------------------------------------------------------------------------#
+# Writes.
+#----------------------------------------------------------------------------#
+
+def form_write(work):
+  # one form submission as one transaction (writes.py); submitting the
+  # same rendered form twice writes once
+  return write(work, request.form.get('idempotency_key'), request.endpoint)
+
+def write_failed(error, message):
+  # the user gets what went wrong, the log the structured error with the
+  # database's message; clients asking for JSON get the structured error
+  # without it
+  app.logger.warning(json.dumps(dict(error.to_dict(), detail=error.detail, event='write_failed',
+                                     endpoint=request.endpoint)))
+  if request.accept_mimetypes.best == 'application/json':
+    return jsonify(error.to_dict()), error.status
+  flash('{} {}'.format(message, error.message))
+  return render_template('pages/home.html'), error.status
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -40,102 +103,25 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@conditional(venues_stamp)
+@page_cache.cached(Venue, Show)
 def venues():
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data = []
-  for loc in Venue.query.distinct(Venue.city, Venue.state):
-    location = {}
-    location['city'] = loc.city
-    location['state'] = loc.state
-    location_venues = []
-    for location_venue in Venue.query.filter_by(city = location['city'], state = location['state']).all():
-      venue = {}
-      ven_id = location_venue.id
-      venue['id'] = ven_id
-      venue['name'] = location_venue.name
-      # get number of upcoming events
-      time = datetime.now()
-      num_upcoming_shows = 0
-      for show in Show.query.filter_by(venue_id=ven_id).all():
-        if show.start_time > time:
-          num_upcoming_shows += 1
-      venue['num_upcoming_shows'] = num_upcoming_shows
-      location_venues.append(venue)
-    location['venues'] = location_venues
-    data.append(location)
-
-  return render_template('pages/venues.html', areas=data)
+  return stream_page('pages/venues.html', areas=stream_venue_areas())
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+  # case-insensitive partial string search on the venue name
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  search_term = request.form['search_term'].lower()
-  search = "%{}%".format(search_term)
-  venues = Venue.query.filter(func.lower(Venue.name).like(search)).all()
-  data = []
-  for venue in venues:
-    appendData = {}
-    appendData['id'] = venue.id
-    appendData['name'] = venue.name
-    numUpcoming = 0
-    for show in Show.query.filter_by(venue_id = venue.id).all():
-      if show.start_time > datetime.now():
-        numUpcoming += 1
-    appendData['num_upcoming_shows'] = numUpcoming
-    data.append(appendData)
-
-  response={
-    "count": len(venues),
-    "data": data
-  }
-
+  response = search_with_upcoming_counts(Venue, Show.venue_id, request.form['search_term'])
   return render_template('pages/search_venues.html', results=response, search_term=request.form['search_term'])
 
 @app.route('/venues/<int:venue_id>')
+@conditional(venue_stamp)
+@page_cache.cached(Venue, Show, Artist)
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-  
-  venue = Venue.query.filter_by(id = venue_id).first()
-
-  upcoming_shows = []
-  past_shows = []
-  interestingShows = db.session.query(Show).filter(Show.venue_id == venue_id)\
-    .join(Artist, Show.artist_id == Artist.id).all()
-  for show in interestingShows:
-    appendData = {
-      'artist_id': show.artist.id,
-      'artist_name': show.artist.name,
-      'artist_image_link': show.artist.image_link,
-      'start_time': str(show.start_time)
-    }
-    if show.start_time > datetime.now():
-      upcoming_shows.append(appendData)
-    else:
-      past_shows.append(appendData)
-
-  data = {}
-  data['id'] = venue.id
-  data['name'] = venue.name
-  data['genres'] = str(venue.genres).replace('{', '').replace('}', '').split(",")
-  data['address'] = venue.address
-  data['city'] = venue.city
-  data['state'] = venue.state
-  data['phone'] = venue.phone
-  data['website'] = venue.website_link
-  data['facebook_link'] = venue.facebook_link
-  data['seeking_talent'] = venue.seeking_talent
-  data['seeking_description'] = venue.seeking_description
-  data['image_link'] = venue.image_link
-  data['past_shows'] = past_shows
-  data['upcoming_shows'] = upcoming_shows
-  data['past_shows_count'] = len(past_shows)
-  data['upcoming_shows_count'] = len(upcoming_shows)
-
-  return render_template('pages/show_venue.html', venue=data)
+  return render_template('pages/show_venue.html', venue=venue_detail(venue_id))
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -154,8 +140,8 @@ def create_venue_submission():
   # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   
-  try:
-    venueObj = Venue(
+  def create(batch):
+    batch.create(Venue,
       name = request.form['name'],
       city = request.form['city'],
       state = request.form['state'],
@@ -168,30 +154,24 @@ def create_venue_submission():
       seeking_talent = ('seeking_talent' in request.form),
       seeking_description = request.form['seeking_description']
     )
-    
-    Venue.create(venueObj)
-    flash('Venue ' + request.form['name'] + ' was successfully listed!')
-  except:
-    db.session.rollback()
-    flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
-  finally:
-    db.session.close()
-  
+
+  try:
+    form_write(create)
+  except WriteError as error:
+    return write_failed(error, 'An error occurred. Venue ' + request.form['name'] + ' could not be listed.')
+  flash('Venue ' + request.form['name'] + ' was successfully listed!')
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+  # the venue's shows are deleted with it, in the same transaction
   try:
-    venue = Venue.query.filter(Venue.id == venue_id).all()
-    Venue.delete(venue)
-    flash('Venue ' + venue_id + ' was successfully deleted from database.')
-  except:
-    db.session.rollback()
-    flash('ERROR: Venue ' + venue_id + ' could not be deleted form database.')
-  finally:
-    db.session.close()
+    form_write(lambda batch: batch.delete(Venue, venue_id))
+  except WriteError as error:
+    return write_failed(error, 'ERROR: Venue {} could not be deleted form database.'.format(venue_id))
+  flash('Venue {} was successfully deleted from database.'.format(venue_id))
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
   return redirect(url_for('venues'))
@@ -199,81 +179,25 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional(artists_stamp)
+@page_cache.cached(Artist)
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data = []
-  for artist in Artist.query.order_by('id').all():
-    append = {}
-    append['id'] = artist.id
-    append['name'] = artist.name
-    data.append(append)
-  
-  return render_template('pages/artists.html', artists=data)
+  return stream_page('pages/artists.html', artists=stream_artists())
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
+  # case-insensitive partial string search on the artist name
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-
-  search_term = request.form['search_term'].lower()
-  search = "%{}%".format(search_term)
-  artists = Artist.query.filter(func.lower(Artist.name).like(search)).all()
-  data = []
-  for artist in artists:
-    appendData = {}
-    appendData['id'] = artist.id
-    appendData['name'] = artist.name
-    numUpcoming = Show.query.filter(Show.artist_id == artist.id).filter(Show.start_time > datetime.now()).count()
-    appendData['num_upcoming_shows'] = numUpcoming
-    data.append(appendData)
-
-  response={
-    "count": len(artists),
-    "data": data
-  }
+  response = search_with_upcoming_counts(Artist, Show.artist_id, request.form.get('search_term', ''))
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/artists/<int:artist_id>')
+@conditional(artist_stamp)
+@page_cache.cached(Artist, Show, Venue)
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  # TODO: replace with real artist data from the artist table, using artist_id
-
-  showData = db.session.query(Show).filter(Show.artist_id == artist_id)\
-    .join(Venue, Show.venue_id == Venue.id).all()
-  past_shows = []
-  upcoming_shows = []
-
-  for show in showData:
-    appendData = {}
-    appendData['venue_id'] = show.venue.id
-    appendData['venue_name'] = show.venue.name
-    appendData['venue_image_link'] = show.venue.image_link
-    appendData['start_time'] = str(show.start_time)
-    if show.start_time > datetime.now():
-      upcoming_shows.append(appendData)
-    else:
-      past_shows.append(appendData)
-
-  data = {}
-  artist = Artist.query.filter_by(id = artist_id).first()
-  data['id'] = artist.id
-  data['name'] = artist.name
-  data['genres'] = str(artist.genres).replace('{', '').replace('}', '').split(",")
-  data['city'] = artist.city
-  data['state'] = artist.state
-  data['phone'] = artist.phone
-  data['website'] = artist.website_link
-  data['facebook_link'] = artist.facebook_link
-  data['seeking_venue'] = artist.seeking_venue
-  data['seeking_description'] = artist.seeking_description
-  data['image_link'] = artist.image_link
-  data['past_shows'] = past_shows
-  data['upcoming_shows'] = upcoming_shows
-  data['past_shows_count'] = len(past_shows)
-  data['upcoming_shows_count'] = len(upcoming_shows)
-  
-  return render_template('pages/show_artist.html', artist=data)
+  return render_template('pages/show_artist.html', artist=artist_detail(artist_id))
 
 #  Update
 #  ----------------------------------------------------------------
@@ -289,26 +213,25 @@ def edit_artist_submission(artist_id):
   # TODO: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
 
+  def update(batch):
+    batch.update(Artist, artist_id, request.form.get('version', type=int),
+      name = request.form['name'],
+      city = request.form['city'],
+      state = request.form['state'],
+      phone = request.form['phone'],
+      genres = request.form.getlist('genres'),
+      facebook_link = request.form['facebook_link'],
+      image_link = request.form['image_link'],
+      website_link = request.form['website_link'],
+      seeking_venue = ('seeking_venue' in request.form),
+      seeking_description = request.form['seeking_description']
+    )
+
   try:
-    artist = Artist.query.get(artist_id)
-    artist.name = request.form['name']
-    artist.city = request.form['city']
-    artist.state = request.form['state']
-    artist.phone = request.form['phone']
-    artist.genres = request.form.getlist('genres')
-    artist.facebook_link = request.form['facebook_link']
-    artist.image_link = request.form['image_link']
-    artist.website_link = request.form['website_link']
-    artist.seeking_venue = ('seeking_venue' in request.form)
-    artist.seeking_description = request.form['seeking_description']
-
-    db.session.commit()
-    flash('Artist ' + request.form['name'] + ' was successfully updated! ')
-  except:
-    db.session.rollback()
-    print(sys.exc_info())
-  finally:
-    db.session.close()
+    form_write(update)
+  except WriteError as error:
+    return write_failed(error, 'ERROR: There was an error while trying to update Artist ' + request.form['name'] + '.')
+  flash('Artist ' + request.form['name'] + ' was successfully updated! ')
 
   return render_template('pages/home.html')
   # return redirect(url_for('show_artist', artist_id=artist_id))
@@ -325,27 +248,25 @@ def edit_venue_submission(venue_id):
   # TODO: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
 
+  def update(batch):
+    batch.update(Venue, venue_id, request.form.get('version', type=int),
+      name = request.form['name'],
+      city = request.form['city'],
+      state = request.form['state'],
+      phone = request.form['phone'],
+      genres = request.form.getlist('genres'),
+      facebook_link = request.form['facebook_link'],
+      image_link = request.form['image_link'],
+      website_link = request.form['website_link'],
+      seeking_talent = ('seeking_talent' in request.form),
+      seeking_description = request.form['seeking_description']
+    )
+
   try:
-    venue = Venue.query.get(venue_id)
-    venue.name = request.form['name']
-    venue.city = request.form['city']
-    venue.state = request.form['state']
-    venue.phone = request.form['phone']
-    venue.genres = request.form.getlist('genres')
-    venue.facebook_link = request.form['facebook_link']
-    venue.image_link = request.form['image_link']
-    venue.website_link = request.form['website_link']
-    venue.seeking_talent = ('seeking_talent' in request.form)
-    venue.seeking_description = request.form['seeking_description']
-
-    db.session.commit()
-    flash('Venue ' + request.form['name'] + ' was successfully updated! ')
-  except:
-    db.session.rollback()
-    flash('ERROR: There was an error while trying to update Venue ' + request.form['name'])
-    print(sys.exc_info())
-  finally:
-    db.session.close()
+    form_write(update)
+  except WriteError as error:
+    return write_failed(error, 'ERROR: There was an error while trying to update Venue ' + request.form['name'] + '.')
+  flash('Venue ' + request.form['name'] + ' was successfully updated! ')
 
   return render_template('pages/home.html')
   # return redirect(url_for('show_venue', venue_id=venue_id))
@@ -367,8 +288,8 @@ def create_artist_submission():
   # TODO: on unsuccessful db insert, flash an error instead.
   # e.g., flash('An error occurred. Artist ' + data.name + ' could not be listed.')
 
-  try:
-    artistObj = Artist(
+  def create(batch):
+    batch.create(Artist,
       name = request.form['name'],
       city = request.form['city'],
       state = request.form['state'],
@@ -380,14 +301,12 @@ def create_artist_submission():
       seeking_venue = ('seeking_venue' in request.form),
       seeking_description = request.form['seeking_description']
     )
-    
-    Artist.create(artistObj)
-    flash('Artist ' + request.form['name'] + ' was successfully listed!')
-  except:
-    db.session.rollback()
-    flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
-  finally:
-    db.session.close()
+
+  try:
+    form_write(create)
+  except WriteError as error:
+    return write_failed(error, 'An error occurred. Artist ' + request.form['name'] + ' could not be listed.')
+  flash('Artist ' + request.form['name'] + ' was successfully listed!')
 
   return render_template('pages/home.html')
 
@@ -395,24 +314,11 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@conditional(shows_stamp)
+@page_cache.cached(Show, Venue, Artist)
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-
-  data = []
-  shows = Show.query.all()
-  for show in shows:
-    append = {}
-    append['venue_id'] = show.venue_id
-    append['venue_name'] = Venue.query.get(show.venue_id).name
-    append['artist_id'] = show.artist_id
-    append['artist_name'] = Artist.query.get(show.artist_id).name
-    append['artist_image_link'] = Artist.query.get(show.artist_id).image_link
-    append['start_time'] = str(show.start_time)
-    data.append(append)
-  
-  return render_template('pages/shows.html', shows=data)
+  # displays list of shows at /shows, one page at a time
+  return stream_page('pages/shows.html', shows=ShowPage())
 
 @app.route('/shows/create')
 def create_shows():
@@ -429,23 +335,65 @@ def create_show_submission():
   # e.g., flash('An error occurred. Show could not be listed.')
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
 
+  def create(batch):
+    errors = {}
+    values = {}
+    for field in ('artist_id', 'venue_id'):
+      try:
+        values[field] = int(request.form[field])
+      except ValueError:
+        errors[field] = ['Not a valid id.']
+    try:
+      values['start_time'] = dateutil.parser.parse(request.form['start_time'])
+    except (ValueError, OverflowError):
+      errors['start_time'] = ['Not a valid date and time.']
+    if errors:
+      raise Invalid('The artist ID, venue ID or start time is not valid.', fields=errors)
+    batch.create(Show, **values)
+
   try:
-    showObj = Show(
-      artist_id = request.form['artist_id'],
-      venue_id = request.form['venue_id'],
-      start_time = request.form['start_time']
-    )
-    
-    Show.create(showObj)
-    flash('Show was successfully listed!')
-  except:
-    db.session.rollback()
-    flash('An error occurred. Show could not be listed. Most likely either your artist_id or venue_id could not be found in database.')
-  finally:
-    db.session.close()
+    form_write(create)
+  except WriteError as error:
+    return write_failed(error, 'An error occurred. Show could not be listed. Most likely either your artist_id or venue_id could not be found in database.')
+  flash('Show was successfully listed!')
 
   return render_template('pages/home.html')
 
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@app.route('/autocomplete')
+def autocomplete_names():
+  # typeahead for the search boxes: ?q=<prefix>&kind=venue|artist
+  kinds = request.args.getlist('kind') or ['venue', 'artist']
+  limit = request.args.get('limit', 10, type=int)
+  limit = max(1, min(limit, app.config['AUTOCOMPLETE_MAX_RESULTS']))
+  return jsonify(autocomplete(request.args.get('q', ''), kinds, limit))
+
+#  JSON API
+#  ----------------------------------------------------------------
+
+app.register_blueprint(api)
+
+#  Commands
+#  ----------------------------------------------------------------
+
+app.cli.add_command(bulk_import.import_command)
+app.cli.add_command(export.export_command)
+app.cli.add_command(counters.counters_cli)
+app.cli.add_command(synthetic.synthetic_command)
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/metrics/pool')
+def pool_metrics_view():
+  # connection pool usage of this worker, for sizing workers against the
+  # database's connection limit
+  if not app.config['POOL_METRICS_ENABLED']:
+    abort(404)
+  return jsonify(pool_metrics.snapshot(db.engine.pool))
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -455,26 +403,34 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
+    if app.config.get('LOG_FILE'):
+        log_handler = FileHandler(app.config['LOG_FILE'])
+    else:
+        # replaces Flask's own stderr handler rather than doubling every line
+        app.logger.removeHandler(default_handler)
+        log_handler = StreamHandler(sys.stderr)
+    log_handler.setFormatter(
         Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
     )
     app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    log_handler.setLevel(logging.INFO)
+    app.logger.addHandler(log_handler)
     app.logger.info('errors')
 
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
-# Default port:
-if __name__ == '__main__':
-    app.run(debug=True)
+def check_secret_key():
+    # sessions and flash messages signed by one worker must be readable by
+    # the others, so a non-debug server never runs on a made-up key
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError('Set SECRET_KEY: every worker must sign sessions with the same key.')
 
-# Or specify port manually:
-'''
+# Development server; FLASK_DEBUG=1 turns on the debugger and reloading.
+# Production runs gunicorn with wsgi.py and gunicorn.conf.py instead.
 if __name__ == '__main__':
+    check_secret_key()
+    autocomplete_index.build_in_background()
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
-'''
+    app.run(host=os.environ.get('HOST', '127.0.0.1'), port=port)
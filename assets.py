@@ -0,0 +1,241 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+
+#----------------------------------------------------------------------------#
+# Build.
+#----------------------------------------------------------------------------#
+
+# bundle -> files under static/ it is made of, in load order
+BUNDLES = {
+    'css/fyyur.css': [
+        'css/bootstrap.min.css',
+        'css/layout.main.css',
+        'css/main.css',
+        'css/main.responsive.css',
+        'css/main.quickfix.css'
+    ],
+    # loaded in <head>, blocking
+    'js/head.js': [
+        'js/libs/modernizr-2.8.2.min.js',
+        'js/libs/moment.min.js'
+    ],
+    # loaded with defer, after jQuery
+    'js/fyyur.js': [
+        'js/script.js',
+        'js/libs/bootstrap-3.1.1.min.js',
+        'js/plugins.js'
+    ]
+}
+
+# worth compressing ahead of time; images and woff fonts are compressed already
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.ttf', '.otf', '.eot', '.txt')
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+SOURCE_MAP = re.compile(r'^\s*//[#@] sourceMappingURL=.*$', re.M)
+
+def fingerprinted(path, content):
+    # main.css -> main.1f2e3d4c5b6a.css
+    base, ext = posixpath.splitext(path)
+    return '{}.{}{}'.format(base, hashlib.sha256(content).hexdigest()[:12], ext)
+
+def rewrite_css_urls(css, source, target, manifest):
+    '''Points the url()s of a stylesheet at their fingerprinted copies.
+
+    url()s are relative to the file they appear in (`source`); they are
+    rewritten relative to where the stylesheet is written (`target`).
+    '''
+    def replace(match):
+        quote, url = match.groups()
+        if re.match(r'^([a-z]+:|/|#)', url):
+            return match.group(0)
+        path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        built = manifest.get(posixpath.normpath(posixpath.join(posixpath.dirname(source), path)))
+        if built is None:
+            return match.group(0)
+        return 'url({0}{1}{2}{0})'.format(quote, posixpath.relpath(built, posixpath.dirname(target)), suffix)
+    return CSS_URL.sub(replace, css)
+
+def minify_css(css):
+    # rcssmin is optional; without it only comments and whitespace go
+    try:
+        import rcssmin
+        return rcssmin.cssmin(css)
+    except ImportError:
+        pass
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+def minify_js(js):
+    # rjsmin is optional; the bundled libraries ship minified anyway
+    try:
+        import rjsmin
+        return rjsmin.jsmin(js)
+    except ImportError:
+        return js
+
+def write_asset(build_folder, path, content):
+    '''Writes one built file, plus .gz and .br copies when they are smaller.'''
+    target = os.path.join(build_folder, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(content)
+    if not path.endswith(COMPRESSIBLE):
+        return
+    compressed = {'.gz': gzip.compress(content, 9, mtime=0)}
+    try:
+        import brotli
+        compressed['.br'] = brotli.compress(content, quality=11)
+    except ImportError:
+        pass
+    for suffix, data in compressed.items():
+        if len(data) < len(content):
+            with open(target + suffix, 'wb') as f:
+                f.write(data)
+
+def build_assets(static_folder, build_folder):
+    '''Fingerprints every static file, builds the bundles and writes the
+    manifest mapping each logical path to its built one.'''
+    if os.path.isdir(build_folder):
+        shutil.rmtree(build_folder)
+    sources = {}
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = [name for name in dirnames if os.path.join(dirpath, name) != build_folder]
+        for filename in filenames:
+            if not filename.startswith('.'):
+                source = os.path.join(dirpath, filename)
+                sources[os.path.relpath(source, static_folder).replace(os.sep, '/')] = source
+
+    def read(path):
+        with open(sources[path], 'rb') as f:
+            return f.read()
+
+    manifest = {}
+    # stylesheets last, so the files their url()s point at are known
+    for path in sorted(sources, key=lambda path: (path.endswith('.css'), path)):
+        content = read(path)
+        if path.endswith('.css'):
+            content = rewrite_css_urls(content.decode('utf-8'), path, path, manifest).encode('utf-8')
+        manifest[path] = fingerprinted(path, content)
+        write_asset(build_folder, manifest[path], content)
+
+    for bundle, paths in BUNDLES.items():
+        parts = [read(path).decode('utf-8') for path in paths]
+        if bundle.endswith('.css'):
+            parts = [rewrite_css_urls(part, path, bundle, manifest) for part, path in zip(parts, paths)]
+            content = minify_css('\n'.join(parts))
+        else:
+            # the source maps of single files do not match the bundle
+            content = minify_js('\n;\n'.join(SOURCE_MAP.sub('', part) for part in parts))
+        content = content.encode('utf-8')
+        manifest[bundle] = fingerprinted(bundle, content)
+        write_asset(build_folder, manifest[bundle], content)
+
+    with open(os.path.join(build_folder, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+#----------------------------------------------------------------------------#
+# Serving.
+#----------------------------------------------------------------------------#
+
+class Assets(object):
+    '''Serves the output of `flask assets build` and resolves asset URLs.
+
+    Built files have the hash of their content in their name, so they are
+    served from /assets/ with an immutable, year-long Cache-Control, as
+    the pre-compressed .br or .gz copy when the client accepts it. In
+    templates, asset_url(path) and asset_urls(bundle) resolve logical
+    paths through the manifest. Without a build (in development) they fall
+    back to the plain files under /static/, one per bundled source.
+    '''
+
+    def __init__(self, app=None):
+        self._manifest = None
+        self._manifest_mtime = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.build_folder = os.path.join(app.static_folder, 'build')
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.send_asset)
+        app.context_processor(lambda: {'asset_url': self.url, 'asset_urls': self.urls})
+        app.cli.add_command(assets_cli)
+
+    def manifest(self):
+        # read once; in debug mode again whenever the build changes
+        if self._manifest is not None and not current_app.debug:
+            return self._manifest
+        path = os.path.join(self.build_folder, 'manifest.json')
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            # not built (yet): plain static files
+            return {}
+        if mtime != self._manifest_mtime:
+            with open(path) as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def url(self, path):
+        built = self.manifest().get(path)
+        if built is None:
+            return url_for('static', filename=path)
+        return url_for('assets', filename=built)
+
+    def urls(self, bundle):
+        built = self.manifest().get(bundle)
+        if built is None:
+            return [url_for('static', filename=path) for path in BUNDLES[bundle]]
+        return [url_for('assets', filename=built)]
+
+    def send_asset(self, filename):
+        response = None
+        mimetype = mimetypes.guess_type(filename)[0]
+        max_age = current_app.config.get('ASSETS_MAX_AGE', 31536000)
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[encoding] and os.path.isfile(os.path.join(self.build_folder, filename + suffix)):
+                response = send_from_directory(self.build_folder, filename + suffix, mimetype=mimetype, max_age=max_age)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(self.build_folder, filename, mimetype=mimetype, max_age=max_age)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept-Encoding')
+        return response
+
+#----------------------------------------------------------------------------#
+# CLI.
+#----------------------------------------------------------------------------#
+
+assets_cli = AppGroup('assets', help='Build the fingerprinted static assets.')
+
+@assets_cli.command('build')
+def build_command():
+    '''Bundle, minify, fingerprint and pre-compress static/ into static/build/.'''
+    static_folder = current_app.static_folder
+    build_folder = os.path.join(static_folder, 'build')
+    manifest = build_assets(static_folder, build_folder)
+    for bundle in BUNDLES:
+        path = os.path.join(build_folder, *manifest[bundle].split('/'))
+        sizes = [os.path.getsize(path + suffix) for suffix in ('', '.gz', '.br') if os.path.exists(path + suffix)]
+        click.echo('{} -> {} ({})'.format(bundle, manifest[bundle], ' / '.join('{:,} bytes'.format(size) for size in sizes)), err=True)
+    click.echo('{} files in {}'.format(len(manifest), build_folder), err=True)
@@ -0,0 +1,103 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import asyncio
+import os
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from profiling import current_profile
+
+#----------------------------------------------------------------------------#
+# Async reads.
+#----------------------------------------------------------------------------#
+
+def async_database_uri(config):
+    '''ASYNC_DATABASE_URI, or SQLALCHEMY_DATABASE_URI with the asyncpg driver.'''
+    if config.get('ASYNC_DATABASE_URI'):
+        return config['ASYNC_DATABASE_URI']
+    scheme, rest = config['SQLALCHEMY_DATABASE_URI'].split('://', 1)
+    if not scheme.startswith('postgres'):
+        raise ValueError('Set ASYNC_DATABASE_URI for {} databases'.format(scheme))
+    return 'postgresql+asyncpg://' + rest
+
+def async_engine_options(config):
+    # same pool settings as the synchronous engine (see db_pool.py)
+    if config.get('DB_PGBOUNCER'):
+        # asyncpg prepares statements server side, which PgBouncer's
+        # transaction pooling cannot route; turn both caches off
+        return {
+            'poolclass': NullPool,
+            'connect_args': {'statement_cache_size': 0, 'prepared_statement_cache_size': 0}
+        }
+    return {
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True)
+    }
+
+
+class AsyncReads(object):
+    '''Runs a view's independent read queries concurrently through asyncpg.
+
+    Views stay synchronous. Each worker process keeps one event loop in a
+    background thread, and the asyncpg connection pool lives on that loop;
+    a view hands it a batch of queries and waits for all of them at once,
+    so a page costs its slowest query instead of the sum of its queries.
+    Every query runs on its own connection, hence its own snapshot.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = app.config
+        self.enabled = app.config.get('ASYNC_READS_ENABLED', False)
+
+    def _start(self):
+        # neither the loop thread nor the pool survives a fork, so every
+        # worker process starts its own on first use
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # asyncpg is optional and only needed in this mode
+            from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='async-reads', daemon=True).start()
+            engine = create_async_engine(async_database_uri(self.config), **async_engine_options(self.config))
+            self._loop = loop
+            self._session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+            self._pid = os.getpid()
+
+    async def _run(self, statement, take):
+        started = time.perf_counter()
+        async with self._session() as session:
+            value = take(await session.execute(statement))
+        return value, time.perf_counter() - started
+
+    async def _run_all(self, jobs):
+        return await asyncio.gather(*[self._run(statement, take) for statement, take in jobs])
+
+    def gather(self, jobs):
+        '''Runs (statement, take) pairs concurrently, returns take(result) of each.'''
+        self._start()
+        results = asyncio.run_coroutine_threadsafe(self._run_all(jobs), self._loop).result()
+        # the engine events of profiling.py fire on the loop thread, outside
+        # the request; the request's profile is filled in from here instead
+        profile = current_profile()
+        if profile is not None:
+            for (statement, _), (_, seconds) in zip(jobs, results):
+                profile.record_query(str(statement), None, seconds, False)
+        return [value for value, _ in results]
@@ -0,0 +1,213 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from sqlalchemy import event, func, or_
+
+from models import app, db, Artist, Venue
+
+#----------------------------------------------------------------------------#
+# Prefix index.
+#----------------------------------------------------------------------------#
+
+KINDS = {
+    'venue': Venue,
+    'artist': Artist
+}
+
+def normalize(text):
+    '''Lowercase, accent-free, single-spaced form of a name or query.'''
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'[^\W_]+', text.casefold()))
+
+def word_suffixes(name):
+    # "the musical hop" -> "the musical hop", "musical hop", "hop", so a
+    # prefix of any word in the name finds it
+    words = normalize(name).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex(object):
+    '''Sorted array of normalized venue/artist names, searched by bisection.
+
+    The index lives in the worker's memory and is built in the background
+    when the worker starts (see gunicorn.conf.py). Commits made by this
+    worker are applied to it incrementally; commits made by other workers
+    are picked up by the periodic rebuild (AUTOCOMPLETE_REBUILD_SECONDS).
+    '''
+
+    def __init__(self):
+        self._keys = []
+        # (kind, id) -> (name, keys of that entry)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._building = False
+        self.built_at = None
+
+    @property
+    def ready(self):
+        return self.built_at is not None
+
+    @property
+    def stale(self):
+        # see mark_stale()
+        return self.built_at == 0
+
+    def _add(self, kind, id, name):
+        keys = [(suffix, kind, id) for suffix in word_suffixes(name)]
+        for key in keys:
+            insort(self._keys, key)
+        self._entries[(kind, id)] = (name, keys)
+
+    def _remove(self, kind, id):
+        entry = self._entries.pop((kind, id), None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            i = bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def put(self, kind, id, name):
+        with self._lock:
+            self._remove(kind, id)
+            self._add(kind, id, name)
+
+    def delete(self, kind, id):
+        with self._lock:
+            self._remove(kind, id)
+
+    def build(self):
+        '''Loads every name; runs outside the lock and swaps the result in.'''
+        entries = {}
+        keys = []
+        with app.app_context():
+            for kind, model in KINDS.items():
+                for id, name in db.session.query(model.id, model.name).yield_per(10000):
+                    entry_keys = [(suffix, kind, id) for suffix in word_suffixes(name)]
+                    keys.extend(entry_keys)
+                    entries[(kind, id)] = (name, entry_keys)
+        keys.sort()
+        with self._lock:
+            self._keys = keys
+            self._entries = entries
+            self.built_at = time.time()
+            self._building = False
+
+    def mark_stale(self):
+        '''Keeps serving the current index but rebuilds it on the next lookup.'''
+        with self._lock:
+            if self.built_at is not None:
+                self.built_at = 0
+
+    def build_in_background(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                self.build()
+            except Exception:
+                app.logger.exception('Building the autocomplete index failed')
+                with self._lock:
+                    self._building = False
+
+        threading.Thread(target=run, name='autocomplete-index', daemon=True).start()
+
+    def search(self, query, kinds, limit):
+        prefix = normalize(query)
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                key, kind, id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if kind in kinds and (kind, id) not in seen:
+                    seen.add((kind, id))
+                    results.append({'kind': kind, 'id': id, 'name': self._entries[(kind, id)][0]})
+                i += 1
+        return results
+
+autocomplete_index = PrefixIndex()
+
+#----------------------------------------------------------------------------#
+# Keeping the index current.
+#----------------------------------------------------------------------------#
+
+@event.listens_for(db.session, 'after_flush')
+def collect_name_changes(session, flush_context):
+    changes = session.info.setdefault('autocomplete_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, (Venue, Artist)):
+            changes[(type(obj).__name__.lower(), obj.id)] = obj.name
+    for obj in session.deleted:
+        if isinstance(obj, (Venue, Artist)):
+            changes[(type(obj).__name__.lower(), obj.id)] = None
+
+@event.listens_for(db.session, 'after_commit')
+def apply_name_changes(session):
+    changes = session.info.pop('autocomplete_changes', {})
+    if not autocomplete_index.ready:
+        return
+    for (kind, id), name in changes.items():
+        if name is None:
+            autocomplete_index.delete(kind, id)
+        else:
+            autocomplete_index.put(kind, id, name)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_name_changes(session):
+    session.info.pop('autocomplete_changes', None)
+
+#----------------------------------------------------------------------------#
+# Lookup.
+#----------------------------------------------------------------------------#
+
+def search_database(query, kinds, limit):
+    # used while the index is cold: name prefix or word prefix match, on
+    # the trigram indexes of lower(name). Only the `limit` candidates are
+    # ranked as the index ranks them, by their first matching word suffix;
+    # accents are not folded here, unlike in the index
+    term = normalize(query)
+    candidates = []
+    for kind in sorted(kinds):
+        model = KINDS[kind]
+        name = func.lower(model.name)
+        rows = db.session.query(model.id, model.name)\
+            .filter(or_(name.like(term + '%'), name.like('% ' + term + '%')))\
+            .order_by(model.name, model.id)\
+            .limit(limit).all()
+        for row in rows:
+            suffixes = [suffix for suffix in word_suffixes(row.name) if suffix.startswith(term)]
+            candidates.append((min(suffixes, default=''), kind, row.id, row.name))
+    return [{'kind': kind, 'id': id, 'name': name} for _, kind, id, name in sorted(candidates)[:limit]]
+
+def autocomplete(query, kinds=('venue', 'artist'), limit=10):
+    '''Names starting with query (or with a word starting with it).
+
+    Served from the in-memory index without touching the database once the
+    index is built; until then, and while a stale index is rebuilt in the
+    background, the database (or the previous index) answers instead.
+    '''
+    kinds = set(kinds) & set(KINDS)
+    if not normalize(query) or not kinds:
+        return []
+    index = autocomplete_index
+    max_age = app.config.get('AUTOCOMPLETE_REBUILD_SECONDS')
+    if not index.ready:
+        index.build_in_background()
+        return search_database(query, kinds, limit)
+    if index.stale or (max_age and time.time() - index.built_at > max_age):
+        index.build_in_background()
+    return index.search(query, kinds, limit)
@@ -0,0 +1,584 @@
+'''End-to-end benchmark of every route, through the Flask test client.
+
+    DATABASE_URL=postgresql://localhost/fyyur_bench python benchmark.py --create --generate 100000 --save-baseline
+    DATABASE_URL=postgresql://localhost/fyyur_bench python benchmark.py
+
+Runs the app in-process against DATABASE_URL, a local Postgres database
+or a SQLite file (sqlite:////tmp/fyyur_bench.db; full-text search, genre
+filters and the show feed need Postgres and are reported as errors
+there). The page cache is turned off so every request reaches the
+database. Each case is requested --iterations times for its latency
+percentiles and query count, then once more under tracemalloc for its
+peak Python memory.
+
+The results are compared with the baseline file, and the run exits 1 when
+the median latency or the peak memory of a case grew by more than
+--tolerance, or it runs more queries, or it fails where it used to
+succeed. With writes on, the insert throughput of writes.py is measured
+too, one show per transaction and then --write-batch-size shows per
+transaction, and gated the same way; so is the rate at which
+bulk_import.py imports synthetic venues at each --import-batch-size. The
+per-call time of the `datetime` template filter is gated too, and
+measured against the uncached formatting it replaced (--format-calls).
+Checks that hold regardless of the baseline fail the run on their own:
+/venues must run as many queries after the venue table doubled as before
+(the index plans are checked by tests/test_indexes.py). --create makes
+the tables and --generate fills them through synthetic.py first; a
+baseline is only comparable with a run over the same data set.
+--search-scale measures search latency over a million synthetic shows,
+against a baseline of its own:
+
+    DATABASE_URL=postgresql://localhost/fyyur_bench python benchmark.py --create --search-scale --save-baseline
+'''
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+DEFAULT_SEARCH_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'search_baseline.json')
+
+# data set of --search-scale: a million synthetic shows, with the 20,000
+# venues and 50,000 artists synthetic.py makes for them
+SEARCH_SCALE_SHOWS = 1000000
+
+# endpoints deliberately left out: files, gated uploads and metrics
+NOT_BENCHMARKED = {'static', 'assets', 'thumbnail', 'image_original', 'upload_image', 'import_upload', 'pool_metrics_view'}
+
+# name of the venues and artists the create cases add, and time of their show
+BENCHMARK_NAME = 'Benchmark Run'
+BENCHMARK_SHOW_TIME = datetime(2100, 1, 1, 20, 0)
+
+# `repeat` caps the iterations of cases that read a whole table
+Case = namedtuple('Case', 'name method path data repeat')
+
+def case(name, path, method='GET', data=None, repeat=None):
+    return Case(name, method, path, data, repeat)
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+#----------------------------------------------------------------------------#
+# Cases.
+#----------------------------------------------------------------------------#
+
+def pick_ids():
+    '''The busiest and a middle-of-the-table venue and artist.'''
+    from models import db, Artist, Show, Venue
+    ids = {}
+    for kind, model, show_fk in (('venue', Venue, Show.venue_id), ('artist', Artist, Show.artist_id)):
+        busiest = db.session.query(show_fk).group_by(show_fk).order_by(db.func.count().desc(), show_fk).first()
+        total = model.query.count()
+        typical = db.session.query(model.id).order_by(model.id).offset(total // 2).first()
+        if busiest is None or typical is None:
+            raise SystemExit('The database has no shows; pass --generate.')
+        ids['busiest_' + kind] = busiest[0]
+        ids['typical_' + kind] = typical[0]
+    return ids
+
+def form_data(entity, fields, flag):
+    data = {field: getattr(entity, field) or '' for field in fields}
+    data['genres'] = list(entity.genres)
+    # checkboxes are only sent when checked
+    if getattr(entity, flag):
+        data[flag] = 'y'
+    return data
+
+def name_words(venue, artist):
+    # words of real names, for the searches
+    return venue.name.split()[1], artist.name.split()[-1]
+
+def build_cases(ids, writes):
+    from models import app, db, Artist, Show, Venue
+    from queries import encode_show_cursor
+
+    busiest_venue = db.session.get(Venue, ids['busiest_venue'])
+    busiest_artist = db.session.get(Artist, ids['busiest_artist'])
+    # the cursor of the 10th page of the show listing
+    tenth = db.session.query(Show.start_time, Show.id).order_by(Show.start_time, Show.id)\
+        .offset(9 * app.config['SHOWS_PER_PAGE'] - 1).first()
+    cursor = encode_show_cursor(*tenth) if tenth else ''
+    venue_word, artist_word = name_words(busiest_venue, busiest_artist)
+
+    cases = [
+        case('home', '/'),
+        case('venues', '/venues'),
+        case('venues_genre', '/venues?genre={}'.format(busiest_venue.genres[0])),
+        case('venue_busiest', '/venues/{}'.format(ids['busiest_venue'])),
+        case('venue_busiest_past_page_50', '/venues/{}?past_page=50'.format(ids['busiest_venue'])),
+        case('venue_typical', '/venues/{}'.format(ids['typical_venue'])),
+        case('search_venues', '/venues/search', 'POST', {'search_term': venue_word}),
+        case('search_venues_prefix', '/venues/search', 'POST', {'search_term': venue_word[:3]}),
+        case('artists', '/artists'),
+        case('artist_busiest', '/artists/{}'.format(ids['busiest_artist'])),
+        case('artist_typical', '/artists/{}'.format(ids['typical_artist'])),
+        case('search_artists', '/artists/search', 'POST', {'search_term': artist_word}),
+        case('search_artists_two_words', '/artists/search', 'POST', {'search_term': busiest_artist.name}),
+        case('shows', '/shows'),
+        case('shows_page_10', '/shows?after={}'.format(cursor)),
+        case('autocomplete', '/autocomplete?q={}'.format(venue_word[:3].lower())),
+        case('venue_create_form', '/venues/create'),
+        case('venue_edit_form', '/venues/{}/edit'.format(ids['busiest_venue'])),
+        case('artist_create_form', '/artists/create'),
+        case('artist_edit_form', '/artists/{}/edit'.format(ids['busiest_artist'])),
+        case('show_create_form', '/shows/create'),
+        case('api_venues', '/api/v1/venues'),
+        case('api_venues_search', '/api/v1/venues/search?search_term={}'.format(venue_word)),
+        case('api_venues_search_page_2', '/api/v1/venues/search?search_term={}&offset={}'.format(
+            venue_word[:3], app.config['SEARCH_RESULTS_LIMIT'])),
+        case('api_venue_busiest', '/api/v1/venues/{}'.format(ids['busiest_venue'])),
+        case('api_artists', '/api/v1/artists'),
+        case('api_artists_search', '/api/v1/artists/search?search_term={}'.format(artist_word)),
+        case('api_artist_busiest', '/api/v1/artists/{}'.format(ids['busiest_artist'])),
+        case('api_shows', '/api/v1/shows', repeat=3),
+        case('api_shows_ndjson', '/api/v1/shows?format=ndjson', repeat=3)
+    ]
+    if writes:
+        # writes go last so they do not change what the reads measure;
+        # the edits post the current values back
+        venue_fields = ('name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+                        'website_link', 'seeking_description')
+        artist_fields = ('name', 'city', 'state', 'phone', 'image_link', 'facebook_link',
+                         'website_link', 'seeking_description')
+        venue = form_data(busiest_venue, venue_fields, 'seeking_talent')
+        artist = form_data(busiest_artist, artist_fields, 'seeking_venue')
+        cases += [
+            case('venue_edit', '/venues/{}/edit'.format(ids['busiest_venue']), 'POST', venue),
+            case('artist_edit', '/artists/{}/edit'.format(ids['busiest_artist']), 'POST', artist),
+            case('venue_create', '/venues/create', 'POST', dict(venue, name=BENCHMARK_NAME)),
+            case('artist_create', '/artists/create', 'POST', dict(artist, name=BENCHMARK_NAME)),
+            case('show_create', '/shows/create', 'POST', {
+                'venue_id': ids['typical_venue'],
+                'artist_id': ids['typical_artist'],
+                'start_time': BENCHMARK_SHOW_TIME.strftime('%Y-%m-%d %H:%M:%S')
+            }),
+            case('venue_delete', '/venues/0', 'DELETE')
+        ]
+    return cases
+
+def remove_written_rows(ids):
+    '''Deletes what the create cases added, so that runs stay comparable.'''
+    from counters import TARGETS, refresh_counts
+    from models import db, Artist, Show, Venue
+    db.session.query(Show).filter(
+        Show.venue_id == ids['typical_venue'],
+        Show.artist_id == ids['typical_artist'],
+        Show.start_time == BENCHMARK_SHOW_TIME
+    ).delete(synchronize_session=False)
+    for model in (Venue, Artist):
+        db.session.query(model).filter(model.name == BENCHMARK_NAME).delete(synchronize_session=False)
+    db.session.commit()
+    if db.engine.dialect.name != 'postgresql':
+        # no counter triggers outside Postgres
+        refresh_counts(*TARGETS['venues'], ids=[ids['typical_venue']])
+        refresh_counts(*TARGETS['artists'], ids=[ids['typical_artist']])
+
+def uncovered_endpoints(app, cases):
+    adapter = app.url_map.bind('localhost')
+    covered = set()
+    for c in cases:
+        covered.add(adapter.match(c.path.split('?')[0], c.method)[0])
+    return sorted(set(rule.endpoint for rule in app.url_map.iter_rules()) - covered - NOT_BENCHMARKED)
+
+#----------------------------------------------------------------------------#
+# Measuring.
+#----------------------------------------------------------------------------#
+
+class QueryCounter(object):
+    '''Counts the queries of a request.
+
+    The engine event sees every statement of the synchronous engine,
+    including those run while a streamed body is read; async reads only
+    show up in the request profile of profiling.py, read here when the
+    profiler's own hook runs.
+    '''
+
+    def __init__(self, app, db):
+        from flask import g
+        from sqlalchemy import event
+        self.engine_count = 0
+        self.profile_count = 0
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def count(*args):
+            self.engine_count += 1
+
+        # after_request functions run in reverse order: this one first
+        @app.after_request
+        def read_profile(response):
+            profile = g.get('request_profile')
+            if profile is not None:
+                self.profile_count = profile.query_count
+            return response
+
+    def reset(self):
+        self.engine_count = self.profile_count = 0
+
+    @property
+    def count(self):
+        return max(self.engine_count, self.profile_count)
+
+def request_once(client, c):
+    response = client.open(c.path, method=c.method, data=c.data)
+    body = response.get_data()
+    response.close()
+    return response.status_code, len(body)
+
+def measure(app, db, counter, cases, iterations):
+    client = app.test_client()
+    results = {}
+    for c in cases:
+        runs = min(iterations, c.repeat or iterations)
+        # one warm-up request fills the connection pool and the caches of
+        # compiled statements and templates
+        request_once(client, c)
+        latencies, queries, statuses = [], [], set()
+        for _ in range(runs):
+            counter.reset()
+            started = time.perf_counter()
+            status, size = request_once(client, c)
+            latencies.append(time.perf_counter() - started)
+            queries.append(counter.count)
+            statuses.add(status)
+        # tracemalloc slows everything down, so memory gets a run of its own
+        tracemalloc.start()
+        request_once(client, c)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        latencies.sort()
+        results[c.name] = {
+            'method': c.method,
+            'path': c.path,
+            'requests': runs,
+            'status': sorted(statuses),
+            'error': any(status >= 500 for status in statuses),
+            'bytes': size,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+            'queries': max(queries),
+            'peak_kib': round(peak / 1024, 1)
+        }
+        print('{:28} {:>8.1f} {:>8.1f} {:>8.1f} {:>6} {:>10.1f}  {}'.format(
+            c.name, results[c.name]['p50_ms'], results[c.name]['p95_ms'], results[c.name]['p99_ms'],
+            results[c.name]['queries'], results[c.name]['peak_kib'], '/'.join(map(str, sorted(statuses)))))
+    return results
+
+def write_throughput(ids, rows, batch_size):
+    '''Shows inserted per second through writes.write(), one per
+    transaction (as the create form does) and batch_size per transaction.'''
+    import writes
+    from models import Show
+
+    def add_shows(count):
+        def work(batch):
+            for _ in range(count):
+                batch.create(Show, venue_id=ids['typical_venue'], artist_id=ids['typical_artist'],
+                             start_time=BENCHMARK_SHOW_TIME)
+        return work
+
+    def single():
+        for _ in range(rows):
+            writes.write(add_shows(1))
+
+    def batched():
+        for start in range(0, rows, batch_size):
+            writes.write(add_shows(min(batch_size, rows - start)))
+
+    results = {'rows': rows, 'batch_size': batch_size}
+    for name, run in (('single', single), ('batched', batched)):
+        started = time.perf_counter()
+        run()
+        results[name + '_rows_per_second'] = round(rows / (time.perf_counter() - started), 1)
+    return results
+
+def import_throughput(rows, batch_sizes):
+    '''Venues imported per second by bulk_import.import_records() at each
+    batch size, from synthetic NDJSON read as `flask import` reads a file.
+    The imported venues are removed again after each run.'''
+    import io
+    import random
+    import bulk_import
+    import synthetic
+    from models import db, Venue
+    ndjson = ''.join(json.dumps(row) + '\n' for row in synthetic.venue_rows(random.Random(0), rows))
+    results = {'rows': rows, 'batch_sizes': {}}
+    for batch_size in batch_sizes:
+        last = db.session.query(db.func.coalesce(db.func.max(Venue.id), 0)).scalar()
+        try:
+            report = bulk_import.import_records('venues', bulk_import.read_records(io.StringIO(ndjson), 'ndjson'),
+                                                batch_size=batch_size)
+        finally:
+            db.session.query(Venue).filter(Venue.id > last).delete(synchronize_session=False)
+            db.session.commit()
+        results['batch_sizes'][str(batch_size)] = {
+            'rows_per_second': report['rows_per_second'],
+            'failed': report['failed']
+        }
+    return results
+
+def datetime_formatting(calls):
+    '''Microseconds per show time formatted by the `datetime` template
+    filter, against the formatting it replaced: dateutil parsing the
+    string and babel parsing the pattern on every call.'''
+    import babel.dates
+    import dateutil.parser
+    from app import format_datetime
+    value = BENCHMARK_SHOW_TIME
+
+    def old():
+        babel.dates.format_datetime(dateutil.parser.parse(str(value)), 'EE MM, dd, y h:mma', locale='en')
+
+    def new():
+        format_datetime(value)
+
+    results = {'calls': calls}
+    for name, run in (('old', old), ('new', new)):
+        run()
+        started = time.perf_counter()
+        for _ in range(calls):
+            run()
+        results[name + '_us_per_call'] = round((time.perf_counter() - started) / calls * 1e6, 2)
+    return results
+
+#----------------------------------------------------------------------------#
+# Checks.
+#----------------------------------------------------------------------------#
+
+# checks hold whatever the data set and the baseline: a failed one fails
+# the run on its own
+
+def venue_query_growth(app, db, counter, extra):
+    '''Queries of /venues before and after `extra` more venues are added.
+
+    The listing reads every venue in one grouped query, so the count must
+    not move with the size of the table. The added venues are removed
+    again afterwards.
+    '''
+    import random
+    import synthetic
+    from models import Venue
+    client = app.test_client()
+    listing = case('venues', '/venues')
+
+    def queries():
+        counter.reset()
+        request_once(client, listing)
+        return counter.count
+
+    before = queries()
+    with app.app_context():
+        last = db.session.query(db.func.coalesce(db.func.max(Venue.id), 0)).scalar()
+        synthetic.insert_batches(Venue, synthetic.venue_rows(random.Random(0), extra), 1000)
+    try:
+        after = queries()
+    finally:
+        with app.app_context():
+            db.session.query(Venue).filter(Venue.id > last).delete(synchronize_session=False)
+            db.session.commit()
+    return {'path': listing.path, 'extra_venues': extra, 'queries_before': before, 'queries_after': after}
+
+def data_set():
+    from models import db, Artist, Show, Venue
+    return {
+        'database': db.engine.dialect.name,
+        'venues': Venue.query.count(),
+        'artists': Artist.query.count(),
+        'shows': Show.query.count()
+    }
+
+#----------------------------------------------------------------------------#
+# Baseline.
+#----------------------------------------------------------------------------#
+
+def compare(baseline, current, tolerance, min_ms, min_kib):
+    '''Regressions of `current` against `baseline`, as readable lines.'''
+    regressions = []
+    for name, now in sorted(current['cases'].items()):
+        before = baseline['cases'].get(name)
+        if before is None:
+            continue
+        if now['error'] and not before['error']:
+            regressions.append('{}: now fails with {}'.format(name, now['status']))
+        if now['queries'] > before['queries']:
+            regressions.append('{}: {} queries, was {}'.format(name, now['queries'], before['queries']))
+        # the tail percentiles of a few dozen requests are too noisy to
+        # fail a run on; they are recorded for reading, the median is gated
+        if now['p50_ms'] > before['p50_ms'] * (1 + tolerance) and now['p50_ms'] - before['p50_ms'] > min_ms:
+            regressions.append('{}: p50 {:.1f} ms, was {:.1f} ms'.format(name, now['p50_ms'], before['p50_ms']))
+        if now['peak_kib'] > before['peak_kib'] * (1 + tolerance) and now['peak_kib'] - before['peak_kib'] > min_kib:
+            regressions.append('{}: peak {:.0f} KiB, was {:.0f} KiB'.format(name, now['peak_kib'], before['peak_kib']))
+    before, now = baseline.get('write_throughput'), current.get('write_throughput')
+    if before and now:
+        for key in ('single_rows_per_second', 'batched_rows_per_second'):
+            if now[key] * (1 + tolerance) < before[key]:
+                regressions.append('{}: {:.0f}, was {:.0f}'.format(key, now[key], before[key]))
+    before, now = baseline.get('import_throughput'), current.get('import_throughput')
+    if before and now:
+        for batch_size, result in sorted(now['batch_sizes'].items(), key=lambda item: int(item[0])):
+            was = before['batch_sizes'].get(batch_size)
+            if was and result['rows_per_second'] * (1 + tolerance) < was['rows_per_second']:
+                regressions.append('import of {} per batch: {:.0f} rows/s, was {:.0f}'.format(
+                    batch_size, result['rows_per_second'], was['rows_per_second']))
+    before, now = baseline.get('datetime_formatting'), current.get('datetime_formatting')
+    if before and now and now['new_us_per_call'] > before['new_us_per_call'] * (1 + tolerance):
+        regressions.append('datetime filter: {:.1f} us per call, was {:.1f} us'.format(
+            now['new_us_per_call'], before['new_us_per_call']))
+    return regressions
+
+#----------------------------------------------------------------------------#
+# Main.
+#----------------------------------------------------------------------------#
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--create', action='store_true', help='Create the tables first.')
+    parser.add_argument('--generate', type=int, metavar='SHOWS', help='Insert this many synthetic shows first.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--only', action='append', help='Run only this case (repeatable).')
+    parser.add_argument('--no-writes', dest='writes', action='store_false', help='Skip the POST and DELETE cases.')
+    parser.add_argument('--write-rows', type=int, default=1000,
+                        help='Shows inserted by the write throughput runs (0 skips them).')
+    parser.add_argument('--write-batch-size', type=int, default=100)
+    parser.add_argument('--import-rows', type=int, default=10000,
+                        help='Venues imported by the bulk import throughput runs (0 skips them).')
+    parser.add_argument('--import-batch-size', type=int, action='append',
+                        help='Batch size of an import run (repeatable; defaults to 100, 1000 and 5000).')
+    parser.add_argument('--format-calls', type=int, default=5000,
+                        help='Show times formatted by the datetime filter microbenchmark (0 skips it).')
+    parser.add_argument('--verbose', action='store_true', help='Log the tracebacks of failing requests.')
+    parser.add_argument('--search-scale', action='store_true',
+                        help='Top the data set up to {:,} shows and run only the search cases.'.format(SEARCH_SCALE_SHOWS))
+    parser.add_argument('--baseline', help='Defaults to {} ({} with --search-scale).'.format(
+        os.path.relpath(DEFAULT_BASELINE), os.path.relpath(DEFAULT_SEARCH_BASELINE)))
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline.')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown and memory growth.')
+    parser.add_argument('--min-ms', type=float, default=2.0, help='Ignore latency changes smaller than this.')
+    parser.add_argument('--min-kib', type=float, default=256.0, help='Ignore memory changes smaller than this.')
+    args = parser.parse_args()
+    if args.search_scale:
+        args.writes = False
+    if args.baseline is None:
+        args.baseline = DEFAULT_SEARCH_BASELINE if args.search_scale else DEFAULT_BASELINE
+
+    # measure the database work of every request, not the page cache
+    os.environ['PAGE_CACHE_BACKEND'] = 'null'
+    os.environ.setdefault('PROFILE_LOG_REQUESTS', '0')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from app import app
+    from models import db
+    app.config['WTF_CSRF_ENABLED'] = False
+    if not args.verbose:
+        # failing cases are reported in the results, not as tracebacks
+        app.logger.setLevel(logging.CRITICAL)
+
+    with app.app_context():
+        if args.create:
+            db.create_all()
+        if args.generate:
+            import synthetic
+            print(json.dumps(synthetic.generate(args.generate, seed=args.seed)), file=sys.stderr)
+        if args.search_scale:
+            import synthetic
+            from models import Show
+            missing_shows = SEARCH_SCALE_SHOWS - Show.query.count()
+            if missing_shows > 0:
+                print(json.dumps(synthetic.generate(missing_shows, seed=args.seed)), file=sys.stderr)
+        current = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'data_set': data_set(),
+            'iterations': args.iterations
+        }
+        ids = pick_ids()
+        # /autocomplete answers from the database until its index is built
+        from autocomplete import autocomplete_index
+        autocomplete_index.build()
+        cases = build_cases(ids, args.writes)
+        db.session.remove()
+
+    missing = uncovered_endpoints(app, cases)
+    if missing:
+        print('not benchmarked: {}'.format(', '.join(missing)), file=sys.stderr)
+    if args.search_scale:
+        args.only = [c.name for c in cases if 'search' in c.name]
+    if args.only:
+        cases = [c for c in cases if c.name in args.only]
+
+    print('{:28} {:>8} {:>8} {:>8} {:>6} {:>10}  {}'.format('case', 'p50 ms', 'p95 ms', 'p99 ms', 'sql', 'peak KiB', 'status'))
+    counter = QueryCounter(app, db)
+    current['cases'] = measure(app, db, counter, cases, args.iterations)
+    if args.writes:
+        with app.app_context():
+            if args.write_rows and not args.only:
+                current['write_throughput'] = write_throughput(ids, args.write_rows, args.write_batch_size)
+                print('inserts/s: {single_rows_per_second:.0f} one per transaction, '
+                      '{batched_rows_per_second:.0f} {batch_size} per transaction'.format(**current['write_throughput']))
+            if args.import_rows and not args.only:
+                current['import_throughput'] = imported = import_throughput(
+                    args.import_rows, args.import_batch_size or [100, 1000, 5000])
+                print('imported venues/s: {}'.format(', '.join(
+                    '{rows_per_second:.0f} at {batch_size} per batch'.format(batch_size=batch_size, **result)
+                    for batch_size, result in imported['batch_sizes'].items())))
+            remove_written_rows(ids)
+
+    failures = []
+    for batch_size, result in current.get('import_throughput', {}).get('batch_sizes', {}).items():
+        if result['failed']:
+            failures.append('{} synthetic venues failed validation in the import of {} per batch'.format(
+                result['failed'], batch_size))
+    if args.format_calls and not args.only:
+        with app.app_context():
+            current['datetime_formatting'] = formatting = datetime_formatting(args.format_calls)
+        print('datetime filter: {new_us_per_call:.1f} us per call, {old_us_per_call:.1f} us before '
+              'the cached patterns'.format(**formatting))
+        if formatting['new_us_per_call'] >= formatting['old_us_per_call']:
+            failures.append('the datetime filter is no faster than parsing every call')
+    if not args.only:
+        growth = venue_query_growth(app, db, counter, max(100, current['data_set']['venues']))
+        current['venue_query_growth'] = growth
+        print('/venues queries: {queries_before} before, {queries_after} with {extra_venues} more venues'.format(**growth))
+        if growth['queries_after'] != growth['queries_before']:
+            failures.append('/venues runs {queries_after} queries with {extra_venues} more venues, '
+                            '{queries_before} before'.format(**growth))
+    for line in failures:
+        print('CHECK FAILED ' + line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print('baseline written to {}'.format(args.baseline), file=sys.stderr)
+    elif not os.path.exists(args.baseline):
+        print('no baseline at {}; run with --save-baseline'.format(args.baseline), file=sys.stderr)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['data_set'] != current['data_set']:
+            print('warning: baseline data set {} differs from {}'.format(baseline['data_set'], current['data_set']),
+                  file=sys.stderr)
+        regressions = compare(baseline, current, args.tolerance, args.min_ms, args.min_kib)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if not regressions:
+            print('no regressions against {}'.format(args.baseline), file=sys.stderr)
+        failures += regressions
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
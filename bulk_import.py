@@ -0,0 +1,297 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import os
+import time
+
+import click
+from flask import abort, jsonify, request
+from flask.cli import with_appcontext
+from werkzeug.datastructures import MultiDict
+
+from autocomplete import autocomplete_index
+from forms import ArtistForm, ShowForm, VenueForm
+from models import app, db, page_cache, Artist, Show, Venue
+
+#----------------------------------------------------------------------------#
+# Readers.
+#----------------------------------------------------------------------------#
+
+FORMATS = ('csv', 'ndjson')
+
+def read_records(stream, fmt):
+    '''Yields (line number, record dict) pairs from a text stream.
+
+    In CSV files multi-valued columns such as genres are comma separated
+    inside one cell; in NDJSON they may also be lists.
+    '''
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_no, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as error:
+                    yield line_no, error
+    else:
+        raise ValueError('Unknown import format {!r}'.format(fmt))
+
+#----------------------------------------------------------------------------#
+# Validation.
+#----------------------------------------------------------------------------#
+
+def to_formdata(record):
+    formdata = MultiDict()
+    for key, value in record.items():
+        if value is None:
+            continue
+        if key == 'genres':
+            values = value if isinstance(value, list) else str(value).split(',')
+            for genre in values:
+                if genre.strip():
+                    formdata.add(key, genre.strip())
+        elif isinstance(value, bool):
+            # BooleanField treats any submitted value as checked
+            if value:
+                formdata.add(key, 'y')
+        else:
+            formdata.add(key, str(value))
+    return formdata
+
+def flag(formdata, name):
+    return formdata.get(name, '').strip().lower() in ('y', 'yes', 'true', '1', 'on')
+
+def venue_row(formdata):
+    return {
+        'name': formdata.get('name'),
+        'city': formdata.get('city'),
+        'state': formdata.get('state'),
+        'address': formdata.get('address'),
+        'phone': formdata.get('phone'),
+        'genres': formdata.getlist('genres'),
+        'facebook_link': formdata.get('facebook_link'),
+        'image_link': formdata.get('image_link'),
+        'website_link': formdata.get('website_link'),
+        'seeking_talent': flag(formdata, 'seeking_talent'),
+        'seeking_description': formdata.get('seeking_description')
+    }
+
+def artist_row(formdata):
+    return {
+        'name': formdata.get('name'),
+        'city': formdata.get('city'),
+        'state': formdata.get('state'),
+        'phone': formdata.get('phone'),
+        'genres': formdata.getlist('genres'),
+        'facebook_link': formdata.get('facebook_link'),
+        'image_link': formdata.get('image_link'),
+        'website_link': formdata.get('website_link'),
+        'seeking_venue': flag(formdata, 'seeking_venue'),
+        'seeking_description': formdata.get('seeking_description')
+    }
+
+def show_row(form):
+    return {
+        'artist_id': int(form.artist_id.data),
+        'venue_id': int(form.venue_id.data),
+        'start_time': form.start_time.data
+    }
+
+# model, form validating a record, and the insert row built from it
+KINDS = {
+    'venues': (Venue, VenueForm, lambda form, formdata: venue_row(formdata)),
+    'artists': (Artist, ArtistForm, lambda form, formdata: artist_row(formdata)),
+    'shows': (Show, ShowForm, lambda form, formdata: show_row(form))
+}
+
+def validate(kind, record):
+    '''Returns (row, None) for a valid record and (None, errors) otherwise.'''
+    if not isinstance(record, dict):
+        return None, {'record': [str(record)]}
+    model, form_class, to_row = KINDS[kind]
+    formdata = to_formdata(record)
+    form = form_class(formdata=formdata, meta={'csrf': False})
+    if not form.validate():
+        return None, form.errors
+    if kind == 'shows':
+        errors = {}
+        for field in ('artist_id', 'venue_id'):
+            if not str(getattr(form, field).data or '').strip().isdigit():
+                errors[field] = ['Not a valid id.']
+        if errors:
+            return None, errors
+    return to_row(form, formdata), None
+
+def missing_references(rows):
+    '''Line numbers of show rows whose artist or venue does not exist.'''
+    artist_ids = set(row['artist_id'] for _, row in rows)
+    venue_ids = set(row['venue_id'] for _, row in rows)
+    known_artists = set(id for id, in db.session.query(Artist.id).filter(Artist.id.in_(artist_ids)))
+    known_venues = set(id for id, in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids)))
+    missing = {}
+    for line_no, row in rows:
+        errors = {}
+        if row['artist_id'] not in known_artists:
+            errors['artist_id'] = ['Artist {} does not exist.'.format(row['artist_id'])]
+        if row['venue_id'] not in known_venues:
+            errors['venue_id'] = ['Venue {} does not exist.'.format(row['venue_id'])]
+        if errors:
+            missing[line_no] = errors
+    return missing
+
+#----------------------------------------------------------------------------#
+# Import.
+#----------------------------------------------------------------------------#
+
+def import_records(kind, records, batch_size=1000, resume_after=0, on_error=None, on_batch=None):
+    '''Validates and inserts records, committing one batch at a time.
+
+    Each batch is one multi-row INSERT (psycopg2's executemany runs as
+    execute_values) and one commit, so an interrupted import can be
+    resumed after the last committed line with `resume_after`. Invalid
+    records are skipped and passed to `on_error(line_no, errors)`;
+    `on_batch(last_line_no)` runs after every commit.
+    '''
+    model = KINDS[kind][0]
+    report = {'kind': kind, 'inserted': 0, 'failed': 0, 'skipped': 0, 'last_line': resume_after}
+    started = time.perf_counter()
+    batch = []
+
+    def fail(line_no, errors):
+        report['failed'] += 1
+        if on_error is not None:
+            on_error(line_no, errors)
+
+    def flush(last_line_no):
+        rows = batch
+        if kind == 'shows' and rows:
+            missing = missing_references(rows)
+            for line_no, errors in sorted(missing.items()):
+                fail(line_no, errors)
+            rows = [(line_no, row) for line_no, row in rows if line_no not in missing]
+        if rows:
+            db.session.execute(model.__table__.insert(), [row for _, row in rows])
+        db.session.commit()
+        if rows:
+            # core inserts bypass the ORM flush events the page cache and
+            # the autocomplete index listen to
+            page_cache.invalidate(model.__name__)
+            if kind != 'shows':
+                autocomplete_index.mark_stale()
+        report['inserted'] += len(rows)
+        report['last_line'] = last_line_no
+        if on_batch is not None:
+            on_batch(last_line_no)
+
+    line_no = resume_after
+    try:
+        for line_no, record in records:
+            if line_no <= resume_after:
+                report['skipped'] += 1
+                continue
+            row, errors = validate(kind, record)
+            if errors:
+                fail(line_no, errors)
+                continue
+            batch.append((line_no, row))
+            if len(batch) >= batch_size:
+                flush(line_no)
+                batch = []
+        flush(line_no)
+    except Exception:
+        db.session.rollback()
+        raise
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['rows_per_second'] = round(report['inserted'] / report['seconds'], 1) if report['seconds'] else None
+    return report
+
+#----------------------------------------------------------------------------#
+# CLI and upload endpoint.
+#----------------------------------------------------------------------------#
+
+@click.command('import')
+@with_appcontext
+@click.argument('kind', type=click.Choice(sorted(KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, type=click.IntRange(min=1))
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='File recording the last committed line; an existing one resumes the import.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+              help='Write rejected records as NDJSON here instead of stderr.')
+def import_command(kind, path, fmt, batch_size, checkpoint, errors_path):
+    '''Bulk import venues, artists or shows from a CSV or NDJSON file.'''
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise click.UsageError('Cannot tell the format of {}, pass --format.'.format(path))
+
+    resume_after = 0
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            resume_after = int(f.read().strip() or 0)
+        click.echo('Resuming after line {}'.format(resume_after), err=True)
+
+    def save_checkpoint(line_no):
+        if checkpoint:
+            with open(checkpoint, 'w') as f:
+                f.write(str(line_no))
+
+    errors_file = open(errors_path, 'a') if errors_path else None
+
+    def report_error(line_no, errors):
+        line = json.dumps({'line': line_no, 'errors': errors})
+        if errors_file is not None:
+            errors_file.write(line + '\n')
+        else:
+            click.echo(line, err=True)
+
+    try:
+        with open(path, newline='', encoding='utf-8') as stream:
+            report = import_records(kind, read_records(stream, fmt), batch_size, resume_after,
+                                    on_error=report_error, on_batch=save_checkpoint)
+    finally:
+        if errors_file is not None:
+            errors_file.close()
+    click.echo(json.dumps(report))
+
+
+@app.route('/import/<kind>', methods=['POST'])
+def import_upload(kind):
+    # multipart upload of one CSV/NDJSON file, read as a stream and
+    # imported batch by batch; per-row errors come back in the report
+    if not app.config['IMPORT_UPLOADS_ENABLED'] or kind not in KINDS:
+        abort(404)
+    upload = request.files.get('file')
+    if upload is None:
+        abort(400)
+    fmt = request.form.get('format') or os.path.splitext(upload.filename or '')[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        abort(400)
+
+    errors = []
+
+    def report_error(line_no, row_errors):
+        if len(errors) < app.config['IMPORT_MAX_REPORTED_ERRORS']:
+            errors.append({'line': line_no, 'errors': row_errors})
+
+    batch_size = request.form.get('batch_size', 1000, type=int)
+    batch_size = min(max(batch_size, 1), app.config['IMPORT_MAX_BATCH_SIZE'])
+
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    report = import_records(
+        kind,
+        read_records(stream, fmt),
+        batch_size,
+        request.form.get('resume_after', 0, type=int),
+        on_error=report_error
+    )
+    report['errors'] = errors
+    return jsonify(report)
@@ -0,0 +1,317 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import event
+from werkzeug.http import is_resource_modified
+from werkzeug.wrappers import Response
+
+#----------------------------------------------------------------------------#
+# Backends.
+#----------------------------------------------------------------------------#
+
+class NullCache(object):
+    '''Backend that never stores anything, used when caching is disabled.'''
+
+    def get(self, key):
+        return None
+
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def incr(self, key):
+        return 0
+
+
+class LRUCache(object):
+    '''In-process least-recently-used cache.
+
+    Entries live in the memory of one worker process, so writes committed
+    by other workers are not seen here; use RedisCache when the app runs
+    with more than one worker.
+    '''
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # counters are kept apart from the entries so eviction never
+        # resets a generation back to a value that was already used
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.time() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisCache(object):
+    '''Cache stored in Redis, shared by every worker.
+
+    `client` can be any object with the redis-py `get`, `mget`, `set` and
+    `incr` methods, so tests can pass a local fake instead of a server.
+    '''
+
+    def __init__(self, client, prefix='fyyur:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def get_many(self, keys):
+        return self.client.mget([self.prefix + key for key in keys])
+
+    def set(self, key, value, timeout=None):
+        self.client.set(self.prefix + key, value, ex=int(timeout) if timeout else None)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+class PageCache(object):
+    '''Read-through cache of rendered GET pages.
+
+    Each cached view names the models its page is built from. Every model
+    has a generation counter in the backend, and the generations are part
+    of the cache key, so committing a change to a Venue, Artist or Show
+    makes exactly the pages built from that model miss on their next
+    request. Stale entries are never read again and age out of the
+    backend on their own. Streamed pages are stored once they have been
+    sent, if they are no larger than PAGE_CACHE_MAX_PAGE_SIZE.
+    '''
+
+    def __init__(self, app=None, db=None):
+        self.backend = NullCache()
+        self.timeout = None
+        self.max_page_size = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        backend = app.config.get('PAGE_CACHE_BACKEND', 'null')
+        self.timeout = app.config.get('PAGE_CACHE_TIMEOUT', 300)
+        self.max_page_size = app.config.get('PAGE_CACHE_MAX_PAGE_SIZE', 1024 * 1024)
+        if backend == 'lru':
+            self.backend = LRUCache(app.config.get('PAGE_CACHE_MAX_ENTRIES', 1024))
+        elif backend == 'redis':
+            import redis
+            self.backend = RedisCache(
+                redis.Redis.from_url(app.config['PAGE_CACHE_REDIS_URL']),
+                app.config.get('PAGE_CACHE_KEY_PREFIX', 'fyyur:')
+            )
+        elif backend != 'null':
+            raise ValueError('Unknown PAGE_CACHE_BACKEND {!r}'.format(backend))
+        self._listen(db.session)
+
+    def _listen(self, session_factory):
+        @event.listens_for(session_factory, 'after_flush')
+        def collect_changed_models(session, flush_context):
+            changed = session.info.setdefault('page_cache_changed', set())
+            for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+                changed.add(type(obj).__name__)
+
+        @event.listens_for(session_factory, 'after_commit')
+        def invalidate_changed_models(session):
+            for model_name in session.info.pop('page_cache_changed', ()):
+                self.invalidate(model_name)
+
+        @event.listens_for(session_factory, 'after_rollback')
+        def forget_changed_models(session):
+            session.info.pop('page_cache_changed', None)
+
+    def invalidate(self, model_name):
+        self.backend.incr('generation:' + model_name)
+
+    def expire_at(self, when):
+        '''Caps the lifetime of the page being rendered.
+
+        Views call this with the moment their content changes on its own,
+        e.g. when the next upcoming show becomes a past show.
+        '''
+        state = g.get('page_cache_state')
+        if when is None or state is None:
+            return
+        if state['expires_at'] is None or when < state['expires_at']:
+            state['expires_at'] = when
+
+    def _key(self, model_names):
+        generations = self.backend.get_many(['generation:' + name for name in model_names])
+        args = '&'.join('{}={}'.format(k, v) for k, v in sorted(request.args.items(multi=True)))
+        # under conditional(), the ETag of the current stamp: the
+        # generations only move with commits seen by this process, the
+        # stamp with every change, whoever made it
+        return 'page:{}?{}:{}:{}'.format(
+            request.path,
+            args,
+            '.'.join(str(int(generation or 0)) for generation in generations),
+            g.get('page_etag', '')
+        )
+
+    def _store(self, key, page, expires_at):
+        timeout = self.timeout
+        if expires_at is not None:
+            remaining = (expires_at - datetime.now()).total_seconds()
+            if remaining < 1:
+                return
+            timeout = min(timeout, remaining) if timeout else remaining
+        self.backend.set(key, page, timeout)
+
+    def _tee(self, chunks, key, state):
+        # a streamed page is stored once it has been sent in full, unless
+        # it outgrew max_page_size; expire_at() is still being called while
+        # it streams, hence the state dict rather than g, which is gone by
+        # the end
+        kept, size = [], 0
+        for chunk in chunks:
+            if kept is not None:
+                kept.append(chunk)
+                size += len(chunk)
+                if size > self.max_page_size:
+                    kept = None
+            yield chunk
+        if kept is not None:
+            self._store(key, ''.join(kept), state['expires_at'])
+
+    def cached(self, *models):
+        model_names = sorted(model.__name__ for model in models)
+
+        def decorator(view):
+            @wraps(view)
+            def decorated(*args, **kwargs):
+                # pages carrying flashed messages are specific to one user
+                if request.method != 'GET' or '_flashes' in session:
+                    return view(*args, **kwargs)
+
+                key = self._key(model_names)
+                page = self.backend.get(key)
+                if page is not None:
+                    return page.decode('utf-8') if isinstance(page, bytes) else page
+
+                g.page_cache_state = state = {'expires_at': None}
+                page = view(*args, **kwargs)
+                if isinstance(page, str):
+                    self._store(key, page, state['expires_at'])
+                elif isinstance(page, Response) and page.is_streamed and page.status_code == 200:
+                    page.response = self._tee(page.response, key, state)
+                return page
+            return decorated
+        return decorator
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+
+_templates_digest = None
+
+def templates_digest():
+    '''Hash of the templates and the asset manifest, so that ETags change
+    when a deploy changes what the same data renders to. Read once per
+    process, on every request in debug mode.'''
+    global _templates_digest
+    if _templates_digest is not None and not current_app.debug:
+        return _templates_digest
+    digest = hashlib.sha1()
+    folders = [os.path.join(current_app.root_path, current_app.template_folder)]
+    manifest = os.path.join(current_app.static_folder, 'build', 'manifest.json')
+    paths = [manifest] if os.path.exists(manifest) else []
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(folder):
+            dirnames.sort()
+            paths.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+    for path in paths:
+        digest.update(path.encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    _templates_digest = digest.hexdigest()
+    return _templates_digest
+
+def conditional(stamp):
+    '''Answers conditional GETs before the view runs.
+
+    `stamp` is called with the view arguments and returns a tuple of cheap
+    aggregates over the rows the page is built from (see the *_stamp
+    functions in queries.py), or None when there is no such page. The
+    ETag is a hash of the stamp and the Last-Modified date is its latest
+    datetime, naive UTC, so a matching If-None-Match or If-Modified-Since is
+    answered with 304 before any heavy query or template rendering runs.
+    Responses carry `Cache-Control: no-cache`: browsers keep them but
+    revalidate on every use. Must be applied outside PageCache.cached().
+    '''
+    def decorator(view):
+        @wraps(view)
+        def decorated(*args, **kwargs):
+            # pages carrying flashed messages are specific to one user
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(*args, **kwargs)
+            values = stamp(*args, **kwargs)
+            if values is None:
+                return view(*args, **kwargs)
+
+            etag = hashlib.sha1(repr((templates_digest(), request.path, values)).encode('utf-8')).hexdigest()
+            # keys the page cache (see PageCache._key), so the body sent
+            # with this ETag is never one rendered for an older stamp
+            g.page_etag = etag
+            last_modified = max((value for value in values if isinstance(value, datetime)), default=None)
+            # HTTP dates have whole seconds, so a change within the same
+            # second as the date would go unnoticed; the date is only sent
+            # once that second has passed. The stamps' datetimes are UTC.
+            if last_modified is not None:
+                if datetime.now(timezone.utc).replace(tzinfo=None) - last_modified < timedelta(seconds=1):
+                    last_modified = None
+                else:
+                    last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+            if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return decorated
+    return decorator
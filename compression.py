@@ -0,0 +1,195 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import re
+import time
+import zlib
+
+from flask import g, request
+
+#----------------------------------------------------------------------------#
+# Encoders.
+#----------------------------------------------------------------------------#
+
+# dynamic responses worth compressing; files under /assets/ and /images/
+# are sent as files (or compressed ahead of time) and left alone
+COMPRESSIBLE = (
+    'text/',
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml'
+)
+
+# input slice size, so that a large buffered page is compressed and sent
+# piece by piece instead of being copied into a second full buffer
+SLICE_SIZE = 64 * 1024
+
+class GzipEncoder(object):
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder(object):
+
+    def __init__(self, brotli, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+        # brotli names it process(), brotlicffi compress()
+        self._process = getattr(self._compressor, 'process', None) or self._compressor.compress
+
+    def compress(self, data):
+        return self._process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def brotli_module():
+    # brotli (or brotlicffi) is optional; without it responses are gzipped
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        pass
+    try:
+        import brotlicffi
+        return brotlicffi
+    except ImportError:
+        return None
+
+#----------------------------------------------------------------------------#
+# HTML whitespace.
+#----------------------------------------------------------------------------#
+
+# indentation and blank lines only: every run of whitespace that contains
+# a line break becomes one line break, which HTML, inline scripts (line
+# comments included) and inline styles all read the same way
+LINE_BREAK_WHITESPACE = re.compile(rb'[ \t\r]*\n\s*')
+
+# elements whose whitespace is content
+PRESERVE_WHITESPACE = re.compile(rb'<(pre|textarea)\b', re.I)
+
+# bytes of the previous slice searched along with the next one, enough for
+# an opening tag cut in two ('<textarea' less its last byte)
+TAG_OVERLAP = len(b'<textarea') - 1
+
+def collapse_whitespace(chunk):
+    return LINE_BREAK_WHITESPACE.sub(b'\n', chunk)
+
+#----------------------------------------------------------------------------#
+# Compressor.
+#----------------------------------------------------------------------------#
+
+class Compressor(object):
+    '''Compresses dynamic responses with brotli or gzip, as negotiated.
+
+    The body is compressed while it is sent: buffered pages are fed to the
+    encoder in slices and streamed ones (the listing pages and the show
+    feed) chunk by chunk, so no response is held twice in memory. The
+    encoder is flushed after every chunk of a streamed response, so each
+    chunk goes out as it is produced rather than when the encoder's
+    window fills. Bodies smaller than
+    COMPRESS_MIN_SIZE, responses that are already encoded and files are
+    sent as they are. With COMPRESS_MINIFY_HTML, templates are rendered
+    with trim_blocks/lstrip_blocks and the indentation of HTML responses
+    is collapsed before compressing, up to their first <pre> or <textarea>. Bytes in and out and the CPU time
+    spent are added to the request profile (profiling.py).
+    '''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        self.gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+        self.brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 5)
+        self.minify_html = app.config.get('COMPRESS_MINIFY_HTML', False)
+        self.brotli = brotli_module()
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return
+        if self.minify_html:
+            app.jinja_env.trim_blocks = True
+            app.jinja_env.lstrip_blocks = True
+        app.after_request(self._compress)
+
+    def _encoder(self):
+        encodings = ['br', 'gzip'] if self.brotli is not None else ['gzip']
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding == 'br':
+            return encoding, BrotliEncoder(self.brotli, self.brotli_quality)
+        if encoding == 'gzip':
+            return encoding, GzipEncoder(self.gzip_level)
+        return None, None
+
+    def _compress(self, response):
+        if (request.method == 'HEAD'
+                or response.status_code != 200
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or not (response.mimetype or '').startswith(COMPRESSIBLE)):
+            return response
+        if not response.is_streamed and (response.content_length or 0) < self.min_size:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding, encoder = self._encoder()
+        if encoder is None:
+            return response
+        minify = self.minify_html and response.mimetype == 'text/html'
+        body = self._encode(response.iter_encoded(), encoder, minify, response.is_streamed,
+                            g.get('request_profile'), encoding)
+        response.response = body
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Length', None)
+        return response
+
+    def _encode(self, chunks, encoder, minify, streamed, profile, encoding):
+        bytes_in = bytes_out = 0
+        cpu = 0.0
+        # end of the previous slice, for the whitespace guard
+        overlap = b''
+        try:
+            for chunk in chunks:
+                bytes_in += len(chunk)
+                for i in range(0, len(chunk), SLICE_SIZE):
+                    data = chunk[i:i + SLICE_SIZE]
+                    started = time.thread_time()
+                    if minify:
+                        # everything from the first <pre> or <textarea> on
+                        # is sent as it is
+                        if PRESERVE_WHITESPACE.search(overlap + data):
+                            minify = False
+                        else:
+                            overlap = data[-TAG_OVERLAP:]
+                            data = collapse_whitespace(data)
+                    part = encoder.compress(data)
+                    if streamed and i + SLICE_SIZE >= len(chunk):
+                        part += encoder.flush()
+                    cpu += time.thread_time() - started
+                    if part:
+                        bytes_out += len(part)
+                        yield part
+            started = time.thread_time()
+            tail = encoder.finish()
+            cpu += time.thread_time() - started
+            bytes_out += len(tail)
+            yield tail
+        finally:
+            if profile is not None:
+                profile.record_compression(encoding, bytes_in, bytes_out, cpu)
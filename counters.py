@@ -0,0 +1,120 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, select, update
+
+from models import db, page_cache, Artist, Show, Venue
+
+#----------------------------------------------------------------------------#
+# Recounting.
+#----------------------------------------------------------------------------#
+
+# model carrying the counters and the show column pointing at it
+TARGETS = {
+    'venues': (Venue, Show.venue_id),
+    'artists': (Artist, Show.artist_id)
+}
+
+def actual_counts(model, show_fk, now):
+    '''Correlated subqueries recounting upcoming shows from the shows table.'''
+    upcoming = and_(show_fk == model.id, Show.start_time > now)
+    count = select(func.count(Show.id)).where(upcoming).scalar_subquery()
+    next_show = select(func.min(Show.start_time)).where(upcoming).scalar_subquery()
+    return count, next_show
+
+def refresh_counts(model, show_fk, ids=None, batch_size=1000):
+    '''Recounts the given rows, or every row whose next show has started.
+
+    Rows are locked in id order before they are recounted, like the
+    database triggers do, and committed one batch at a time. Returns the
+    number of rows recounted.
+    '''
+    now = datetime.now()
+    query = db.session.query(model.id)
+    if ids is None:
+        query = query.filter(model.next_show_time <= now)
+    else:
+        query = query.filter(model.id.in_(ids))
+    ids = [id for id, in query.order_by(model.id)]
+
+    count, next_show = actual_counts(model, show_fk, now)
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        db.session.query(model.id).filter(model.id.in_(batch)).order_by(model.id).with_for_update().all()
+        db.session.execute(
+            update(model.__table__)
+            .where(model.id.in_(batch))
+            .values(upcoming_shows_count=count, next_show_time=next_show)
+        )
+        db.session.commit()
+    if ids:
+        # core updates bypass the ORM flush events the page cache listens to
+        page_cache.invalidate(model.__name__)
+    return len(ids)
+
+def find_mismatches(model, show_fk):
+    '''Rows whose stored counters differ from the shows table.
+
+    Each mismatch is flagged `rolled_over` when it only exists because the
+    row's next show has started since the last refresh, which is expected
+    between two runs of `flask counters refresh`; any other mismatch means
+    the counters have drifted.
+    '''
+    now = datetime.now()
+    count, next_show = actual_counts(model, show_fk, now)
+    rows = db.session.query(
+        model.id,
+        model.upcoming_shows_count,
+        model.next_show_time,
+        count.label('actual_count'),
+        next_show.label('actual_next_show_time')
+    ).filter(
+        (model.upcoming_shows_count != count) | model.next_show_time.is_distinct_from(next_show)
+    ).order_by(model.id)
+    return [{
+        'id': row.id,
+        'upcoming_shows_count': row.upcoming_shows_count,
+        'actual_count': row.actual_count,
+        'next_show_time': row.next_show_time,
+        'actual_next_show_time': row.actual_next_show_time,
+        'rolled_over': row.next_show_time is not None and row.next_show_time <= now
+    } for row in rows]
+
+#----------------------------------------------------------------------------#
+# CLI.
+#----------------------------------------------------------------------------#
+
+counters_cli = AppGroup('counters', help='Maintain the upcoming show counters of venues and artists.')
+
+@counters_cli.command('refresh')
+@click.option('--all', 'refresh_all', is_flag=True, help='Recount every row, not only rows whose next show has started.')
+def refresh_command(refresh_all):
+    '''Recount venues and artists whose next show has started; run it from cron.'''
+    for kind, (model, show_fk) in TARGETS.items():
+        ids = [id for id, in db.session.query(model.id)] if refresh_all else None
+        click.echo('{}: {} recounted'.format(kind, refresh_counts(model, show_fk, ids)), err=True)
+
+@counters_cli.command('check')
+@click.option('--fix', is_flag=True, help='Recount the rows found to be wrong.')
+def check_command(fix):
+    '''Compare the counters with the shows table; exits 1 on drift.'''
+    drifted = 0
+    for kind, (model, show_fk) in TARGETS.items():
+        mismatches = find_mismatches(model, show_fk)
+        for mismatch in mismatches:
+            if not mismatch['rolled_over']:
+                click.echo(json.dumps(dict(mismatch, kind=kind), default=str))
+        kind_drifted = sum(1 for mismatch in mismatches if not mismatch['rolled_over'])
+        drifted += kind_drifted
+        click.echo('{}: {} drifted, {} awaiting refresh'.format(
+            kind, kind_drifted, len(mismatches) - kind_drifted), err=True)
+        if fix and mismatches:
+            refresh_counts(model, show_fk, [mismatch['id'] for mismatch in mismatches])
+    if drifted and not fix:
+        raise SystemExit(1)
@@ -0,0 +1,124 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, Pool, QueuePool
+
+#----------------------------------------------------------------------------#
+# Metrics.
+#----------------------------------------------------------------------------#
+
+class PoolMetrics(object):
+    '''Connection pool counters of the current worker process.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+            self.in_use = 0
+            self.in_use_peak = 0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.checkout_timeouts += 1
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.in_use_peak = max(self.in_use_peak, self.in_use)
+
+    def record_checkin(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            data = {
+                'pid': os.getpid(),
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.checkout_timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+                'wait_seconds_avg': self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                'in_use': self.in_use,
+                'in_use_peak': self.in_use_peak
+            }
+        if isinstance(pool, QueuePool):
+            data['pool_size'] = pool.size()
+            data['idle'] = pool.checkedin()
+            data['overflow'] = pool.overflow()
+        return data
+
+pool_metrics = PoolMetrics()
+
+@event.listens_for(Pool, 'checkout')
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info['checked_out'] = True
+    pool_metrics.record_checkout()
+
+@event.listens_for(Pool, 'checkin')
+def count_checkin(dbapi_connection, connection_record):
+    # checkin also fires for connections invalidated before being handed
+    # out; only count the ones checkout saw
+    if connection_record is not None and connection_record.info.pop('checked_out', False):
+        pool_metrics.record_checkin()
+
+#----------------------------------------------------------------------------#
+# Pools.
+#----------------------------------------------------------------------------#
+
+class InstrumentedQueuePool(QueuePool):
+    '''QueuePool that records how long each checkout waited for a connection.'''
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+def engine_options(config):
+    '''SQLALCHEMY_ENGINE_OPTIONS built from the DB_POOL_* settings.
+
+    With DB_PGBOUNCER set, connections are not pooled in the app at all
+    (NullPool) and PgBouncer does the pooling. psycopg2 never prepares
+    statements server side, so nothing else has to change for PgBouncer's
+    transaction pooling.
+    '''
+    if config.get('DB_PGBOUNCER'):
+        return {
+            'poolclass': NullPool,
+            'pool_pre_ping': config.get('DB_POOL_PRE_PING', True)
+        }
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True)
+    }
+    if config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite'):
+        # pooled connections move between request and background threads,
+        # which SQLite refuses by default (local benchmark runs only)
+        options['connect_args'] = {'check_same_thread': False}
+    return options
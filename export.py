@@ -0,0 +1,177 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import csv
+import gzip
+import io
+import json
+import sys
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import ARRAY, select
+
+from models import db, Artist, Show, Venue
+
+#----------------------------------------------------------------------------#
+# Rows.
+#----------------------------------------------------------------------------#
+
+MODELS = {
+    'venues': Venue,
+    'artists': Artist,
+    'shows': Show
+}
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+
+# maintained by triggers and the ORM for the app's own use, not part of
+# the catalog
+INTERNAL_COLUMNS = {'search_vector', 'version', 'upcoming_shows_count', 'next_show_time'}
+
+def export_columns(model):
+    return [column for column in model.__table__.columns if column.name not in INTERNAL_COLUMNS]
+
+def export_batches(model, since=None, batch_size=5000):
+    '''Yields lists of row dicts, read through a server-side cursor.
+
+    Only `batch_size` rows are held in memory at a time, however large the
+    table is. `since` exports only rows created or changed at or after
+    that updated_at, so the rows of the previous run's last instant are
+    exported again; consumers upsert by id.
+    '''
+    table = model.__table__
+    query = select(*export_columns(model)).order_by(table.c.updated_at, table.c.id)
+    if since is not None:
+        query = query.where(table.c.updated_at >= since)
+    result = db.session.execute(query, execution_options={'stream_results': True})
+    for partition in result.mappings().partitions(batch_size):
+        yield [dict(row) for row in partition]
+
+#----------------------------------------------------------------------------#
+# Writers.
+#----------------------------------------------------------------------------#
+
+def json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+def write_ndjson(batches, stream):
+    for batch in batches:
+        stream.write(''.join(json.dumps(row, default=json_default) + '\n' for row in batch))
+
+def write_csv(batches, stream, columns):
+    writer = csv.DictWriter(stream, fieldnames=columns)
+    writer.writeheader()
+    for batch in batches:
+        for row in batch:
+            if isinstance(row.get('genres'), list):
+                row['genres'] = ','.join(row['genres'])
+        writer.writerows(batch)
+
+def arrow_schema(pyarrow, columns):
+    # from the table definition rather than from the first batch, where a
+    # column that happens to be all null would be typed null
+    types = {
+        int: pyarrow.int64(),
+        str: pyarrow.string(),
+        bool: pyarrow.bool_(),
+        datetime: pyarrow.timestamp('us')
+    }
+    fields = []
+    for column in columns:
+        type_ = getattr(column.type, 'impl', column.type)
+        if isinstance(type_, ARRAY):
+            arrow_type = pyarrow.list_(pyarrow.string())
+        else:
+            arrow_type = types[type_.python_type]
+        fields.append(pyarrow.field(column.name, arrow_type, nullable=column.nullable))
+    return pyarrow.schema(fields)
+
+def write_parquet(batches, path, compression, columns):
+    # pyarrow is optional and only needed for this format
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise click.UsageError('The parquet format needs pyarrow (pip install pyarrow).')
+    schema = arrow_schema(pyarrow, columns)
+    with pyarrow.parquet.ParquetWriter(path, schema, compression=compression) as writer:
+        for batch in batches:
+            # one row group per batch keeps memory flat
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+
+@contextmanager
+def open_output(path, compression):
+    '''Text stream for path ('-' for stdout), compressed on the fly.'''
+    raw = sys.stdout.buffer if path == '-' else open(path, 'wb')
+    binary = raw
+    if compression == 'gzip':
+        binary = gzip.GzipFile(fileobj=raw, mode='wb')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise click.UsageError('zstd compression needs zstandard (pip install zstandard).')
+        binary = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    stream = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+    try:
+        yield stream
+    finally:
+        stream.flush()
+        stream.detach()
+        if binary is not raw:
+            # writes the compressed stream's trailer, leaves raw open
+            binary.close()
+        if raw is sys.stdout.buffer:
+            raw.flush()
+        else:
+            raw.close()
+
+#----------------------------------------------------------------------------#
+# CLI.
+#----------------------------------------------------------------------------#
+
+@click.command('export')
+@with_appcontext
+@click.argument('kind', type=click.Choice(sorted(MODELS)))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='ndjson', show_default=True)
+@click.option('--output', '-o', default='-', show_default=True, help="File to write, '-' for stdout.")
+@click.option('--compress', type=click.Choice(COMPRESSIONS), default='none', show_default=True)
+@click.option('--since', type=click.DateTime(['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']),
+              help='Only export rows created or changed since then (updated_at, as printed by the last run).')
+@click.option('--batch-size', default=5000, show_default=True)
+def export_command(kind, fmt, output, compress, since, batch_size):
+    '''Stream every venue, artist or show to CSV, NDJSON or Parquet.'''
+    model = MODELS[kind]
+    columns = export_columns(model)
+    batches = export_batches(model, since, batch_size)
+
+    # remember the latest change written so the next run can pass it to
+    # --since
+    last_change = [since]
+
+    def tracked(batches):
+        for batch in batches:
+            if batch:
+                last_change[0] = batch[-1]['updated_at']
+            yield batch
+
+    if fmt == 'parquet':
+        if output == '-':
+            raise click.UsageError('Parquet output needs --output.')
+        write_parquet(tracked(batches), output, compress, columns)
+    else:
+        with open_output(output, compress) as stream:
+            if fmt == 'csv':
+                write_csv(tracked(batches), stream, [column.name for column in columns])
+            else:
+                write_ndjson(tracked(batches), stream)
+    click.echo('Exported {} changed up to {}'.format(
+        kind, last_change[0].isoformat() if last_change[0] else None), err=True)
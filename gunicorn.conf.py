@@ -0,0 +1,60 @@
+#----------------------------------------------------------------------------#
+# gunicorn settings, read from the working directory by `gunicorn wsgi:app`.
+# Every value can be overridden from the environment.
+#----------------------------------------------------------------------------#
+
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:{}'.format(os.environ.get('PORT', 8000)))
+
+# Workers: 2 x cores + 1 by default (WEB_CONCURRENCY is also what Heroku
+# sets). Each worker opens up to DB_POOL_SIZE + DB_MAX_OVERFLOW database
+# connections, so keep workers x that under Postgres' max_connections or
+# set DB_PGBOUNCER.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# config.py reads the worker count from here, e.g. to pick the page cache
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+# gthread: a few threads per worker, no more than the worker's pool
+# hands out connections. gevent: many green threads per worker, for
+# requests that mostly wait on the database (needs gevent and psycogreen).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+# Import the app once in the master and fork the workers from it: faster
+# starts and shared memory for the code. gevent has to patch the standard
+# library before the app is imported, so it does not preload by default.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0' if worker_class == 'gevent' else '1') == '1'
+
+# Recycle workers now and then so slow leaks cannot build up; the jitter
+# keeps them from all restarting at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 blocks the whole worker unless it cooperates with gevent
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    if preload_app:
+        # connections opened in the master must not be shared with the
+        # workers; drop them from the forked pool without closing them
+        from models import app, db
+        db.get_engine(app).dispose(close=False)
+
+
+def post_worker_init(worker):
+    # the autocomplete index is per process: start loading it as soon as
+    # the worker has the app rather than on the first lookup
+    from autocomplete import autocomplete_index
+    autocomplete_index.build_in_background()
@@ -0,0 +1,430 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import hashlib
+import importlib.util
+import io
+import ipaddress
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from urllib.request import HTTPRedirectHandler, Request, build_opener, url2pathname
+
+import click
+from flask import abort, current_app, jsonify, redirect, request, send_file, url_for
+from flask.cli import AppGroup
+from itsdangerous import BadSignature, URLSafeSerializer
+
+#----------------------------------------------------------------------------#
+# Store.
+#----------------------------------------------------------------------------#
+
+# bounding boxes, twice the size the CSS shows them at for high-DPI screens
+SIZES = {
+    'tile': (400, 400),
+    'large': (1000, 1000)
+}
+
+FORMATS = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg'
+}
+
+MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+    (b'RIFF', 'image/webp')
+)
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def sniff_mimetype(data):
+    for magic, mimetype in MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mimetype
+    return 'application/octet-stream'
+
+
+class ImageStore(object):
+    '''Content-addressed image files under one directory, bounded in size.
+
+        originals/ab/<sha256 of the image>
+        thumbs/ab/<sha256 of the original>-<size>.<format>
+        sources/ab/<sha256 of a source URL>, holding its original's sha256
+
+    The same picture linked from several URLs is stored and thumbnailed
+    once. Serving a file refreshes its mtime; when the directory outgrows
+    max_bytes the least recently used files go until it is under 90%.
+    The directory is only walked once the bytes this process wrote since
+    the last walk could have taken it over max_bytes.
+    '''
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+        # size of the directory at the last walk plus what this process
+        # wrote since (overwrites counted in full, which only makes the
+        # next walk come early); None until the first walk
+        self._size = None
+
+    def path(self, kind, name):
+        return os.path.join(self.root, kind, name[:2], name)
+
+    def _write(self, path, data):
+        # written to a temporary file and renamed, so readers never see
+        # half a file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._evict_lock:
+            if self._size is not None:
+                self._size += len(data)
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_original(self, data):
+        digest = sha256(data)
+        path = self.path('originals', digest)
+        if not os.path.exists(path):
+            self._write(path, data)
+        return digest
+
+    def original(self, digest):
+        return self._read(self.path('originals', digest))
+
+    def link_source(self, src, digest):
+        self._write(self.path('sources', sha256(src.encode('utf-8'))), digest.encode('ascii'))
+
+    def source_digest(self, src):
+        digest = self._read(self.path('sources', sha256(src.encode('utf-8'))))
+        return digest.decode('ascii') if digest else None
+
+    def thumbnail_path(self, digest, size, fmt):
+        return self.path('thumbs', '{}-{}.{}'.format(digest, size, fmt))
+
+    def put_thumbnail(self, digest, size, fmt, data):
+        self._write(self.thumbnail_path(digest, size, fmt), data)
+
+    def touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def evict(self):
+        '''Deletes least recently used files while over the size bound.'''
+        with self._evict_lock:
+            if self._size is not None and self._size <= self.max_bytes:
+                return 0
+            files = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            evicted = 0
+            if total > self.max_bytes:
+                for _, size, path in sorted(files):
+                    if total <= self.max_bytes * 0.9:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+                    evicted += 1
+            self._size = total
+            return evicted
+
+#----------------------------------------------------------------------------#
+# Fetching and resizing.
+#----------------------------------------------------------------------------#
+
+def check_host(url):
+    # image links are typed in by users: never let them point the server
+    # at itself or at the private network
+    host = urlsplit(url).hostname
+    if not host:
+        raise ValueError('No host in {}'.format(url))
+    for *_, sockaddr in socket.getaddrinfo(host, None):
+        address = ipaddress.ip_address(sockaddr[0])
+        if address.is_private or address.is_loopback or address.is_link_local or address.is_reserved:
+            raise ValueError('{} resolves to a private address'.format(host))
+
+
+class CheckedRedirectHandler(HTTPRedirectHandler):
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_host(newurl)
+        return super(CheckedRedirectHandler, self).redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def fetch_image(src, max_bytes, timeout, allow_local=False):
+    '''Downloads an image link. file:// links and private hosts are only
+    followed with allow_local (IMAGE_FETCH_LOCAL), for tests and development.'''
+    scheme = urlsplit(src).scheme
+    if scheme == 'file' and allow_local:
+        with open(url2pathname(urlsplit(src).path), 'rb') as f:
+            data = f.read(max_bytes + 1)
+    elif scheme in ('http', 'https'):
+        if allow_local:
+            opener = build_opener()
+        else:
+            check_host(src)
+            opener = build_opener(CheckedRedirectHandler)
+        with opener.open(Request(src, headers={'User-Agent': 'Fyyur thumbnailer'}), timeout=timeout) as response:
+            if not response.headers.get('Content-Type', '').startswith('image/'):
+                raise ValueError('{} is not an image'.format(src))
+            data = response.read(max_bytes + 1)
+    else:
+        raise ValueError('Cannot fetch {}'.format(src))
+    if len(data) > max_bytes:
+        raise ValueError('{} is larger than {} bytes'.format(src, max_bytes))
+    return data
+
+def make_thumbnail(data, size, fmt):
+    '''Scales an image down to fit the size's bounding box, as WebP or JPEG.'''
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(SIZES[size], Image.LANCZOS)
+        if fmt == 'jpeg' and image.mode != 'RGB':
+            # JPEG has no alpha channel: flatten onto white
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        out = io.BytesIO()
+        if fmt == 'webp':
+            image.save(out, 'WEBP', quality=80, method=4)
+        else:
+            image.save(out, 'JPEG', quality=82, optimize=True, progressive=True)
+        return out.getvalue()
+
+#----------------------------------------------------------------------------#
+# Thumbnailer.
+#----------------------------------------------------------------------------#
+
+class Thumbnailer(object):
+    '''Serves resized copies of venue and artist images.
+
+    Templates call thumbnail_url(image_link, size), which points at
+    /images/<size>/<token>; the token is the image link signed with
+    SECRET_KEY, so only links the app itself rendered are ever fetched.
+    A thumbnail that is not in the store yet is generated by a background
+    thread while the request is redirected to the original image; later
+    requests get the stored WebP (or JPEG) file. Thumbnails are off, and
+    image links rendered as they are, when IMAGE_THUMBNAILS_ENABLED is
+    off or Pillow is not installed.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pending = set()
+        # src -> time of the last failure, not retried for a while
+        self._failed = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('IMAGE_THUMBNAILS_ENABLED', True)
+        if self.enabled:
+            if importlib.util.find_spec('PIL') is None:
+                app.logger.warning('Pillow is not installed, image thumbnails are off')
+                self.enabled = False
+        root = app.config.get('IMAGE_CACHE_DIR') or os.path.join(app.instance_path, 'images')
+        self.store = ImageStore(root, app.config.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+        app.add_url_rule('/images/<size>/<token>', 'thumbnail', self.send_thumbnail)
+        app.add_url_rule('/images/originals/<digest>', 'image_original', self.send_original)
+        app.add_url_rule('/images', 'upload_image', self.upload, methods=['POST'])
+        app.add_template_global(self.url, 'thumbnail_url')
+        app.cli.add_command(images_cli)
+
+    def _serializer(self):
+        return URLSafeSerializer(current_app.secret_key, salt='thumbnail')
+
+    def url(self, src, size='tile'):
+        if not src or not self.enabled:
+            return src
+        return url_for('thumbnail', size=size, token=self._serializer().dumps(src))
+
+    #  Background work
+    #  ----------------------------------------------------------------
+
+    def _executor(self):
+        # threads do not survive a fork: one pool per worker process
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.app.config.get('IMAGE_WORKERS', 2), thread_name_prefix='thumbnails')
+                self._pending = set()
+                self._pid = os.getpid()
+            return self._pool
+
+    def schedule(self, src):
+        retry_after = self.app.config.get('IMAGE_RETRY_SECONDS', 300)
+        executor = self._executor()
+        with self._lock:
+            if src in self._pending or time.time() - self._failed.get(src, 0) < retry_after:
+                return
+            self._pending.add(src)
+        executor.submit(self._generate_logged, src)
+
+    def _generate_logged(self, src):
+        try:
+            self.generate(src)
+        except Exception as error:
+            with self._lock:
+                if len(self._failed) > 10000:
+                    self._failed.clear()
+                self._failed[src] = time.time()
+            self.app.logger.warning(json.dumps({'event': 'thumbnail_failed', 'src': src, 'error': str(error)}))
+        finally:
+            with self._lock:
+                self._pending.discard(src)
+
+    def _original_for(self, src):
+        # uploads link to /images/originals/<digest> and need no fetching
+        path = urlsplit(src).path
+        prefix = '/images/originals/'
+        if not urlsplit(src).netloc and path.startswith(prefix):
+            return self.store.original(path[len(prefix):])
+        config = self.app.config
+        return fetch_image(
+            src,
+            config.get('IMAGE_MAX_SOURCE_BYTES', 10 * 1024 * 1024),
+            config.get('IMAGE_FETCH_TIMEOUT', 10),
+            config.get('IMAGE_FETCH_LOCAL', False)
+        )
+
+    def generate(self, src):
+        '''Stores the original of src and every thumbnail of it. Returns the
+        number of thumbnails written.'''
+        digest = self.store.source_digest(src)
+        data = self.store.original(digest) if digest else None
+        if data is None:
+            data = self._original_for(src)
+            if data is None:
+                raise ValueError('{} is not in the store'.format(src))
+            digest = self.store.put_original(data)
+            self.store.link_source(src, digest)
+        written = 0
+        for size in SIZES:
+            for fmt in FORMATS:
+                if not os.path.exists(self.store.thumbnail_path(digest, size, fmt)):
+                    self.store.put_thumbnail(digest, size, fmt, make_thumbnail(data, size, fmt))
+                    written += 1
+        if written:
+            self.store.evict()
+        return written
+
+    #  Views
+    #  ----------------------------------------------------------------
+
+    def send_thumbnail(self, size, token):
+        if size not in SIZES or not self.enabled:
+            abort(404)
+        try:
+            src = self._serializer().loads(token)
+        except BadSignature:
+            abort(404)
+        # only browsers that name WebP get it, */* does not count
+        fmt = 'webp' if any(value == 'image/webp' for value, _ in request.accept_mimetypes) else 'jpeg'
+        digest = self.store.source_digest(src)
+        path = self.store.thumbnail_path(digest, size, fmt) if digest else None
+        if path is None or not os.path.exists(path):
+            self.schedule(src)
+            # not ready yet: the full image this once
+            response = redirect(src)
+            response.cache_control.no_store = True
+            return response
+        self.store.touch(path)
+        response = send_file(path, mimetype=FORMATS[fmt], max_age=current_app.config.get('IMAGE_MAX_AGE', 86400))
+        response.vary.add('Accept')
+        return response
+
+    def send_original(self, digest):
+        path = self.store.path('originals', digest)
+        if len(digest) != 64 or not os.path.exists(path):
+            abort(404)
+        self.store.touch(path)
+        with open(path, 'rb') as f:
+            mimetype = sniff_mimetype(f.read(16))
+        response = send_file(path, mimetype=mimetype, max_age=current_app.config.get('ASSETS_MAX_AGE', 31536000))
+        # named after its content, so it never changes
+        response.cache_control.immutable = True
+        return response
+
+    def upload(self):
+        # multipart upload of one image; the URL that comes back can be
+        # used as an image_link
+        if not current_app.config.get('IMAGE_UPLOADS_ENABLED') or not self.enabled:
+            abort(404)
+        upload = request.files.get('image')
+        if upload is None:
+            abort(400)
+        max_bytes = current_app.config.get('IMAGE_MAX_SOURCE_BYTES', 10 * 1024 * 1024)
+        data = upload.stream.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            abort(413)
+        from PIL import Image
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image.verify()
+        except Exception:
+            abort(400)
+        digest = self.store.put_original(data)
+        src = url_for('image_original', digest=digest)
+        self.store.link_source(src, digest)
+        self.schedule(src)
+        return jsonify({'url': src, 'thumbnail_url': self.url(src)}), 201
+
+#----------------------------------------------------------------------------#
+# CLI.
+#----------------------------------------------------------------------------#
+
+images_cli = AppGroup('images', help='Manage the image thumbnail store.')
+
+@images_cli.command('warm')
+def warm_command():
+    '''Fetch and thumbnail every venue and artist image now.'''
+    from models import db, thumbnails, Artist, Venue
+    links = set()
+    for model in (Venue, Artist):
+        links.update(link for link, in db.session.query(model.image_link).filter(model.image_link != '').distinct() if link)
+    report = {'links': len(links), 'thumbnails': 0, 'failed': 0}
+    for link in sorted(links):
+        try:
+            report['thumbnails'] += thumbnails.generate(link)
+        except Exception as error:
+            report['failed'] += 1
+            click.echo(json.dumps({'src': link, 'error': str(error)}), err=True)
+    click.echo(json.dumps(report))
+
+@images_cli.command('evict')
+def evict_command():
+    '''Trim the store to IMAGE_CACHE_MAX_BYTES.'''
+    from models import thumbnails
+    click.echo('{} files evicted'.format(thumbnails.store.evict()), err=True)
@@ -0,0 +1,155 @@
+'''Load test of the read pages, synchronous against async reads.
+
+    python loadtest.py --compare
+    python loadtest.py --url http://127.0.0.1:8000 --concurrency 32
+
+--compare starts the app twice against the configured (local Postgres)
+database, once with ASYNC_READS_ENABLED=0 and once with 1, and runs the
+same load against both. The page cache is turned off in both servers so
+every request reaches the database. --url runs the load against a server
+that is already running. The server command can be replaced with
+--server, e.g. "gunicorn -w 4 -k gthread --threads 8 -b 127.0.0.1:{port} app:app".
+'''
+
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    '/venues',
+    '/artists',
+    '/shows',
+    '/venues/1',
+    '/artists/1',
+    '/api/v1/venues/search?search_term=the',
+    '/api/v1/artists/search?search_term=a'
+]
+
+DEFAULT_SERVER = '{python} -m flask run --port {port}'
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def run_load(base_url, paths, concurrency, seconds):
+    '''Each client thread requests the paths round robin over a kept-alive
+    connection until time is up. Returns the summary as a dict.'''
+    url = urlsplit(base_url)
+    deadline = time.perf_counter() + seconds
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(offset):
+        connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        own = []
+        failed = 0
+        i = offset
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                connection.request('GET', url.path.rstrip('/') + path)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+                continue
+            own.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None
+    }
+
+def wait_until_up(base_url, timeout=30):
+    url = urlsplit(base_url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection(url.hostname, url.port, timeout=2)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('{} did not come up'.format(base_url))
+
+def start_server(command, port, async_reads):
+    env = dict(os.environ)
+    env.update({
+        'FLASK_APP': 'app',
+        'ASYNC_READS_ENABLED': '1' if async_reads else '0',
+        'PAGE_CACHE_BACKEND': 'null',
+        'PROFILE_LOG_REQUESTS': '0'
+    })
+    argv = command.format(python=sys.executable, port=port).split()
+    return subprocess.Popen(argv, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Load an already running server instead of starting one.')
+    parser.add_argument('--compare', action='store_true', help='Start a sync and an async server and load both.')
+    parser.add_argument('--server', default=DEFAULT_SERVER, help='Server command, with {port} (and {python}).')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--path', action='append', dest='paths', help='Path to request (repeatable).')
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+
+    if args.url:
+        print(json.dumps(run_load(args.url, paths, args.concurrency, args.seconds)))
+        return
+    if not args.compare:
+        parser.error('pass --url or --compare')
+
+    results = {}
+    for mode, async_reads in (('sync', False), ('async', True)):
+        server = start_server(args.server, args.port, async_reads)
+        base_url = 'http://127.0.0.1:{}'.format(args.port)
+        try:
+            wait_until_up(base_url)
+            # one pass over the paths to open the pools before measuring
+            run_load(base_url, paths, 1, 1)
+            results[mode] = run_load(base_url, paths, args.concurrency, args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+        print(mode, json.dumps(results[mode]))
+    if results['sync']['requests_per_second']:
+        print('async/sync requests per second: {:.2f}'.format(
+            results['async']['requests_per_second'] / results['sync']['requests_per_second']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""index shows by (start_time, id) for the keyset-paginated listing
+
+Revision ID: 2a7d4f1c9e35
+Revises: c3afe66b31d7
+Create Date: 2026-10-17 08:41:52.207733
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2a7d4f1c9e35'
+down_revision = 'c3afe66b31d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # /shows orders and pages on (start_time, id): each page is one range
+    # scan of this index, however deep the cursor
+    op.create_index('ix_shows_start_time_id', 'shows', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_start_time_id', table_name='shows')
@@ -0,0 +1,32 @@
+"""add show and name search indexes
+
+Revision ID: 5b8e2f1a9c47
+Revises: 2a7d4f1c9e35
+Create Date: 2026-10-17 09:12:31.402118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2f1a9c47'
+down_revision = '2a7d4f1c9e35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX ix_venue_name_trgm ON venue USING gin (lower(name) gin_trgm_ops)')
+    op.execute('CREATE INDEX ix_artist_name_trgm ON artist USING gin (lower(name) gin_trgm_ops)')
+
+
+def downgrade():
+    op.drop_index('ix_artist_name_trgm', table_name='artist')
+    op.drop_index('ix_venue_name_trgm', table_name='venue')
+
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
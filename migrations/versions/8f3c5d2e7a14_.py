@@ -0,0 +1,50 @@
+"""full-text search vectors for venues and artists
+
+Revision ID: 8f3c5d2e7a14
+Revises: d1e7a3b6f902
+Create Date: 2026-10-17 14:02:48.113790
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3c5d2e7a14'
+down_revision = 'd1e7a3b6f902'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+    CREATE OR REPLACE FUNCTION search_vector_update() RETURNS trigger AS $$
+    BEGIN
+      NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.seeking_description, '')), 'C');
+      RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute("""
+        CREATE TRIGGER {table}_search_vector_update
+        BEFORE INSERT OR UPDATE OF name, city, state, genres, seeking_description ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE search_vector_update()
+        """.format(table=table))
+        # fire the trigger once for every existing row
+        op.execute('UPDATE {table} SET name = name'.format(table=table))
+        op.create_index('ix_{}_search_vector'.format(table), table, ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    for table in ('artist', 'venue'):
+        op.drop_index('ix_{}_search_vector'.format(table), table_name=table)
+        op.execute('DROP TRIGGER {table}_search_vector_update ON {table}'.format(table=table))
+        op.drop_column(table, 'search_vector')
+    op.execute('DROP FUNCTION search_vector_update()')
@@ -0,0 +1,85 @@
+"""upcoming show counters on venues and artists
+
+Revision ID: a4c9e1f7b305
+Revises: 8f3c5d2e7a14
+Create Date: 2026-10-17 20:14:31.402518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c9e1f7b305'
+down_revision = '8f3c5d2e7a14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('next_show_time', sa.DateTime(), nullable=True))
+        op.create_index('ix_{}_next_show_time'.format(table), table, ['next_show_time'], unique=False)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION refresh_upcoming_show_counts(venue_ids integer[], artist_ids integer[]) RETURNS void AS $$
+    BEGIN
+      -- lock the rows first, so the counts below are taken on a snapshot that
+      -- includes shows committed meanwhile by concurrent writers
+      PERFORM 1 FROM venue WHERE id = ANY(venue_ids) ORDER BY id FOR UPDATE;
+      PERFORM 1 FROM artist WHERE id = ANY(artist_ids) ORDER BY id FOR UPDATE;
+      UPDATE venue SET (upcoming_shows_count, next_show_time) = (
+        SELECT count(*), min(start_time) FROM shows
+        WHERE shows.venue_id = venue.id AND shows.start_time > LOCALTIMESTAMP
+      ) WHERE id = ANY(venue_ids);
+      UPDATE artist SET (upcoming_shows_count, next_show_time) = (
+        SELECT count(*), min(start_time) FROM shows
+        WHERE shows.artist_id = artist.id AND shows.start_time > LOCALTIMESTAMP
+      ) WHERE id = ANY(artist_ids);
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION shows_upcoming_counts_update() RETURNS trigger AS $$
+    BEGIN
+      IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_upcoming_show_counts(
+          ARRAY(SELECT DISTINCT venue_id FROM new_rows),
+          ARRAY(SELECT DISTINCT artist_id FROM new_rows));
+      ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_upcoming_show_counts(
+          ARRAY(SELECT DISTINCT venue_id FROM old_rows),
+          ARRAY(SELECT DISTINCT artist_id FROM old_rows));
+      ELSE
+        PERFORM refresh_upcoming_show_counts(
+          ARRAY(SELECT venue_id FROM old_rows UNION SELECT venue_id FROM new_rows),
+          ARRAY(SELECT artist_id FROM old_rows UNION SELECT artist_id FROM new_rows));
+      END IF;
+      RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    transition_tables = {
+        'insert': 'REFERENCING NEW TABLE AS new_rows',
+        'delete': 'REFERENCING OLD TABLE AS old_rows',
+        'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'
+    }
+    for event, referencing in transition_tables.items():
+        op.execute("""
+        CREATE TRIGGER shows_upcoming_counts_{event}
+        AFTER {event} ON shows {referencing}
+        FOR EACH STATEMENT EXECUTE PROCEDURE shows_upcoming_counts_update()
+        """.format(event=event, referencing=referencing))
+    # count the existing shows once
+    op.execute('SELECT refresh_upcoming_show_counts(ARRAY(SELECT id FROM venue), ARRAY(SELECT id FROM artist))')
+
+
+def downgrade():
+    for event in ('update', 'delete', 'insert'):
+        op.execute('DROP TRIGGER shows_upcoming_counts_{event} ON shows'.format(event=event))
+    op.execute('DROP FUNCTION shows_upcoming_counts_update()')
+    op.execute('DROP FUNCTION refresh_upcoming_show_counts(integer[], integer[])')
+    for table in ('artist', 'venue'):
+        op.drop_index('ix_{}_next_show_time'.format(table), table_name=table)
+        op.drop_column(table, 'next_show_time')
+        op.drop_column(table, 'upcoming_shows_count')
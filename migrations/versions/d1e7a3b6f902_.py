@@ -0,0 +1,54 @@
+"""store genres as text arrays
+
+Revision ID: d1e7a3b6f902
+Revises: 5b8e2f1a9c47
+Create Date: 2026-10-17 11:40:05.817342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1e7a3b6f902'
+down_revision = '5b8e2f1a9c47'
+branch_labels = None
+depends_on = None
+
+# Existing rows hold either the array literal psycopg2 produced for the
+# form's list ('{Jazz,"Hip-Hop"}') or, for hand-written rows, a plain
+# comma separated string. (No LIKE: psycopg2 would read its % as a
+# placeholder.)
+TO_ARRAY = """
+    CASE
+        WHEN genres IS NULL OR btrim(genres) = '' THEN '{}'::varchar(120)[]
+        WHEN left(btrim(genres), 1) = '{' AND right(btrim(genres), 1) = '}' THEN btrim(genres)::varchar(120)[]
+        ELSE string_to_array(btrim(genres), ',')::varchar(120)[]
+    END
+"""
+
+
+def upgrade():
+    for table in ('venue', 'artist'):
+        op.alter_column(table, 'genres',
+                   existing_type=sa.String(length=120),
+                   type_=postgresql.ARRAY(sa.String(length=120)),
+                   postgresql_using=TO_ARRAY)
+        op.execute("UPDATE {} SET genres = ARRAY(SELECT btrim(genre) FROM unnest(genres) AS genre)".format(table))
+        op.alter_column(table, 'genres',
+                   existing_type=postgresql.ARRAY(sa.String(length=120)),
+                   nullable=False,
+                   server_default='{}')
+        op.create_index('ix_{}_genres'.format(table), table, ['genres'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    for table in ('artist', 'venue'):
+        op.drop_index('ix_{}_genres'.format(table), table_name=table)
+        op.alter_column(table, 'genres',
+                   existing_type=postgresql.ARRAY(sa.String(length=120)),
+                   type_=sa.String(length=120),
+                   nullable=True,
+                   server_default=None,
+                   postgresql_using='genres::varchar(120)')
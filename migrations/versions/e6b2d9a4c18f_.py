@@ -0,0 +1,47 @@
+"""change stamps on venues, artists and shows
+
+Revision ID: e6b2d9a4c18f
+Revises: a4c9e1f7b305
+Create Date: 2026-10-17 21:02:47.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b2d9a4c18f'
+down_revision = 'a4c9e1f7b305'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # in UTC; existing rows get the time of the migration
+    for table in ('venue', 'artist', 'shows'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.text("timezone('utc', now())"),
+                                      nullable=False))
+        op.create_index('ix_{}_updated_at'.format(table), table, ['updated_at'], unique=False)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+    BEGIN
+      NEW.updated_at := timezone('utc', clock_timestamp());
+      RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    for table in ('venue', 'artist', 'shows'):
+        op.execute("""
+        CREATE TRIGGER {table}_touch_updated_at
+        BEFORE UPDATE ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE touch_updated_at()
+        """.format(table=table))
+
+
+def downgrade():
+    for table in ('shows', 'artist', 'venue'):
+        op.execute('DROP TRIGGER {table}_touch_updated_at ON {table}'.format(table=table))
+    op.execute('DROP FUNCTION touch_updated_at()')
+    for table in ('shows', 'artist', 'venue'):
+        op.drop_index('ix_{}_updated_at'.format(table), table_name=table)
+        op.drop_column(table, 'updated_at')
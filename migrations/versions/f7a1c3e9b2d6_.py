@@ -0,0 +1,36 @@
+"""row versions on venues and artists, idempotency keys
+
+Revision ID: f7a1c3e9b2d6
+Revises: e6b2d9a4c18f
+Create Date: 2026-10-17 22:14:09.530217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a1c3e9b2d6'
+down_revision = 'e6b2d9a4c18f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venue', 'artist'):
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.create_table('idempotency_keys',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('scope', sa.String(length=120), nullable=False),
+    sa.Column('outcome', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_idempotency_keys_created_at'), 'idempotency_keys', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_idempotency_keys_created_at'), table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
+    for table in ('artist', 'venue'):
+        op.drop_column(table, 'version')
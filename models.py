@@ -2,10 +2,23 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+from datetime import datetime, timezone
+
 from flask import Flask
 from flask_migrate import Migrate
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, JSON, Text, event, func
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from assets import Assets
+from async_db import AsyncReads
+from cache import PageCache
+from compression import Compressor
+from db_pool import engine_options
+from images import Thumbnailer
+from profiling import RequestProfiler
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -14,15 +27,48 @@ from flask_sqlalchemy import SQLAlchemy
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
 db = SQLAlchemy(app)
 
 # TODO: connect to a local postgresql database
 migrate = Migrate(app, db)
+page_cache = PageCache(app, db)
+profiler = RequestProfiler(app, db)
+async_reads = AsyncReads(app)
+assets = Assets(app)
+thumbnails = Thumbnailer(app)
+# after the profiler, so that its after_request hook runs first
+compressor = Compressor(app)
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+# Postgres types; the SQLite variants only let the schema be created for
+# local benchmark runs (see benchmark.py), where search and genre filters
+# are not supported
+GENRES = ARRAY(db.String(120)).with_variant(JSON, 'sqlite')
+SEARCH_VECTOR = TSVECTOR().with_variant(Text, 'sqlite')
+
+# updated_at is kept in UTC, whatever the time zone of the app's host or
+# of the database session, since it becomes the Last-Modified date of the
+# pages (see cache.conditional())
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class utc_now(FunctionElement):
+    type = db.DateTime()
+    inherit_cache = True
+
+@compiles(utc_now, 'postgresql')
+def compile_utc_now_postgresql(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+@compiles(utc_now)
+def compile_utc_now(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is UTC
+    return 'CURRENT_TIMESTAMP'
+
 # TODO: implement model/table for shows
 class Venue(db.Model):
     __tablename__ = 'venue'
@@ -37,22 +83,35 @@ class Venue(db.Model):
     facebook_link = db.Column(db.String(120))
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
-    genres = db.Column(db.String(120))
+    genres = db.Column(GENRES, nullable=False, default=list, server_default='{}')
     website_link = db.Column(db.String(256))
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(512))
+    # maintained by the search_vector_update trigger, never set directly
+    search_vector = db.deferred(db.Column(SEARCH_VECTOR))
+    # maintained by the shows_upcoming_counts triggers, never set directly
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_time = db.Column(db.DateTime, index=True)
+    # bumped on every change, including the counter updates above
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=utcnow,
+                           onupdate=utcnow, server_default=utc_now())
+    # optimistic locking: every ORM update checks and bumps it, so an edit
+    # made from a stale form fails instead of overwriting (see writes.py).
+    # The counter triggers leave it alone.
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     shows = db.relationship('Show', backref="venue", lazy=True)
 
+    __mapper_args__ = {'version_id_col': version}
+
     def __repr__(self):
       return f'<Venue name={self.name}, city={self.city}, state={self.state}, address={self.address}, genres={self.genres}>'
     
+    # staged in the current transaction, committed by writes.py
     def create(self):
       db.session.add(self)
-      db.session.commit()
 
     def delete(self):
       db.session.delete(self)
-      db.session.commit()
 
 class Artist(db.Model):
     __tablename__ = 'artist'
@@ -62,7 +121,7 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.Column(GENRES, nullable=False, default=list, server_default='{}')
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
 
@@ -70,18 +129,29 @@ class Artist(db.Model):
     website_link = db.Column(db.String(256))
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(512))
+    # maintained by the search_vector_update trigger, never set directly
+    search_vector = db.deferred(db.Column(SEARCH_VECTOR))
+    # maintained by the shows_upcoming_counts triggers, never set directly
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_show_time = db.Column(db.DateTime, index=True)
+    # bumped on every change, including the counter updates above
+    updated_at = db.Column(db.DateTime, nullable=False, index=True, default=utcnow,
+                           onupdate=utcnow, server_default=utc_now())
+    # optimistic locking, as on Venue
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     shows = db.relationship('Show', backref="artist", lazy=True)
 
+    __mapper_args__ = {'version_id_col': version}
+
     def __repr__(self):
       return f'<Artist name={self.name}, city={self.city}, state={self.state}, address={self.address}, genres={self.genres}>'
     
+    # staged in the current transaction, committed by writes.py
     def create(self):
       db.session.add(self)
-      db.session.commit()
 
     def delete(self):
       db.session.delete(self)
-      db.session.commit()
 
 class Show(db.Model):
   __tablename__ = 'shows'
@@ -90,14 +160,213 @@ class Show(db.Model):
   artist_id = db.Column(db.Integer, db.ForeignKey('artist.id'), nullable=False)
   venue_id = db.Column(db.Integer, db.ForeignKey('venue.id'), nullable=False)
   start_time = db.Column(db.DateTime, nullable=False)
+  updated_at = db.Column(db.DateTime, nullable=False, index=True, default=utcnow,
+                         onupdate=utcnow, server_default=utc_now())
+
+  # detail pages and upcoming-show counts filter on one side of the show
+  # and a start_time range; the show listing pages through
+  # (start_time, id) and the page stamps look up the latest started show
+  __table_args__ = (
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+  )
 
   def __repr__(self):
     return f'<Show artist_id={self.artist_id}, venue_id={self.venue_id}>'
 
+  # staged in the current transaction, committed by writes.py
   def create(self):
-      db.session.add(self)
-      db.session.commit()
+    db.session.add(self)
 
   def delete(self):
     db.session.delete(self)
-    db.session.commit()
\ No newline at end of file
+
+class IdempotencyKey(db.Model):
+  __tablename__ = 'idempotency_keys'
+
+  # one per rendered form: a second submit of the same form finds its key
+  # and gets the outcome of the first instead of writing again
+  key = db.Column(db.String(64), primary_key=True)
+  scope = db.Column(db.String(120), nullable=False)
+  outcome = db.Column(db.JSON)
+  created_at = db.Column(db.DateTime, nullable=False, index=True, default=datetime.now)
+
+  def __repr__(self):
+    return f'<IdempotencyKey key={self.key}, scope={self.scope}>'
+
+#----------------------------------------------------------------------------#
+# Search indexes.
+#----------------------------------------------------------------------------#
+
+# trigram indexes let the case-insensitive `lower(name) LIKE '%term%'`
+# searches use an index scan instead of a sequential scan
+event.listen(
+  db.metadata,
+  'before_create',
+  DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+db.Index(
+  'ix_venue_name_trgm',
+  func.lower(Venue.name).label('name_lower'),
+  postgresql_using='gin',
+  postgresql_ops={'name_lower': 'gin_trgm_ops'}
+)
+
+db.Index(
+  'ix_artist_name_trgm',
+  func.lower(Artist.name).label('name_lower'),
+  postgresql_using='gin',
+  postgresql_ops={'name_lower': 'gin_trgm_ops'}
+)
+
+# genre filters use the array containment operator (genres @> ARRAY[...]),
+# which is answered from these indexes
+db.Index('ix_venue_genres', Venue.genres, postgresql_using='gin')
+
+db.Index('ix_artist_genres', Artist.genres, postgresql_using='gin')
+
+# full-text search over name, city/state, genres and seeking_description.
+# The 'simple' configuration keeps names unstemmed, so prefix queries
+# ('hop:*') match the way people type them.
+SEARCH_VECTOR_FUNCTION = """
+CREATE OR REPLACE FUNCTION search_vector_update() RETURNS trigger AS $$
+BEGIN
+  NEW.search_vector :=
+    setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(NEW.city, '') || ' ' || coalesce(NEW.state, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(array_to_string(NEW.genres, ' '), '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(NEW.seeking_description, '')), 'C');
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+SEARCH_VECTOR_TRIGGER = """
+CREATE TRIGGER {table}_search_vector_update
+BEFORE INSERT OR UPDATE OF name, city, state, genres, seeking_description ON {table}
+FOR EACH ROW EXECUTE PROCEDURE search_vector_update()
+"""
+
+event.listen(
+  db.metadata,
+  'after_create',
+  DDL(SEARCH_VECTOR_FUNCTION).execute_if(dialect='postgresql')
+)
+
+for table in ('venue', 'artist'):
+  event.listen(
+    db.metadata,
+    'after_create',
+    DDL(SEARCH_VECTOR_TRIGGER.format(table=table)).execute_if(dialect='postgresql')
+  )
+
+db.Index('ix_venue_search_vector', Venue.search_vector, postgresql_using='gin')
+
+db.Index('ix_artist_search_vector', Artist.search_vector, postgresql_using='gin')
+
+#----------------------------------------------------------------------------#
+# Upcoming show counters.
+#----------------------------------------------------------------------------#
+
+# every venue and artist carries its number of upcoming shows and the start
+# time of the next one, recounted by statement-level triggers whenever shows
+# are inserted, updated or deleted (bulk imports included). A counter only
+# goes stale when its next show starts; `flask counters refresh` recounts
+# those rows and the listings recount them on the fly until it has run.
+UPCOMING_COUNTS_FUNCTION = """
+CREATE OR REPLACE FUNCTION refresh_upcoming_show_counts(venue_ids integer[], artist_ids integer[]) RETURNS void AS $$
+BEGIN
+  -- lock the rows first, so the counts below are taken on a snapshot that
+  -- includes shows committed meanwhile by concurrent writers
+  PERFORM 1 FROM venue WHERE id = ANY(venue_ids) ORDER BY id FOR UPDATE;
+  PERFORM 1 FROM artist WHERE id = ANY(artist_ids) ORDER BY id FOR UPDATE;
+  UPDATE venue SET (upcoming_shows_count, next_show_time) = (
+    SELECT count(*), min(start_time) FROM shows
+    WHERE shows.venue_id = venue.id AND shows.start_time > LOCALTIMESTAMP
+  ) WHERE id = ANY(venue_ids);
+  UPDATE artist SET (upcoming_shows_count, next_show_time) = (
+    SELECT count(*), min(start_time) FROM shows
+    WHERE shows.artist_id = artist.id AND shows.start_time > LOCALTIMESTAMP
+  ) WHERE id = ANY(artist_ids);
+END
+$$ LANGUAGE plpgsql
+"""
+
+UPCOMING_COUNTS_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION shows_upcoming_counts_update() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    PERFORM refresh_upcoming_show_counts(
+      ARRAY(SELECT DISTINCT venue_id FROM new_rows),
+      ARRAY(SELECT DISTINCT artist_id FROM new_rows));
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM refresh_upcoming_show_counts(
+      ARRAY(SELECT DISTINCT venue_id FROM old_rows),
+      ARRAY(SELECT DISTINCT artist_id FROM old_rows));
+  ELSE
+    PERFORM refresh_upcoming_show_counts(
+      ARRAY(SELECT venue_id FROM old_rows UNION SELECT venue_id FROM new_rows),
+      ARRAY(SELECT artist_id FROM old_rows UNION SELECT artist_id FROM new_rows));
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# one trigger per event: transition tables need PostgreSQL 10 and cannot
+# be shared between events
+UPCOMING_COUNTS_TRIGGERS = {
+  'insert': 'REFERENCING NEW TABLE AS new_rows',
+  'delete': 'REFERENCING OLD TABLE AS old_rows',
+  'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows'
+}
+
+UPCOMING_COUNTS_TRIGGER = """
+CREATE TRIGGER shows_upcoming_counts_{event}
+AFTER {event} ON shows {transition_tables}
+FOR EACH STATEMENT EXECUTE PROCEDURE shows_upcoming_counts_update()
+"""
+
+for ddl in (UPCOMING_COUNTS_FUNCTION, UPCOMING_COUNTS_TRIGGER_FUNCTION):
+  event.listen(db.metadata, 'after_create', DDL(ddl).execute_if(dialect='postgresql'))
+
+for trigger_event, transition_tables in UPCOMING_COUNTS_TRIGGERS.items():
+  event.listen(
+    db.metadata,
+    'after_create',
+    DDL(UPCOMING_COUNTS_TRIGGER.format(event=trigger_event, transition_tables=transition_tables)).execute_if(dialect='postgresql')
+  )
+
+#----------------------------------------------------------------------------#
+# Change stamps.
+#----------------------------------------------------------------------------#
+
+# updated_at is set by SQLAlchemy on ORM and core writes; the trigger also
+# covers rows changed from inside the database, such as the counter updates
+# of refresh_upcoming_show_counts(). The page stamps in queries.py are
+# built from these columns.
+TOUCH_UPDATED_AT_FUNCTION = """
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+  NEW.updated_at := timezone('utc', clock_timestamp());
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+TOUCH_UPDATED_AT_TRIGGER = """
+CREATE TRIGGER {table}_touch_updated_at
+BEFORE UPDATE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE touch_updated_at()
+"""
+
+event.listen(db.metadata, 'after_create', DDL(TOUCH_UPDATED_AT_FUNCTION).execute_if(dialect='postgresql'))
+
+for table in ('venue', 'artist', 'shows'):
+  event.listen(
+    db.metadata,
+    'after_create',
+    DDL(TOUCH_UPDATED_AT_TRIGGER.format(table=table)).execute_if(dialect='postgresql')
+  )
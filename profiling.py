@@ -0,0 +1,217 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import heapq
+import json
+import time
+
+from flask import current_app, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Request profile.
+#----------------------------------------------------------------------------#
+
+class RequestProfile(object):
+    '''What one request spent on SQL and template rendering.'''
+
+    def __init__(self, keep_slowest):
+        self.started = time.perf_counter()
+        self.keep_slowest = keep_slowest
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        # min-heap of (seconds, sequence, statement, parameters)
+        self.slowest = []
+        # filled in by compression.py while the body is sent
+        self.compression = None
+
+    def record_query(self, statement, parameters, seconds, executemany):
+        self.query_count += 1
+        self.db_seconds += seconds
+        entry = (seconds, self.query_count, statement, None if executemany else parameters)
+        if len(self.slowest) < self.keep_slowest:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def record_compression(self, encoding, bytes_in, bytes_out, cpu_seconds):
+        self.compression = {
+            'encoding': encoding,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'ratio': round(bytes_in / bytes_out, 2) if bytes_out else None,
+            'cpu_ms': round(cpu_seconds * 1000, 2)
+        }
+
+    def slowest_statements(self):
+        return sorted(self.slowest, reverse=True)
+
+    @property
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+
+def current_profile():
+    if has_request_context():
+        return g.get('request_profile')
+    return None
+
+
+class ProfiledTemplate(Template):
+    '''Template that adds its render time to the current request profile.
+
+    Only top level renders go through render() and generate() (streamed
+    pages); extended and included templates are rendered inside them and
+    are not counted twice. For a streamed page, the render time includes
+    the queries the template pulls its rows through.
+    '''
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super(ProfiledTemplate, self).render(*args, **kwargs)
+        finally:
+            profile = current_profile()
+            if profile is not None:
+                profile.render_seconds += time.perf_counter() - start
+
+    def generate(self, *args, **kwargs):
+        profile = current_profile()
+        chunks = super(ProfiledTemplate, self).generate(*args, **kwargs)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                if profile is not None:
+                    profile.render_seconds += time.perf_counter() - start
+            yield chunk
+
+#----------------------------------------------------------------------------#
+# Profiler.
+#----------------------------------------------------------------------------#
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start_time'].pop()
+    profile = current_profile()
+    if profile is not None:
+        profile.record_query(statement, parameters, seconds, executemany)
+
+@event.listens_for(Engine, 'handle_error')
+def drop_query_timer(exception_context):
+    # a failing statement never reaches after_cursor_execute; without this
+    # its start time would stay on the pooled connection for good
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_start_time'):
+        conn.info['query_start_time'].pop()
+
+
+class RequestProfiler(object):
+    '''Records query count, DB time, render time and the slowest statements
+    of every request.
+
+    In debug mode the numbers are sent back as Server-Timing and
+    X-Query-Count headers; otherwise each request is logged as one JSON
+    line once its body has been sent, streamed rendering and compression
+    included. Streamed pages are always logged and never get the headers,
+    which go out before their queries run. Statements slower than PROFILE_SLOW_QUERY_MS are logged
+    together with their EXPLAIN output.
+    '''
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        if not app.config.get('PROFILE_ENABLED', True):
+            return
+        app.jinja_env.template_class = ProfiledTemplate
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g.request_profile = RequestProfile(current_app.config.get('PROFILE_SLOWEST_STATEMENTS', 3))
+
+    def _finish(self, response):
+        # the profile stays on g: a streamed page keeps querying while its
+        # body is sent, after this hook
+        profile = g.get('request_profile')
+        if profile is None:
+            return response
+
+        # the headers of a streamed page are sent before its body renders
+        # and would only count the queries of the view itself
+        streamed = response.is_streamed
+        if current_app.debug and not streamed:
+            response.headers['X-Query-Count'] = str(profile.query_count)
+            response.headers['Server-Timing'] = ', '.join([
+                'db;dur={:.1f};desc="{} queries"'.format(profile.db_seconds * 1000, profile.query_count),
+                'render;dur={:.1f}'.format(profile.render_seconds * 1000),
+                'total;dur={:.1f}'.format(profile.total_seconds * 1000)
+            ])
+
+        app = current_app._get_current_object()
+        record = {
+            'event': 'request_profile',
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code
+        }
+
+        def report():
+            if (streamed or not app.debug) and app.config.get('PROFILE_LOG_REQUESTS', True):
+                record.update({
+                    'query_count': profile.query_count,
+                    'db_ms': round(profile.db_seconds * 1000, 2),
+                    'render_ms': round(profile.render_seconds * 1000, 2),
+                    'total_ms': round(profile.total_seconds * 1000, 2),
+                    'slowest': [{
+                        'ms': round(seconds * 1000, 2),
+                        'statement': statement
+                    } for seconds, _, statement, _ in profile.slowest_statements()],
+                    'compression': profile.compression
+                })
+                app.logger.info(json.dumps(record))
+            threshold = app.config.get('PROFILE_SLOW_QUERY_MS')
+            if threshold:
+                for seconds, _, statement, parameters in profile.slowest_statements():
+                    if seconds * 1000 >= threshold:
+                        self._log_slow_statement(app, record['path'], seconds, statement, parameters)
+
+        # reported once the body has been sent, so that the work done while
+        # sending it (streamed rendering, compression) is included
+        response.call_on_close(report)
+        return response
+
+    def _log_slow_statement(self, app, path, seconds, statement, parameters):
+        plan = None
+        if parameters is not None and statement.lstrip().split(None, 1)[0].upper() in ('SELECT', 'WITH'):
+            # EXPLAIN only plans the statement, it does not run it again;
+            # it goes through its own connection outside the request's
+            # transaction, after the response was sent
+            try:
+                with self.db.engine.connect() as connection:
+                    plan = '\n'.join(str(row[0]) for row in connection.exec_driver_sql('EXPLAIN ' + statement, parameters))
+            except Exception as error:
+                plan = 'EXPLAIN failed: {}'.format(error)
+        app.logger.warning(json.dumps({
+            'event': 'slow_query',
+            'path': path,
+            'ms': round(seconds * 1000, 2),
+            'statement': statement,
+            'plan': plan
+        }))
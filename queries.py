@@ -0,0 +1,399 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import re
+from datetime import datetime, timezone
+from itertools import groupby
+from flask import request, abort
+from sqlalchemy import and_, case, func, literal, or_, select, tuple_
+from sqlalchemy.orm import contains_eager
+from models import app, db, page_cache, async_reads, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Queries shared by the HTML views and the JSON API.
+#----------------------------------------------------------------------------#
+
+def all_rows(result):
+  return result.all()
+
+def one_row(result):
+  return result.one()
+
+def all_entities(result):
+  return result.scalars().all()
+
+def first_entity(result):
+  return result.scalars().first()
+
+def fetch(*jobs):
+  # jobs are (query, take) pairs of independent queries, take turning the
+  # result into rows or objects. With ASYNC_READS_ENABLED they run
+  # concurrently through asyncpg, otherwise one after the other on the
+  # request's session.
+  statements = [(query.statement, take) for query, take in jobs]
+  if async_reads.enabled:
+    return async_reads.gather(statements)
+  return [take(db.session.execute(statement)) for statement, take in statements]
+
+def stream_rows(query):
+  # rows read from a server-side cursor, API_STREAM_BATCH_SIZE at a time.
+  # The query runs here, so that a streamed page that fails does so before
+  # it starts to go out.
+  batch_size = app.config['API_STREAM_BATCH_SIZE']
+  return db.session.execute(query.statement, execution_options={'yield_per': batch_size})
+
+def genre_filter(model):
+  # optional ?genre= filter, answered from the GIN index on genres
+  genre = request.values.get('genre')
+  if not genre:
+    return []
+  return [model.genres.contains([genre])]
+
+def upcoming_show_columns(model, show_fk, now):
+  # the stored counters (see models.py) are exact until the next show
+  # starts; rows whose next show has started since the last `flask counters
+  # refresh` are recounted here from the shows table instead
+  fresh = or_(model.next_show_time == None, model.next_show_time > now)
+  upcoming = and_(show_fk == model.id, Show.start_time > now)
+  count = case(
+    (fresh, model.upcoming_shows_count),
+    else_=select(func.count(Show.id)).where(upcoming).scalar_subquery())
+  next_show = case(
+    (fresh, model.next_show_time),
+    else_=select(func.min(Show.start_time)).where(upcoming).scalar_subquery())
+  return count.label('num_upcoming_shows'), next_show.label('next_show')
+
+#  Venues
+#  ----------------------------------------------------------------
+
+def venue_area_query():
+  # every venue with its number of upcoming shows, read from the counter
+  # columns and ordered so that venues of the same area are adjacent
+  return db.session.query(
+      Venue.city,
+      Venue.state,
+      Venue.id,
+      Venue.name,
+      *upcoming_show_columns(Venue, Show.venue_id, datetime.now())
+    ).filter(*genre_filter(Venue))\
+    .order_by(Venue.state, Venue.city, Venue.id)
+
+def group_areas(rows):
+  # one area at a time, as the rows come in
+  for (city, state), area_rows in groupby(rows, key=lambda row: (row.city, row.state)):
+    location = {}
+    location['city'] = city
+    location['state'] = state
+    location['venues'] = []
+    for row in area_rows:
+      # the counts change as soon as the next show starts
+      page_cache.expire_at(row.next_show)
+      location['venues'].append({
+        'id': row.id,
+        'name': row.name,
+        'num_upcoming_shows': row.num_upcoming_shows
+      })
+    yield location
+
+def stream_venue_areas():
+  # the areas read from a server-side cursor, for the streamed page and API
+  return group_areas(stream_rows(venue_area_query()))
+
+def prefix_tsquery(search_term):
+  # every word of the search term as a prefix, all of them required:
+  # "mus hop" -> 'mus:* & hop:*'
+  words = re.findall(r'[^\W_]+', search_term.lower())
+  if not words:
+    return None
+  return func.to_tsquery('simple', ' & '.join(word + ':*' for word in words))
+
+def search_with_upcoming_counts(model, show_fk, search_term):
+  # matched rows with their upcoming show counters and the total number
+  # of matches, one page at a time in one query. Full-text matches on
+  # name, city/state, genres and description are ranked first; plain
+  # substring matches on the name still count.
+  limit = request.values.get('limit', app.config['SEARCH_RESULTS_LIMIT'], type=int)
+  limit = max(1, min(limit, app.config['SEARCH_RESULTS_MAX_LIMIT']))
+  offset = max(0, request.values.get('offset', 0, type=int))
+
+  match = func.lower(model.name).like("%{}%".format(search_term.lower()))
+  rank = literal(0.0)
+  tsquery = prefix_tsquery(search_term)
+  if tsquery is not None:
+    match = or_(model.search_vector.op('@@')(tsquery), match)
+    rank = func.ts_rank_cd(model.search_vector, tsquery)
+
+  num_upcoming_shows, _ = upcoming_show_columns(model, show_fk, datetime.now())
+  query = db.session.query(
+      model.id,
+      model.name,
+      num_upcoming_shows,
+      func.count().over().label('total')
+    ).filter(match)\
+    .filter(*genre_filter(model))\
+    .order_by(rank.desc(), model.name, model.id)\
+    .limit(limit).offset(offset)
+  rows, = fetch((query, all_rows))
+
+  return {
+    "count": rows[0].total if rows else 0,
+    "data": [{
+      'id': row.id,
+      'name': row.name,
+      'num_upcoming_shows': row.num_upcoming_shows
+    } for row in rows],
+    "limit": limit,
+    "offset": offset,
+    "genre": request.values.get('genre', '')
+  }
+
+def split_shows(entity_query, show_fk, entity_id, relationship, related_model):
+  # the venue/artist itself, its upcoming shows in full, one capped page
+  # of past shows (most recent first) and both counts: four independent
+  # queries, fetched together
+  now = datetime.now()
+  per_page = app.config['PAST_SHOWS_PER_PAGE']
+  past_page = max(1, request.args.get('past_page', 1, type=int))
+
+  counts = db.session.query(
+      func.count(Show.id).filter(Show.start_time > now).label('upcoming'),
+      func.count(Show.id).filter(Show.start_time <= now).label('past')
+    ).filter(show_fk == entity_id)
+
+  shows = db.session.query(Show)\
+    .join(related_model, relationship)\
+    .options(contains_eager(relationship))\
+    .filter(show_fk == entity_id)
+  upcoming_shows = shows.filter(Show.start_time > now)\
+    .order_by(Show.start_time, Show.id)
+  past_shows = shows.filter(Show.start_time <= now)\
+    .order_by(Show.start_time.desc(), Show.id.desc())\
+    .limit(per_page).offset((past_page - 1) * per_page)
+
+  entity, counts, upcoming_shows, past_shows = fetch(
+    (entity_query, first_entity),
+    (counts, one_row),
+    (upcoming_shows, all_entities),
+    (past_shows, all_entities)
+  )
+  if entity is None:
+    abort(404)
+  if upcoming_shows:
+    page_cache.expire_at(upcoming_shows[0].start_time)
+
+  return entity, {
+    'upcoming_shows': upcoming_shows,
+    'past_shows': past_shows,
+    'upcoming_shows_count': counts.upcoming,
+    'past_shows_count': counts.past,
+    'past_page': past_page,
+    'past_has_more': past_page * per_page < counts.past
+  }
+
+def venue_detail(venue_id):
+  venue, split = split_shows(Venue.query.filter_by(id = venue_id), Show.venue_id, venue_id, Show.artist, Artist)
+
+  def show_data(show):
+    return {
+      'artist_id': show.artist.id,
+      'artist_name': show.artist.name,
+      'artist_image_link': show.artist.image_link,
+      'start_time': show.start_time
+    }
+
+  data = {}
+  data['id'] = venue.id
+  data['name'] = venue.name
+  data['genres'] = venue.genres
+  data['address'] = venue.address
+  data['city'] = venue.city
+  data['state'] = venue.state
+  data['phone'] = venue.phone
+  data['website'] = venue.website_link
+  data['facebook_link'] = venue.facebook_link
+  data['seeking_talent'] = venue.seeking_talent
+  data['seeking_description'] = venue.seeking_description
+  data['image_link'] = venue.image_link
+  data['past_shows'] = [show_data(show) for show in split['past_shows']]
+  data['upcoming_shows'] = [show_data(show) for show in split['upcoming_shows']]
+  data['past_shows_count'] = split['past_shows_count']
+  data['upcoming_shows_count'] = split['upcoming_shows_count']
+  data['past_page'] = split['past_page']
+  data['past_has_more'] = split['past_has_more']
+
+  return data
+
+#  Artists
+#  ----------------------------------------------------------------
+
+def artist_name_query():
+  return db.session.query(Artist.id, Artist.name)\
+    .filter(*genre_filter(Artist))\
+    .order_by(Artist.id)
+
+def artist_tile(row):
+  append = {}
+  append['id'] = row.id
+  append['name'] = row.name
+  return append
+
+def stream_artists():
+  # the tiles read from a server-side cursor, for the streamed page and API
+  rows = stream_rows(artist_name_query())
+  return (artist_tile(row) for row in rows)
+
+def artist_detail(artist_id):
+  artist, split = split_shows(Artist.query.filter_by(id = artist_id), Show.artist_id, artist_id, Show.venue, Venue)
+
+  def show_data(show):
+    return {
+      'venue_id': show.venue.id,
+      'venue_name': show.venue.name,
+      'venue_image_link': show.venue.image_link,
+      'start_time': show.start_time
+    }
+
+  data = {}
+  data['id'] = artist.id
+  data['name'] = artist.name
+  data['genres'] = artist.genres
+  data['city'] = artist.city
+  data['state'] = artist.state
+  data['phone'] = artist.phone
+  data['website'] = artist.website_link
+  data['facebook_link'] = artist.facebook_link
+  data['seeking_venue'] = artist.seeking_venue
+  data['seeking_description'] = artist.seeking_description
+  data['image_link'] = artist.image_link
+  data['past_shows'] = [show_data(show) for show in split['past_shows']]
+  data['upcoming_shows'] = [show_data(show) for show in split['upcoming_shows']]
+  data['past_shows_count'] = split['past_shows_count']
+  data['upcoming_shows_count'] = split['upcoming_shows_count']
+  data['past_page'] = split['past_page']
+  data['past_has_more'] = split['past_has_more']
+
+  return data
+
+#  Shows
+#  ----------------------------------------------------------------
+
+def encode_show_cursor(start_time, show_id):
+  return '{}_{}'.format(start_time.isoformat(), show_id)
+
+def decode_show_cursor(cursor):
+  # cursors look like "<start_time isoformat>_<show id>"
+  try:
+    start_time, show_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(start_time), int(show_id)
+  except ValueError:
+    abort(400)
+
+def show_listing_query():
+  # the columns a show tile needs, venue and artist joined in
+  return db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+    ).join(Venue, Show.venue_id == Venue.id)\
+    .join(Artist, Show.artist_id == Artist.id)
+
+def show_tile(row):
+  append = {}
+  append['venue_id'] = row.venue_id
+  append['venue_name'] = row.venue_name
+  append['artist_id'] = row.artist_id
+  append['artist_name'] = row.artist_name
+  append['artist_image_link'] = row.artist_image_link
+  append['start_time'] = row.start_time
+  return append
+
+class ShowPage(object):
+  # one page of the show listing, read as the template iterates over it.
+  # Pages are keyed on (start_time, id) so deep pages cost the same as the
+  # first one; next_cursor is known once the page has been read.
+
+  def __init__(self):
+    per_page = request.args.get('per_page', app.config['SHOWS_PER_PAGE'], type=int)
+    self.per_page = max(1, min(per_page, app.config['SHOWS_MAX_PER_PAGE']))
+    self.next_cursor = None
+
+    query = show_listing_query()
+    cursor = request.args.get('after')
+    if cursor:
+      query = query.filter(tuple_(Show.start_time, Show.id) > decode_show_cursor(cursor))
+    # one extra row tells whether there is a next page
+    self.rows = stream_rows(query.order_by(Show.start_time, Show.id).limit(self.per_page + 1))
+
+  def __iter__(self):
+    last = None
+    for i, row in enumerate(self.rows):
+      if i == self.per_page:
+        self.next_cursor = encode_show_cursor(last.start_time, last.id)
+        break
+      last = row
+      yield show_tile(row)
+
+#  Page stamps
+#  ----------------------------------------------------------------
+
+# cheap aggregates over what a page is built from, compared with the
+# client's validators by cache.conditional() before the page itself is
+# queried. Deleting a show touches its venue and artist through the counter
+# triggers, so the venue and artist stamps cover deleted shows too; the
+# latest started show covers pages that change as shows start.
+
+def stamp(*columns):
+  # cache.conditional() takes every datetime of a stamp as UTC: updated_at
+  # is, show times are wall-clock times of the app's host
+  row, = fetch((db.session.query(*columns), one_row))
+  return tuple(
+    value.astimezone(timezone.utc).replace(tzinfo=None)
+    if getattr(column, 'name', None) == 'last_started' and value is not None else value
+    for column, value in zip(columns, row)
+  )
+
+def latest_change(model, *criteria):
+  return select(func.max(model.updated_at)).where(*criteria).scalar_subquery()
+
+def row_count(model):
+  return select(func.count(model.id)).scalar_subquery()
+
+def last_started(*criteria):
+  return select(func.max(Show.start_time)).where(Show.start_time <= datetime.now(), *criteria)\
+    .scalar_subquery().label('last_started')
+
+def venues_stamp():
+  # venue listing and search
+  return stamp(latest_change(Venue), row_count(Venue), last_started())
+
+def artists_stamp():
+  # the artist listing only shows names
+  return stamp(latest_change(Artist), row_count(Artist))
+
+def artist_search_stamp():
+  return stamp(latest_change(Artist), row_count(Artist), last_started())
+
+def shows_stamp():
+  return stamp(latest_change(Show), latest_change(Venue), latest_change(Artist))
+
+def venue_stamp(venue_id):
+  # the venue, the split of its shows and the artists shown with them
+  values = stamp(
+    select(Venue.updated_at).where(Venue.id == venue_id).scalar_subquery(),
+    last_started(Show.venue_id == venue_id),
+    latest_change(Artist)
+  )
+  return values if values[0] is not None else None
+
+def artist_stamp(artist_id):
+  values = stamp(
+    select(Artist.updated_at).where(Artist.id == artist_id).scalar_subquery(),
+    last_started(Show.artist_id == artist_id),
+    latest_change(Venue)
+  )
+  return values if values[0] is not None else None
@@ -0,0 +1,253 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import bisect
+import itertools
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import DDL
+
+from autocomplete import autocomplete_index
+from counters import TARGETS, refresh_counts
+from forms import VenueForm
+from models import db, page_cache, Artist, Show, Venue
+
+#----------------------------------------------------------------------------#
+# Vocabulary.
+#----------------------------------------------------------------------------#
+
+GENRES = [value for value, _ in VenueForm.genres.kwargs['choices']]
+
+CITIES = [
+    ('New York', 'NY'), ('Brooklyn', 'NY'), ('Los Angeles', 'CA'), ('San Francisco', 'CA'),
+    ('Oakland', 'CA'), ('San Diego', 'CA'), ('Chicago', 'IL'), ('Austin', 'TX'),
+    ('Houston', 'TX'), ('Dallas', 'TX'), ('Nashville', 'TN'), ('Memphis', 'TN'),
+    ('New Orleans', 'LA'), ('Atlanta', 'GA'), ('Miami', 'FL'), ('Orlando', 'FL'),
+    ('Seattle', 'WA'), ('Portland', 'OR'), ('Denver', 'CO'), ('Boston', 'MA'),
+    ('Philadelphia', 'PA'), ('Pittsburgh', 'PA'), ('Detroit', 'MI'), ('Minneapolis', 'MN'),
+    ('Kansas City', 'MO'), ('St. Louis', 'MO'), ('Phoenix', 'AZ'), ('Las Vegas', 'NV'),
+    ('Salt Lake City', 'UT'), ('Baltimore', 'MD'), ('Washington', 'DC'), ('Cleveland', 'OH')
+]
+
+ADJECTIVES = [
+    'Blue', 'Electric', 'Velvet', 'Golden', 'Midnight', 'Crimson', 'Silver', 'Wild',
+    'Lonesome', 'Neon', 'Hollow', 'Rusty', 'Little', 'Big', 'Broken', 'Happy',
+    'Northern', 'Southern', 'Lucky', 'Burning', 'Quiet', 'Savage', 'Paper', 'Iron'
+]
+
+NOUNS = [
+    'Owl', 'Lantern', 'Garage', 'Cellar', 'Room', 'Tavern', 'Hall', 'Palace',
+    'Horse', 'River', 'Engine', 'Machine', 'Echo', 'Harbor', 'Lounge', 'Barn',
+    'Comet', 'Wolf', 'Saint', 'Radio', 'Parade', 'Orchard', 'Factory', 'Garden'
+]
+
+VENUE_KINDS = ['Club', 'Hall', 'Theater', 'Bar', 'Ballroom', 'Lounge', 'Room', 'Stage']
+
+FIRST_NAMES = [
+    'Ada', 'Ben', 'Cleo', 'Dev', 'Esme', 'Finn', 'Gus', 'Hana', 'Ira', 'June',
+    'Kai', 'Lena', 'Milo', 'Nina', 'Otis', 'Pia', 'Quinn', 'Rosa', 'Sam', 'Tess'
+]
+
+LAST_NAMES = [
+    'Abbott', 'Brooks', 'Castillo', 'Dunn', 'Ellis', 'Fischer', 'Garza', 'Hayes',
+    'Ito', 'Jensen', 'Kowalski', 'Lund', 'Moreno', 'Nakamura', 'Okafor', 'Price'
+]
+
+#----------------------------------------------------------------------------#
+# Rows.
+#----------------------------------------------------------------------------#
+
+def zipf_cum_weights(n, skew):
+    '''Cumulative weights of ranks 1..n under a Zipf law with exponent
+    `skew`: the most popular row gets about 1/H(n, skew) of all draws.'''
+    return list(itertools.accumulate(1.0 / rank ** skew for rank in range(1, n + 1)))
+
+class Skewed(object):
+    '''Draws row ids with Zipf-distributed popularity.
+
+    Popularity ranks are shuffled over the ids, so the busiest venues and
+    artists are spread through the table rather than being the first ids.
+    '''
+
+    def __init__(self, rng, ids, skew):
+        self.rng = rng
+        self.ids = list(ids)
+        rng.shuffle(self.ids)
+        self.cum_weights = zipf_cum_weights(len(self.ids), skew)
+        self.total = self.cum_weights[-1]
+
+    def draw(self):
+        return self.ids[bisect.bisect(self.cum_weights, self.rng.random() * self.total)]
+
+def link(rng, name, domain):
+    slug = ''.join(c for c in name.lower() if c.isalnum())
+    return 'https://www.{}.com/{}{}'.format(domain, slug, rng.randrange(1000))
+
+def venue_rows(rng, count):
+    for _ in range(count):
+        city, state = rng.choice(CITIES)
+        name = 'The {} {} {}'.format(rng.choice(ADJECTIVES), rng.choice(NOUNS), rng.choice(VENUE_KINDS))
+        seeking = rng.random() < 0.3
+        yield {
+            'name': name,
+            'city': city,
+            'state': state,
+            'address': '{} {} St'.format(rng.randrange(1, 2000), rng.choice(LAST_NAMES)),
+            'phone': '{}-{}-{}'.format(rng.randrange(200, 999), rng.randrange(100, 999), rng.randrange(1000, 9999)),
+            'genres': rng.sample(GENRES, rng.randint(1, 4)),
+            'image_link': 'https://picsum.photos/seed/venue{}/600/400'.format(rng.randrange(10 ** 6)),
+            'facebook_link': link(rng, name, 'facebook'),
+            'website_link': link(rng, name, 'example'),
+            'seeking_talent': seeking,
+            'seeking_description': 'Looking for {} acts on weekends.'.format(rng.choice(GENRES).lower()) if seeking else None
+        }
+
+def artist_rows(rng, count):
+    for _ in range(count):
+        city, state = rng.choice(CITIES)
+        if rng.random() < 0.4:
+            name = '{} {}'.format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        else:
+            name = 'The {} {}s'.format(rng.choice(ADJECTIVES), rng.choice(NOUNS))
+        seeking = rng.random() < 0.4
+        yield {
+            'name': name,
+            'city': city,
+            'state': state,
+            'phone': '{}-{}-{}'.format(rng.randrange(200, 999), rng.randrange(100, 999), rng.randrange(1000, 9999)),
+            'genres': rng.sample(GENRES, rng.randint(1, 3)),
+            'image_link': 'https://picsum.photos/seed/artist{}/600/600'.format(rng.randrange(10 ** 6)),
+            'facebook_link': link(rng, name, 'facebook'),
+            'website_link': link(rng, name, 'example'),
+            'seeking_venue': seeking,
+            'seeking_description': 'Touring {} and nearby, looking for venues.'.format(city) if seeking else None
+        }
+
+def show_rows(rng, count, venues, artists, now, past_days, future_days):
+    # most of a venue's history is behind it; shows start on the half hour
+    # between 6pm and 11:30pm
+    first_day = (now - timedelta(days=past_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    days = past_days + future_days
+    for _ in range(count):
+        yield {
+            'venue_id': venues.draw(),
+            'artist_id': artists.draw(),
+            'start_time': first_day + timedelta(days=rng.randrange(days), minutes=18 * 60 + 30 * rng.randrange(12))
+        }
+
+#----------------------------------------------------------------------------#
+# Loading.
+#----------------------------------------------------------------------------#
+
+# the statement triggers of models.py recount every venue and artist of
+# each inserted batch; for a bulk load, one recount at the end is cheaper
+COUNTER_TRIGGERS = [
+    'shows_upcoming_counts_insert',
+    'shows_upcoming_counts_delete',
+    'shows_upcoming_counts_update'
+]
+
+def set_counter_triggers(enabled):
+    for trigger in COUNTER_TRIGGERS:
+        db.session.execute(DDL('ALTER TABLE shows {} TRIGGER {}'.format('ENABLE' if enabled else 'DISABLE', trigger)))
+    db.session.commit()
+
+def insert_batches(model, rows, batch_size, on_batch=None):
+    inserted = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return inserted
+        db.session.execute(model.__table__.insert(), batch)
+        db.session.commit()
+        inserted += len(batch)
+        if on_batch is not None:
+            on_batch(model, inserted)
+
+def new_ids(model, after):
+    return [id for id, in db.session.query(model.id).filter(model.id > after).order_by(model.id)]
+
+def generate(shows, venues=None, artists=None, seed=0, skew=1.1, past_days=5 * 365,
+             future_days=365, batch_size=10000, on_batch=None):
+    '''Inserts a reproducible synthetic data set and returns a report.
+
+    By default there is one venue per 50 shows and one artist per 20.
+    Shows pick their venue and artist with Zipf-distributed popularity
+    (exponent `skew`), so a handful of venues and artists carry a large
+    share of all shows, as on a real listings site. The same `seed` and
+    sizes always produce the same rows. Rows are added to whatever the
+    tables already hold; shows only go to the venues and artists
+    generated by this run.
+    '''
+    venues = venues or max(10, shows // 50)
+    artists = artists or max(10, shows // 20)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    postgres = db.engine.dialect.name == 'postgresql'
+
+    last_venue = db.session.query(db.func.coalesce(db.func.max(Venue.id), 0)).scalar()
+    last_artist = db.session.query(db.func.coalesce(db.func.max(Artist.id), 0)).scalar()
+    insert_batches(Venue, venue_rows(rng, venues), batch_size, on_batch)
+    insert_batches(Artist, artist_rows(rng, artists), batch_size, on_batch)
+    venue_draws = Skewed(rng, new_ids(Venue, last_venue), skew)
+    artist_draws = Skewed(rng, new_ids(Artist, last_artist), skew)
+
+    if postgres:
+        set_counter_triggers(False)
+    try:
+        rows = show_rows(rng, shows, venue_draws, artist_draws, datetime.now(), past_days, future_days)
+        insert_batches(Show, rows, batch_size, on_batch)
+    finally:
+        if postgres:
+            db.session.rollback()
+            set_counter_triggers(True)
+
+    for model, show_fk in TARGETS.values():
+        refresh_counts(model, show_fk, venue_draws.ids if model is Venue else artist_draws.ids)
+    # core inserts bypass the ORM flush events the page cache and the
+    # autocomplete index listen to
+    for model in (Venue, Artist, Show):
+        page_cache.invalidate(model.__name__)
+    autocomplete_index.mark_stale()
+    if postgres:
+        db.session.commit()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(DDL('ANALYZE venue, artist, shows'))
+
+    seconds = time.perf_counter() - started
+    return {
+        'seed': seed,
+        'skew': skew,
+        'venues': venues,
+        'artists': artists,
+        'shows': shows,
+        'seconds': round(seconds, 1),
+        'shows_per_second': round(shows / seconds, 1) if seconds else None
+    }
+
+#----------------------------------------------------------------------------#
+# CLI.
+#----------------------------------------------------------------------------#
+
+@click.command('synthetic')
+@with_appcontext
+@click.option('--shows', default=100000, show_default=True, help='Number of shows, e.g. 1000 to 10000000.')
+@click.option('--venues', type=int, help='Defaults to one per 50 shows.')
+@click.option('--artists', type=int, help='Defaults to one per 20 shows.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--skew', default=1.1, show_default=True, help='Zipf exponent of venue and artist popularity.')
+@click.option('--batch-size', default=10000, show_default=True)
+def synthetic_command(shows, venues, artists, seed, skew, batch_size):
+    '''Fill the database with reproducible synthetic venues, artists and shows.'''
+
+    def progress(model, inserted):
+        click.echo('{}: {:,}'.format(model.__tablename__, inserted), err=True)
+
+    report = generate(shows, venues, artists, seed, skew, batch_size=batch_size, on_batch=progress)
+    click.echo(json.dumps(report))
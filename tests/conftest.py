@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+import pytest
+
+# config.py reads the environment once, when models.py is first imported:
+# tests run on a throwaway SQLite file unless DATABASE_URL names a scratch
+# database (tests/test_indexes.py needs a Postgres one)
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='fyyur-tests-'), 'fyyur.db'))
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('PAGE_CACHE_BACKEND', 'null')
+os.environ.setdefault('PROFILE_LOG_REQUESTS', '0')
+os.environ.setdefault('IMAGE_THUMBNAILS_ENABLED', '0')
+
+
+@pytest.fixture
+def database():
+    '''The app's database, with empty tables for one test.'''
+    from models import app, db
+    with app.app_context():
+        db.create_all()
+        try:
+            yield db
+        finally:
+            db.session.remove()
+            db.drop_all()
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import app as fyyur
+from models import app, Artist, Venue
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    # batches smaller than the collections, so that they span chunks
+    monkeypatch.setitem(app.config, 'API_STREAM_BATCH_SIZE', 2)
+    return fyyur.app.test_client()
+
+
+def add_all(db, objects):
+    db.session.add_all(objects)
+    db.session.commit()
+
+
+def test_venues_are_streamed_by_area(database, client):
+    add_all(database, [Venue(name='Venue {}'.format(i), city=city, state=state, address='1 Main St',
+                             genres=['Jazz'])
+                       for i, (city, state) in enumerate([('San Francisco', 'CA'), ('New York', 'NY'),
+                                                          ('San Francisco', 'CA'), ('Oakland', 'CA')])])
+
+    response = client.get('/api/v1/venues')
+    assert response.status_code == 200
+    assert response.is_streamed
+    areas = json.loads(response.get_data(as_text=True))['areas']
+    assert [(area['city'], [venue['name'] for venue in area['venues']]) for area in areas] == [
+        ('Oakland', ['Venue 3']),
+        ('San Francisco', ['Venue 0', 'Venue 2']),
+        ('New York', ['Venue 1'])
+    ]
+
+
+def test_artists_are_streamed(database, client):
+    add_all(database, [Artist(name='Artist {}'.format(i), city='San Francisco', state='CA', genres=['Jazz'])
+                       for i in range(5)])
+
+    response = client.get('/api/v1/artists')
+    assert response.status_code == 200
+    assert response.is_streamed
+    artists = json.loads(response.get_data(as_text=True))['artists']
+    assert [artist['name'] for artist in artists] == ['Artist {}'.format(i) for i in range(5)]
+
+
+def test_empty_collection(database, client):
+    assert json.loads(client.get('/api/v1/artists').get_data(as_text=True)) == {'artists': []}
@@ -0,0 +1,62 @@
+import io
+import json
+
+import pytest
+
+import app as fyyur
+import bulk_import
+from models import Venue
+
+
+def venue_line(name, **values):
+    record = dict(name=name, city='San Francisco', state='CA', address='1015 Folsom Street',
+                  genres=['Jazz'], facebook_link='https://www.facebook.com/TheMusicalHop')
+    record.update(values)
+    return json.dumps(record) + '\n'
+
+
+def run_import(*args):
+    result = fyyur.app.test_cli_runner().invoke(args=['import', 'venues'] + list(args))
+    assert result.exit_code == 0, result.output + result.stderr
+    return json.loads(result.stdout)
+
+
+def test_ndjson_import_skips_bad_rows_and_resumes(database, tmp_path):
+    path, checkpoint, errors = tmp_path / 'venues.ndjson', tmp_path / 'checkpoint', tmp_path / 'errors.ndjson'
+    path.write_text(venue_line('Venue 1') + venue_line('Venue 2') + venue_line('Venue 3', city=''))
+    options = [str(path), '--batch-size', '2', '--checkpoint', str(checkpoint), '--errors', str(errors)]
+
+    report = run_import(*options)
+    assert (report['inserted'], report['failed'], report['last_line']) == (2, 1, 3)
+    assert checkpoint.read_text() == '3'
+    assert [json.loads(line)['line'] for line in errors.read_text().splitlines()] == [3]
+
+    # the file grew since; the second run starts after the checkpoint
+    with path.open('a') as f:
+        f.write(venue_line('Venue 4') + venue_line('Venue 5'))
+    report = run_import(*options)
+    assert (report['skipped'], report['inserted'], report['failed']) == (3, 2, 0)
+    assert sorted(name for name, in database.session.query(Venue.name)) == \
+        ['Venue 1', 'Venue 2', 'Venue 4', 'Venue 5']
+
+
+@pytest.mark.parametrize('asked, used', [('0', 1), ('-5', 1), ('3', 3), ('1000000', 10)])
+def test_upload_batch_size_is_clamped(database, monkeypatch, asked, used):
+    monkeypatch.setitem(fyyur.app.config, 'IMPORT_UPLOADS_ENABLED', True)
+    monkeypatch.setitem(fyyur.app.config, 'IMPORT_MAX_BATCH_SIZE', 10)
+    batch_sizes = []
+    import_records = bulk_import.import_records
+
+    def spy(kind, records, batch_size, *args, **kwargs):
+        batch_sizes.append(batch_size)
+        return import_records(kind, records, batch_size, *args, **kwargs)
+
+    monkeypatch.setattr(bulk_import, 'import_records', spy)
+    upload = io.BytesIO((venue_line('Venue 1') + venue_line('Venue 2')).encode('utf-8'))
+    response = fyyur.app.test_client().post('/import/venues', data={
+        'file': (upload, 'venues.ndjson'),
+        'batch_size': asked
+    })
+    assert response.status_code == 200
+    assert response.get_json()['inserted'] == 2
+    assert batch_sizes == [used]
@@ -0,0 +1,131 @@
+import os
+import runpy
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+from cache import PageCache, RedisCache
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.py')
+
+
+class FakeRedis(object):
+    '''The redis-py calls RedisCache makes, on a dict. Values come back as
+    bytes, as they do from a server.'''
+
+    def __init__(self):
+        self.values = {}
+        self.expiries = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value.encode('utf-8') if isinstance(value, str) else value
+        self.expiries[key] = ex
+
+    def incr(self, key):
+        value = int(self.values.get(key, 0)) + 1
+        self.values[key] = str(value).encode('utf-8')
+        return value
+
+
+@pytest.fixture
+def site():
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', SQLALCHEMY_TRACK_MODIFICATIONS=False,
+                      SECRET_KEY='test', PAGE_CACHE_TIMEOUT=60)
+    db = SQLAlchemy(app)
+
+    class Venue(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String)
+
+    class Show(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    page_cache = PageCache(app, db)
+    redis = FakeRedis()
+    page_cache.backend = RedisCache(redis, prefix='test:')
+    renders = []
+
+    @app.route('/venues')
+    @page_cache.cached(Venue)
+    def venues():
+        renders.append('venues')
+        return ', '.join(venue.name for venue in Venue.query.order_by(Venue.id))
+
+    @app.route('/shows')
+    @page_cache.cached(Show)
+    def shows():
+        renders.append('shows')
+        return str(Show.query.count())
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Venue(name='The Musical Hop'))
+        db.session.commit()
+        yield SimpleNamespace(client=app.test_client(), db=db, redis=redis, renders=renders, Venue=Venue)
+
+
+def page_keys(redis):
+    return sorted(key for key in redis.values if key.startswith('test:page:'))
+
+
+def test_pages_are_stored_under_their_generations(site):
+    first = site.client.get('/venues?genre=Jazz').get_data(as_text=True)
+    second = site.client.get('/venues?genre=Jazz').get_data(as_text=True)
+
+    assert first == second == 'The Musical Hop'
+    assert site.renders == ['venues']
+    # the setup committed one venue
+    assert page_keys(site.redis) == ['test:page:/venues?genre=Jazz:1:']
+    assert site.redis.expiries['test:page:/venues?genre=Jazz:1:'] == 60
+
+
+def test_query_arguments_are_part_of_the_key(site):
+    site.client.get('/venues?genre=Jazz')
+    site.client.get('/venues?genre=Rock')
+
+    assert site.renders == ['venues', 'venues']
+    assert page_keys(site.redis) == ['test:page:/venues?genre=Jazz:1:', 'test:page:/venues?genre=Rock:1:']
+
+
+def test_commit_invalidates_the_pages_of_the_changed_model_only(site):
+    site.client.get('/venues')
+    site.client.get('/shows')
+    site.db.session.add(site.Venue(name='The Dueling Pianos Bar'))
+    site.db.session.commit()
+
+    assert site.redis.values['test:generation:Venue'] == b'2'
+    assert site.client.get('/venues').get_data(as_text=True) == 'The Musical Hop, The Dueling Pianos Bar'
+    assert site.client.get('/shows').get_data(as_text=True) == '0'
+    assert site.renders == ['venues', 'shows', 'venues']
+    assert 'test:page:/venues?:2:' in page_keys(site.redis)
+
+
+def test_rollback_keeps_the_generations(site):
+    site.client.get('/venues')
+    site.db.session.add(site.Venue(name='Park Square Live Music & Coffee'))
+    site.db.session.flush()
+    site.db.session.rollback()
+
+    assert site.redis.values['test:generation:Venue'] == b'1'
+    assert site.client.get('/venues').get_data(as_text=True) == 'The Musical Hop'
+    assert site.renders == ['venues']
+
+
+@pytest.mark.parametrize('workers, backend', [(None, 'lru'), ('1', 'lru'), ('9', 'null')])
+def test_lru_is_only_the_default_with_one_worker(monkeypatch, workers, backend):
+    monkeypatch.delenv('PAGE_CACHE_BACKEND', raising=False)
+    if workers is None:
+        monkeypatch.delenv('WEB_CONCURRENCY', raising=False)
+    else:
+        monkeypatch.setenv('WEB_CONCURRENCY', workers)
+
+    assert runpy.run_path(CONFIG)['PAGE_CACHE_BACKEND'] == backend
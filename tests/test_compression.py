@@ -0,0 +1,25 @@
+import zlib
+
+from compression import SLICE_SIZE, Compressor, GzipEncoder
+
+
+def encode(chunks, streamed=True):
+    compressor = Compressor()
+    body = compressor._encode(iter(chunks), GzipEncoder(6), True, streamed, None, 'gzip')
+    return zlib.decompress(b''.join(body), 31)
+
+
+def test_indentation_is_collapsed():
+    assert encode([b'<ul>\n    <li>a</li>\n\n    <li>b</li>\n</ul>']) == b'<ul>\n<li>a</li>\n<li>b</li>\n</ul>'
+
+
+def test_pre_cut_between_chunks_keeps_its_whitespace():
+    body = encode([b'<div>\n    <p>x</p>\n    <pr', b'e>\n    a\n        b</pre>\n    </div>'])
+    assert body == b'<div>\n<p>x</p>\n<pre>\n    a\n        b</pre>\n    </div>'
+
+
+def test_textarea_cut_between_slices_keeps_its_whitespace():
+    head = b'<div>\n  ' + b'x' * (SLICE_SIZE - len(b'<div>\n  ') - len(b'<text'))
+    page = head + b'<textarea>\n  a\n  b</textarea>'
+    assert len(page) > SLICE_SIZE
+    assert encode([page], streamed=False) == b'<div>\n' + page[len(b'<div>\n  '):]
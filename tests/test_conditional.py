@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from werkzeug.http import http_date, parse_date
+
+import app as fyyur
+from models import Show, Venue
+
+
+@pytest.fixture
+def client(database):
+    return fyyur.app.test_client()
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    # a host that is not on UTC
+    monkeypatch.setenv('TZ', 'America/New_York')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def add_venue(db, **values):
+    venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street',
+                  genres=['Jazz'], **values)
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+
+def test_updated_at_is_utc(database, new_york):
+    venue_id = add_venue(database)
+    venue = database.session.get(Venue, venue_id)
+    assert abs(venue.updated_at - utc_now()) < timedelta(minutes=1)
+
+    venue.updated_at = utc_now() - timedelta(days=1)
+    database.session.commit()
+    venue.name = 'The Dueling Pianos Bar'
+    database.session.commit()
+    assert abs(venue.updated_at - utc_now()) < timedelta(minutes=1)
+
+
+def test_last_modified_is_the_utc_change_time(database, client, new_york):
+    changed = utc_now().replace(microsecond=0) - timedelta(minutes=5)
+    venue_id = add_venue(database, updated_at=changed)
+
+    response = client.get('/api/v1/venues/{}'.format(venue_id))
+    assert response.status_code == 200
+    assert response.headers['Last-Modified'] == http_date(changed.replace(tzinfo=timezone.utc))
+
+
+def test_matching_etag_gets_304(database, client):
+    venue_id = add_venue(database)
+    etag = client.get('/api/v1/venues/{}'.format(venue_id)).headers['ETag']
+
+    response = client.get('/api/v1/venues/{}'.format(venue_id), headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == b''
+
+
+def test_if_modified_since_gets_304(database, client, new_york):
+    venue_id = add_venue(database, updated_at=utc_now() - timedelta(minutes=5))
+    last_modified = client.get('/api/v1/venues/{}'.format(venue_id)).headers['Last-Modified']
+
+    response = client.get('/api/v1/venues/{}'.format(venue_id), headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+    earlier = http_date(parse_date(last_modified) - timedelta(seconds=1))
+    assert client.get('/api/v1/venues/{}'.format(venue_id), headers={'If-Modified-Since': earlier}).status_code == 200
+
+
+def test_a_write_gets_a_fresh_200(database, client):
+    venue_id = add_venue(database, updated_at=utc_now() - timedelta(minutes=5))
+    first = client.get('/api/v1/venues/{}'.format(venue_id))
+
+    venue = database.session.get(Venue, venue_id)
+    venue.name = 'The Dueling Pianos Bar'
+    database.session.commit()
+
+    response = client.get('/api/v1/venues/{}'.format(venue_id), headers={
+        'If-None-Match': first.headers['ETag'],
+        'If-Modified-Since': first.headers['Last-Modified']
+    })
+    assert response.status_code == 200
+    assert response.headers['ETag'] != first.headers['ETag']
+    assert response.get_json()['name'] == 'The Dueling Pianos Bar'
+
+
+def test_a_show_starting_changes_the_page(database, client, new_york):
+    venue_id = add_venue(database, updated_at=utc_now() - timedelta(minutes=5))
+    artist = fyyur.Artist(name='Guns N Petals', city='San Francisco', state='CA', genres=['Rock n Roll'])
+    database.session.add(artist)
+    database.session.flush()
+    # show times are the host's wall-clock time
+    starts = datetime.now().replace(microsecond=0) + timedelta(seconds=2)
+    database.session.add(Show(venue_id=venue_id, artist_id=artist.id, start_time=starts))
+    database.session.commit()
+    time.sleep(max(0, (starts - datetime.now()).total_seconds()) + 1.1)
+
+    response = client.get('/api/v1/venues/{}'.format(venue_id))
+    assert response.status_code == 200
+    assert parse_date(response.headers['Last-Modified']) == starts.astimezone(timezone.utc)
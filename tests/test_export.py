@@ -0,0 +1,55 @@
+import json
+from datetime import datetime
+
+import pytest
+
+import app as fyyur
+from export import export_columns
+from models import Venue
+
+
+def add_venues(db, *descriptions):
+    venues = [Venue(name='Venue {}'.format(i), city='San Francisco', state='CA', address='1 Main St',
+                    genres=['Jazz'], seeking_description=description)
+              for i, description in enumerate(descriptions)]
+    db.session.add_all(venues)
+    db.session.commit()
+    return venues
+
+
+def export(*args):
+    result = fyyur.app.test_cli_runner().invoke(args=['export', 'venues'] + list(args))
+    assert result.exit_code == 0, result.output + result.stderr
+    return result
+
+
+def test_only_catalog_columns_are_exported(database):
+    add_venues(database, None)
+    row = json.loads(export('--format', 'ndjson').stdout)
+    assert set(row) == set(column.name for column in export_columns(Venue))
+    assert not set(row) & {'search_vector', 'version', 'upcoming_shows_count', 'next_show_time'}
+
+
+def test_parquet_columns_that_start_out_null(database, tmp_path):
+    pyarrow_parquet = pytest.importorskip('pyarrow.parquet')
+    # the first batch has no seeking_description, the second one does
+    add_venues(database, None, None, 'Looking for jazz acts on weekends.')
+    path = tmp_path / 'venues.parquet'
+    export('--format', 'parquet', '--output', str(path), '--batch-size', '2')
+
+    table = pyarrow_parquet.read_table(path)
+    assert str(table.schema.field('seeking_description').type) == 'string'
+    assert str(table.schema.field('genres').type.value_type) == 'string'
+    assert table.column('seeking_description').to_pylist() == [None, None, 'Looking for jazz acts on weekends.']
+
+
+def test_since_exports_rows_changed_since(database):
+    venues = add_venues(database, None, None)
+    since = export('--format', 'ndjson').stderr.strip().rsplit(' ', 1)[1]
+    assert datetime.fromisoformat(since) == venues[1].updated_at
+
+    venues[0].name = 'The Musical Hop'
+    database.session.commit()
+    rows = [json.loads(line) for line in export('--format', 'ndjson', '--since', since).stdout.splitlines()]
+    # the last row of the previous run comes again, then the edited one
+    assert [row['name'] for row in rows] == ['Venue 1', 'The Musical Hop']
@@ -0,0 +1,151 @@
+import io
+import os
+import socket
+
+import pytest
+from flask import Flask
+from itsdangerous import URLSafeSerializer
+
+import images
+from images import CheckedRedirectHandler, ImageStore, Thumbnailer, check_host, fetch_image
+
+
+def resolving_to(monkeypatch, *addresses):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET6 if ':' in address else socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, 0))
+                for address in addresses]
+    monkeypatch.setattr(images.socket, 'getaddrinfo', getaddrinfo)
+
+#----------------------------------------------------------------------------#
+# Host checks.
+#----------------------------------------------------------------------------#
+
+@pytest.mark.parametrize('address', ['127.0.0.1', '10.1.2.3', '192.168.0.10', '169.254.169.254', '::1', 'fd00::1'])
+def test_private_addresses_are_refused(monkeypatch, address):
+    resolving_to(monkeypatch, address)
+    with pytest.raises(ValueError, match='private address'):
+        check_host('http://images.example.com/venue.jpg')
+
+
+def test_a_host_with_any_private_address_is_refused(monkeypatch):
+    resolving_to(monkeypatch, '93.184.216.34', '10.0.0.1')
+    with pytest.raises(ValueError):
+        check_host('https://images.example.com/venue.jpg')
+
+
+def test_public_addresses_are_allowed(monkeypatch):
+    resolving_to(monkeypatch, '93.184.216.34', '2606:2800:220:1:248:1893:25c8:1946')
+    check_host('https://images.example.com/venue.jpg')
+
+
+def test_links_without_a_host_are_refused():
+    with pytest.raises(ValueError, match='No host'):
+        check_host('/images/venue.jpg')
+
+
+def test_redirects_are_checked(monkeypatch):
+    resolving_to(monkeypatch, '127.0.0.1')
+    with pytest.raises(ValueError):
+        CheckedRedirectHandler().redirect_request(None, None, 302, 'Found', {}, 'http://localhost/admin')
+
+
+def test_local_files_need_image_fetch_local(tmp_path):
+    path = tmp_path / 'venue.jpg'
+    path.write_bytes(b'\xff\xd8\xff' + b'0' * 100)
+    with pytest.raises(ValueError, match='Cannot fetch'):
+        fetch_image(path.as_uri(), 1024, 1)
+    assert fetch_image(path.as_uri(), 1024, 1, allow_local=True) == path.read_bytes()
+    with pytest.raises(ValueError, match='larger than'):
+        fetch_image(path.as_uri(), 10, 1, allow_local=True)
+
+#----------------------------------------------------------------------------#
+# Signed thumbnail links.
+#----------------------------------------------------------------------------#
+
+@pytest.fixture
+def thumbnailer(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', IMAGE_CACHE_DIR=str(tmp_path / 'store'), IMAGE_FETCH_LOCAL=True)
+    thumbnailer = Thumbnailer(app)
+    scheduled = []
+    thumbnailer.schedule = scheduled.append
+    source = tmp_path / 'venue.png'
+    out = io.BytesIO()
+    Image.new('RGB', (1200, 800), (200, 40, 40)).save(out, 'PNG')
+    source.write_bytes(out.getvalue())
+    with app.test_request_context():
+        yield app, thumbnailer, source.as_uri(), scheduled
+
+
+def test_signed_link_redirects_until_the_thumbnail_is_stored(thumbnailer):
+    app, thumbnailer, src, scheduled = thumbnailer
+    url = thumbnailer.url(src)
+    client = app.test_client()
+
+    response = client.get(url)
+    assert response.status_code == 302
+    assert response.headers['Location'] == src
+    assert scheduled == [src]
+
+    assert thumbnailer.generate(src) == 4
+    response = client.get(url, headers={'Accept': 'image/webp,*/*'})
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert client.get(url).mimetype == 'image/jpeg'
+
+
+@pytest.mark.parametrize('sign', [
+    lambda src: URLSafeSerializer('another key', salt='thumbnail').dumps(src),
+    lambda src: URLSafeSerializer('test', salt='another salt').dumps(src),
+    lambda src: URLSafeSerializer('test', salt='thumbnail').dumps(src)[:-2] + 'xx',
+    lambda src: 'not-a-token'
+])
+def test_links_not_signed_by_the_app_are_not_fetched(thumbnailer, sign):
+    app, thumbnailer, src, scheduled = thumbnailer
+    response = app.test_client().get('/images/tile/{}'.format(sign(src)))
+    assert response.status_code == 404
+    assert scheduled == []
+
+
+def test_unknown_sizes_are_not_found(thumbnailer):
+    app, thumbnailer, src, scheduled = thumbnailer
+    token = thumbnailer.url(src).rsplit('/', 1)[1]
+    assert app.test_client().get('/images/huge/{}'.format(token)).status_code == 404
+
+#----------------------------------------------------------------------------#
+# Eviction.
+#----------------------------------------------------------------------------#
+
+def put(store, size, mtime):
+    digest = store.put_original(os.urandom(size))
+    os.utime(store.path('originals', digest), (mtime, mtime))
+    return digest
+
+
+def test_least_recently_used_files_go_first(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=1000)
+    oldest, older, newer = put(store, 400, 1), put(store, 400, 2), put(store, 400, 3)
+
+    # down to 90% of the bound
+    assert store.evict() == 1
+    assert store.original(oldest) is None
+    assert store.original(older) is not None and store.original(newer) is not None
+
+
+def test_the_store_is_only_walked_once_writes_may_pass_the_bound(tmp_path, monkeypatch):
+    store = ImageStore(str(tmp_path), max_bytes=1000)
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr(images.os, 'walk', lambda root: walks.append(root) or walk(root))
+
+    put(store, 300, 1)
+    assert store.evict() == 0
+    assert len(walks) == 1
+    put(store, 300, 2)
+    put(store, 300, 3)
+    assert store.evict() == 0
+    assert len(walks) == 1
+    put(store, 300, 4)
+    assert store.evict() == 1
+    assert len(walks) == 2
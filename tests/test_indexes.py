@@ -0,0 +1,71 @@
+'''Whether the planner answers the detail-page and name-search queries
+from the indexes made for them.
+
+Needs a scratch Postgres database, whose tables are created and dropped:
+
+    DATABASE_URL=postgresql://localhost/fyyur_test python -m pytest tests/test_indexes.py
+'''
+
+import os
+from datetime import datetime
+
+import pytest
+
+if not os.environ.get('DATABASE_URL', '').startswith(('postgresql://', 'postgres://')):
+    pytest.skip('needs DATABASE_URL pointing at a Postgres database', allow_module_level=True)
+
+from sqlalchemy import func, select
+
+from models import app, db, Artist, Show, Venue
+
+
+@pytest.fixture(scope='module')
+def ids():
+    import synthetic
+    with app.app_context():
+        db.create_all()
+        try:
+            synthetic.generate(2000, seed=0)
+            yield {
+                'venue': db.session.query(Show.venue_id).group_by(Show.venue_id)
+                    .order_by(func.count().desc()).limit(1).scalar(),
+                'artist': db.session.query(Show.artist_id).group_by(Show.artist_id)
+                    .order_by(func.count().desc()).limit(1).scalar()
+            }
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+def plan(statement):
+    # sequential scans are disabled: on a table this small a scan is
+    # cheaper and would hide whether the index can be used at all
+    with db.engine.connect() as connection:
+        with connection.begin() as transaction:
+            connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+            compiled = statement.compile(dialect=connection.dialect)
+            rows = connection.exec_driver_sql('EXPLAIN ' + str(compiled), compiled.params)
+            explained = '\n'.join(row[0] for row in rows)
+            transaction.rollback()
+    return explained
+
+
+def test_shows_of_a_venue_use_the_venue_index(ids):
+    with app.app_context():
+        explained = plan(select(Show.id).where(Show.venue_id == ids['venue'], Show.start_time > datetime.now())
+                         .order_by(Show.start_time))
+    assert 'ix_shows_venue_id_start_time' in explained, explained
+
+
+def test_shows_of_an_artist_use_the_artist_index(ids):
+    with app.app_context():
+        explained = plan(select(Show.id).where(Show.artist_id == ids['artist'], Show.start_time > datetime.now())
+                         .order_by(Show.start_time))
+    assert 'ix_shows_artist_id_start_time' in explained, explained
+
+
+@pytest.mark.parametrize('model, index', [(Venue, 'ix_venue_name_trgm'), (Artist, 'ix_artist_name_trgm')])
+def test_name_searches_use_the_trigram_indexes(ids, model, index):
+    with app.app_context():
+        explained = plan(select(model.id).where(func.lower(model.name).like('%hop%')))
+    assert index in explained, explained
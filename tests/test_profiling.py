@@ -0,0 +1,21 @@
+import pytest
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from models import app
+from profiling import RequestProfile
+
+
+def test_failed_statement_leaves_no_timer_behind(database):
+    with app.test_request_context('/'):
+        g.request_profile = profile = RequestProfile(3)
+        with database.engine.connect() as conn:
+            for _ in range(3):
+                with pytest.raises(DBAPIError):
+                    conn.execute(text('SELECT * FROM no_such_table'))
+            assert conn.info.get('query_start_time') == []
+
+            conn.execute(text('SELECT 1'))
+            assert conn.info['query_start_time'] == []
+        assert profile.query_count == 1
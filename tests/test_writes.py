@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import Artist, IdempotencyKey, Show, Venue
+from writes import Conflict, Invalid, write
+
+
+def add_venue(batch):
+    return batch.create(Venue, name='The Musical Hop', city='San Francisco', state='CA',
+                        address='1015 Folsom Street', genres=['Jazz'])
+
+
+def add_artist(batch):
+    return batch.create(Artist, name='Guns N Petals', city='San Francisco', state='CA', genres=['Rock n Roll'])
+
+
+def test_replayed_key_writes_once(database):
+    first = write(add_venue, 'form-1', 'create_venue_submission')
+    again = write(add_venue, 'form-1', 'create_venue_submission')
+
+    assert first['replayed'] is False
+    assert again['replayed'] is True
+    assert again['created'] == first['created']
+    assert Venue.query.count() == 1
+
+
+def test_key_of_another_form_conflicts(database):
+    write(add_venue, 'form-1', 'create_venue_submission')
+    with pytest.raises(Conflict):
+        write(add_artist, 'form-1', 'create_artist_submission')
+    assert Artist.query.count() == 0
+
+
+def test_failed_write_releases_its_key(database):
+    def broken(batch):
+        batch.create(Show, artist_id=1, venue_id=1, start_time=None)
+
+    with pytest.raises(Invalid) as failed:
+        write(broken, 'form-1', 'create_show_submission')
+    assert database.session.get(IdempotencyKey, 'form-1') is None
+    # the database's message is logged, not sent to clients
+    assert failed.value.detail
+    assert 'detail' not in failed.value.to_dict()
+
+    def create_show(batch):
+        venue, artist = add_venue(batch), add_artist(batch)
+        batch.session.flush()
+        batch.create(Show, artist_id=artist.id, venue_id=venue.id, start_time=datetime.now())
+
+    outcome = write(create_show, 'form-1', 'create_show_submission')
+    assert outcome['replayed'] is False
+    assert Show.query.count() == 1
+
+
+def test_stale_version_conflicts(database):
+    venue_id = write(add_venue)['created'][0]['id']
+    edited = write(lambda batch: batch.update(Venue, venue_id, version=1, name='The Dueling Pianos Bar'))
+    assert edited['updated'] == [{'kind': 'venue', 'id': venue_id, 'version': 2}]
+
+    with pytest.raises(Conflict) as conflict:
+        write(lambda batch: batch.update(Venue, venue_id, version=1, name='Park Square Live Music & Coffee'))
+    assert 'version' in conflict.value.fields
+    assert database.session.get(Venue, venue_id).name == 'The Dueling Pianos Bar'
+
+
+def test_venue_delete_takes_its_shows(database):
+    def create(batch):
+        venue, other, artist = add_venue(batch), add_venue(batch), add_artist(batch)
+        batch.session.flush()
+        for venue_id in (venue.id, venue.id, other.id):
+            batch.create(Show, artist_id=artist.id, venue_id=venue_id, start_time=datetime.now() + timedelta(days=1))
+
+    venue_id, other_id = [entry['id'] for entry in write(create)['created'] if entry['kind'] == 'venue']
+    outcome = write(lambda batch: batch.delete(Venue, venue_id))
+
+    assert outcome['deleted'] == [{'kind': 'venue', 'id': venue_id}]
+    assert database.session.get(Venue, venue_id) is None
+    assert [show.venue_id for show in Show.query.all()] == [other_id]
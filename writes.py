@@ -0,0 +1,223 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.exc import DBAPIError, IntegrityError, SQLAlchemyError
+from sqlalchemy.orm.exc import StaleDataError
+
+from models import app, db, page_cache, Artist, IdempotencyKey, Show, Venue
+
+#----------------------------------------------------------------------------#
+# Errors.
+#----------------------------------------------------------------------------#
+
+class WriteError(Exception):
+    '''A write that was rolled back, described for the user and the logs.
+
+    `status` is the HTTP status to answer with, `code` a stable name for
+    the kind of failure, `fields` the form fields at fault, if known.
+    `detail` is the database's own message; it is for the logs only and
+    is left out of to_dict(), which clients get.
+    '''
+
+    status = 400
+    code = 'write_failed'
+
+    def __init__(self, message, fields=None, detail=None):
+        super(WriteError, self).__init__(message)
+        self.message = message
+        self.fields = fields or {}
+        self.detail = detail
+
+    def to_dict(self):
+        return {
+            'error': self.code,
+            'message': self.message,
+            'fields': self.fields
+        }
+
+
+class NotFound(WriteError):
+    status = 404
+    code = 'not_found'
+
+
+class Conflict(WriteError):
+    status = 409
+    code = 'conflict'
+
+
+class Invalid(WriteError):
+    status = 422
+    code = 'invalid'
+
+
+class Unavailable(WriteError):
+    status = 503
+    code = 'unavailable'
+
+
+def translate(error):
+    '''The WriteError for a database exception raised by a write.'''
+    detail = str(getattr(error, 'orig', None) or error).strip().splitlines()[0]
+    if isinstance(error, StaleDataError):
+        return Conflict('It was changed by someone else meanwhile; reload it and try again.', detail=detail)
+    if isinstance(error, IntegrityError):
+        return Invalid('It refers to a venue or artist that does not exist, or misses a required value.',
+                       detail=detail)
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return Unavailable('The database could not be reached; try again.', detail=detail)
+    return WriteError('The database refused the change.', detail=detail)
+
+#----------------------------------------------------------------------------#
+# Batches.
+#----------------------------------------------------------------------------#
+
+class Batch(object):
+    '''The operations of one write, staged on the request's session.
+
+    Nothing is sent to the database before write() flushes the whole batch,
+    so creates of the same model go out as one multi-row INSERT.
+    '''
+
+    def __init__(self, session):
+        self.session = session
+        self.created = []
+        self.updated = []
+        self.deleted = []
+        # models changed behind the ORM's back, for the page cache
+        self.bulk_changed = set()
+
+    def _get(self, model, id):
+        obj = self.session.get(model, id)
+        if obj is None:
+            raise NotFound('{} {} does not exist.'.format(model.__name__, id))
+        return obj
+
+    def create(self, model, **values):
+        obj = model(**values)
+        obj.create()
+        self.created.append(obj)
+        return obj
+
+    def update(self, model, id, version=None, **values):
+        '''Changes a venue or artist; `version` is the one the change was
+        based on, usually sent back by the edit form.'''
+        obj = self._get(model, id)
+        if version is not None and version != obj.version:
+            raise Conflict('{} {} was changed by someone else since you opened the form; '
+                           'reload it and try again.'.format(model.__name__, id),
+                           fields={'version': ['Is {}, not {}.'.format(obj.version, version)]})
+        for name, value in values.items():
+            setattr(obj, name, value)
+        self.updated.append(obj)
+        return obj
+
+    def delete(self, model, id):
+        obj = self._get(model, id)
+        if model in (Venue, Artist):
+            # their shows go with them, in the same transaction
+            show_fk = Show.venue_id if model is Venue else Show.artist_id
+            if self.session.query(Show).filter(show_fk == id).delete(synchronize_session=False):
+                self.bulk_changed.add(Show.__name__)
+        obj.delete()
+        self.deleted.append((model, id))
+
+    def outcome(self):
+        # after the flush, so that created rows have their ids
+        def describe(obj):
+            entry = {'kind': type(obj).__name__.lower(), 'id': obj.id}
+            if hasattr(obj, 'version'):
+                entry['version'] = obj.version
+            return entry
+
+        return {
+            'created': [describe(obj) for obj in self.created],
+            'updated': [describe(obj) for obj in self.updated],
+            'deleted': [{'kind': model.__name__.lower(), 'id': id} for model, id in self.deleted]
+        }
+
+#----------------------------------------------------------------------------#
+# Writing.
+#----------------------------------------------------------------------------#
+
+def new_idempotency_key():
+    # rendered into every create/edit form (see templates/forms/)
+    return uuid.uuid4().hex
+
+def recorded_outcome(key, scope):
+    record = db.session.get(IdempotencyKey, key)
+    if record is None or record.scope != scope:
+        return None
+    return dict(record.outcome or {}, replayed=True)
+
+def write(work, idempotency_key=None, scope=None):
+    '''Runs `work(batch)` in one transaction and returns what it did.
+
+    The outcome lists the created, updated and deleted rows by kind and id
+    (plus their new version). Any failure rolls the whole batch back and
+    is raised as a WriteError. With an idempotency key, the key is claimed
+    before the work runs: a repeated submit, even a concurrent one that
+    waits on the first, gets the recorded outcome with `replayed` set
+    instead of writing a second time. A key is only recorded when its
+    write commits, so a failed submit can be retried with it.
+    '''
+    session = db.session
+    batch = Batch(session)
+    try:
+        if idempotency_key:
+            replay = recorded_outcome(idempotency_key, scope)
+            if replay is not None:
+                return replay
+            record = IdempotencyKey(key=idempotency_key, scope=scope)
+            session.add(record)
+            try:
+                session.flush()
+            except IntegrityError:
+                session.rollback()
+                replay = recorded_outcome(idempotency_key, scope)
+                if replay is None:
+                    raise Conflict('This form was submitted for something else already; reload it.')
+                return replay
+        work(batch)
+        session.flush()
+        outcome = batch.outcome()
+        if idempotency_key:
+            record.outcome = outcome
+        session.commit()
+    except WriteError:
+        session.rollback()
+        raise
+    except SQLAlchemyError as error:
+        session.rollback()
+        raise translate(error) from error
+    # the ORM flush events only see the objects of the batch
+    for model_name in batch.bulk_changed:
+        page_cache.invalidate(model_name)
+    return dict(outcome, replayed=False)
+
+#----------------------------------------------------------------------------#
+# Templates and CLI.
+#----------------------------------------------------------------------------#
+
+app.jinja_env.globals['idempotency_key'] = new_idempotency_key
+
+writes_cli = AppGroup('writes', help='Maintain the bookkeeping of form writes.')
+
+@writes_cli.command('purge-keys')
+@click.option('--older-than', type=float, help='Hours; defaults to IDEMPOTENCY_KEY_TTL_HOURS.')
+def purge_keys_command(older_than):
+    '''Delete idempotency keys of forms too old to be submitted again.'''
+    hours = older_than if older_than is not None else app.config['IDEMPOTENCY_KEY_TTL_HOURS']
+    purged = IdempotencyKey.query.filter(IdempotencyKey.created_at < datetime.now() - timedelta(hours=hours))\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(json.dumps({'purged': purged}))
+
+app.cli.add_command(writes_cli)
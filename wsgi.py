@@ -0,0 +1,7 @@
+#----------------------------------------------------------------------------#
+# WSGI entry point: gunicorn wsgi:app (settings in gunicorn.conf.py)
+#----------------------------------------------------------------------------#
+
+from app import app, check_secret_key
+
+check_secret_key()